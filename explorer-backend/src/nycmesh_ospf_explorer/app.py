@@ -1,15 +1,85 @@
 import datetime
+import hashlib
+import json
+import math
 import os
+import traceback
+from typing import Callable, Hashable, Optional, Tuple
 
-from flask import Flask, request
+from flask import Flask, Response, abort, request, stream_with_context
 from flask_cors import CORS
+from nycmesh_ospf_explorer.batch import OutageBatchRunner
+from nycmesh_ospf_explorer.cache import LRUCache, SingleFlight
+from nycmesh_ospf_explorer.criticality import CRITICALITY_SORT_KEYS, CriticalityIndex
+from nycmesh_ospf_explorer.fetch import CircuitOpenError, LinkDBFetchError
 from nycmesh_ospf_explorer.graph import OSPFGraph
+from nycmesh_ospf_explorer.refresher import BackgroundRefresher
+from nycmesh_ospf_explorer.store import SnapshotStore
+
+REFRESH_INTERVAL_SECONDS = int(os.environ.get("REFRESH_INTERVAL_SECONDS", 60))
+HISTORY_CACHE_MAX_ENTRIES = int(os.environ.get("HISTORY_CACHE_MAX_ENTRIES", 32))
+HISTORY_CACHE_MAX_MB = int(os.environ.get("HISTORY_CACHE_MAX_MB", 256))
+OUTAGE_BATCH_MAX_SCENARIOS = int(os.environ.get("OUTAGE_BATCH_MAX_SCENARIOS", 256))
+# Worker processes for large outage batches, 0 to always simulate them in the request itself
+OUTAGE_BATCH_WORKERS = int(os.environ.get("OUTAGE_BATCH_WORKERS", 0))
+# How much work (scenarios * routers) each worker needs before a batch is sent to the pool, for
+# /simulate-outages and for the counts behind /criticality, see OutageBatchRunner
+OUTAGE_BATCH_MIN_SCENARIO_ROUTERS_PER_WORKER = int(
+    os.environ.get("OUTAGE_BATCH_MIN_SCENARIO_ROUTERS_PER_WORKER", 250_000)
+)
+OUTAGE_BATCH_MIN_COUNT_ROUTERS_PER_WORKER = int(
+    os.environ.get("OUTAGE_BATCH_MIN_COUNT_ROUTERS_PER_WORKER", 100_000)
+)
+# Set to an empty string to not keep snapshots on disk
+SNAPSHOT_STORE_DIR = os.environ.get(
+    "SNAPSHOT_STORE_DIR", os.path.expanduser("~/.cache/nycmesh-ospf-explorer/snapshots")
+)
+SNAPSHOT_STORE_MAX_MB = int(os.environ.get("SNAPSHOT_STORE_MAX_MB", 512))
+# How far back from the newest index entry every minute is kept, older minutes only keep the
+# newest entry for each stored snapshot
+SNAPSHOT_STORE_INDEX_HOURS = int(os.environ.get("SNAPSHOT_STORE_INDEX_HOURS", 24))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 4096))
+RESPONSE_CACHE_MAX_MB = int(os.environ.get("RESPONSE_CACHE_MAX_MB", 64))
+# The most routers /neighbors returns, however large a searchDistance it's asked for
+NEIGHBORS_MAX_NODES = int(os.environ.get("NEIGHBORS_MAX_NODES", 1000))
 
 app = Flask(__name__)
 CORS(app)
 
+history_graph_cache = LRUCache(
+    HISTORY_CACHE_MAX_ENTRIES,
+    max_size=HISTORY_CACHE_MAX_MB * 1024 * 1024,
+    size_of=lambda graph: graph.estimated_size_bytes(),
+)
+history_graph_loads = SingleFlight()
+# (snapshot version, route & canonicalized arguments) -> (JSON body, ETag)
+response_cache = LRUCache(
+    RESPONSE_CACHE_MAX_ENTRIES,
+    max_size=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+    size_of=lambda entry: len(entry[0]),
+)
+outage_batch_runner = OutageBatchRunner(
+    OUTAGE_BATCH_WORKERS,
+    OUTAGE_BATCH_MIN_SCENARIO_ROUTERS_PER_WORKER,
+    OUTAGE_BATCH_MIN_COUNT_ROUTERS_PER_WORKER,
+)
+criticality_index = CriticalityIndex(outage_batch_runner)
+snapshot_store = None
+if SNAPSHOT_STORE_DIR:
+    try:
+        snapshot_store = SnapshotStore(
+            SNAPSHOT_STORE_DIR,
+            SNAPSHOT_STORE_MAX_MB * 1024 * 1024,
+            datetime.timedelta(hours=SNAPSHOT_STORE_INDEX_HOURS),
+        )
+    except OSError:
+        # e.g. a read-only home directory, the store only saves us time so carry on without it
+        print(f"WARN: Couldn't open the snapshot store at {SNAPSHOT_STORE_DIR}, not using one")
+        traceback.print_exc()
+
 if "FLASK_ENV" in os.environ:
-    global_graph = OSPFGraph()
+    # Don't hold up startup on the API, the refresher loads the link data in the background
+    global_graph = OSPFGraph(load_data=False, store=snapshot_store)
 if os.environ.get("DEBUG") == "true":
     from test_graph import (
         TEST_NINE_NODE_GRAPH,
@@ -21,6 +91,18 @@ if os.environ.get("DEBUG") == "true":
     global_graph.update_link_data(TEST_NINE_NODE_GRAPH)
     # graph.update_link_data(TEST_NINE_NODE_GRAPH_WITH_ASYMMETRIC_COSTS)
     # graph.update_link_data(TEST_REAL_GRAPH_SEP_2023)
+    criticality_index.update(global_graph)
+elif "FLASK_ENV" in os.environ:
+    # Serve the last snapshot we saw (e.g. before a restart) until the first refresh finishes
+    if global_graph.load_latest_from_store():
+        criticality_index.update(global_graph)
+
+    refresher = BackgroundRefresher(
+        global_graph,
+        datetime.timedelta(seconds=REFRESH_INTERVAL_SECONDS),
+        on_refresh=criticality_index.update,
+    )
+    refresher.start(refresh_now=True)
 
 
 def validate_nn(nn: str):
@@ -37,7 +119,26 @@ def validate_nn(nn: str):
 
 @app.route("/neighbors/<router_id>", methods=["GET"])
 def get_neighbors(router_id):
-    neighbor_depth = int(request.args.get("searchDistance", 1))
+    """
+    The routers within searchDistance hops of router_id, or if maxCost is passed, the ones
+    router_id can reach at an OSPF cost of at most maxCost instead
+    """
+    try:
+        neighbor_depth = int(request.args.get("searchDistance", 1))
+    except ValueError:
+        return str(f"Invalid searchDistance: {request.args.get('searchDistance')}"), 400
+    if neighbor_depth < 0:
+        return str(f"Invalid searchDistance: {neighbor_depth}"), 400
+
+    max_cost = None
+    if request.args.get("maxCost"):
+        try:
+            max_cost = int(request.args.get("maxCost"))
+        except ValueError:
+            return str(f"Invalid maxCost: {request.args.get('maxCost')}"), 400
+        if max_cost < 0:
+            return str(f"Invalid maxCost: {max_cost}"), 400
+
     include_egress = request.args.get("includeEgress", "false") == "true"
 
     request_graph = get_request_graph()
@@ -45,24 +146,161 @@ def get_neighbors(router_id):
     if not request_graph.contains_router(router_id):
         return str(f"Couldn't find router with ID: {router_id}"), 404
 
+    def get_neighbors_dict():
+        neighbors_dict = request_graph.get_neighbors_dict(
+            router_id, neighbor_depth, include_egress, NEIGHBORS_MAX_NODES, max_cost
+        )
+
+        # If there were too many routers, only the ones up to this many hops (or this cost)
+        # away are all included
+        if max_cost is not None:
+            neighborhood = request_graph.get_cost_neighborhood(
+                router_id, max_cost, NEIGHBORS_MAX_NODES
+            )
+            neighbors_dict["max_cost_reached"] = neighborhood.radius
+        else:
+            neighborhood = request_graph.get_neighborhood(
+                router_id, neighbor_depth, NEIGHBORS_MAX_NODES
+            )
+            neighbors_dict["search_distance_reached"] = neighborhood.radius
+        neighbors_dict["truncated"] = neighborhood.truncated
+
+        return neighbors_dict
+
+    # A cost search doesn't depend on searchDistance, so those all share one cache entry
+    return get_cached_json_response(
+        request_graph,
+        (
+            "neighbors",
+            router_id,
+            ("cost", max_cost) if max_cost is not None else ("hops", neighbor_depth),
+            include_egress,
+        ),
+        get_neighbors_dict,
+    )
+
+
+@app.errorhandler(LinkDBFetchError)
+def handle_fetch_error(e: LinkDBFetchError):
+    # Only reachable for graphs we have nothing to fall back on (e.g. history), the live graph
+    # keeps serving its last good snapshot while the API is down
+    headers = {}
+    if isinstance(e, CircuitOpenError):
+        headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+    return str(f"Couldn't load link data from the API: {e}"), 503, headers
+
+
+def get_update_metadata(request_graph: OSPFGraph) -> dict:
+    """When request_graph's link data is from, and whether it may be out of date"""
     return {
-        **request_graph.get_neighbors_dict(router_id, neighbor_depth, include_egress=include_egress),
         "updated": int(request_graph.last_updated.timestamp()),
+        "stale": request_graph.is_stale,
     }
 
 
+def get_snapshot_version(request_graph: OSPFGraph) -> Optional[Tuple[bytes, int, bool]]:
+    """
+    Everything about request_graph's snapshot that a response can depend on: its content, and
+    the updated & stale metadata. None if we can't tell its content apart from another's
+    """
+    snapshot = request_graph.snapshot
+    if snapshot.content_digest is None:
+        return None
+
+    return (
+        snapshot.content_digest,
+        int(snapshot.last_updated.timestamp()),
+        request_graph.is_stale,
+    )
+
+
+def get_cached_json_response(
+    request_graph: OSPFGraph, key: Hashable, compute: Callable[[], dict]
+) -> Response:
+    """
+    The JSON response of compute() (with the update metadata added), which must depend only on
+    request_graph's snapshot and key (the route & its canonicalized arguments). Each response
+    is only computed once per snapshot version, and carries a strong ETag of its body, so
+    clients re-polling the same view get an empty 304 until the snapshot changes
+    """
+    version = get_snapshot_version(request_graph)
+    entry = response_cache.get((version, key)) if version is not None else None
+    if entry is None:
+        body = app.json.response({**compute(), **get_update_metadata(request_graph)}).get_data()
+        entry = (body, hashlib.blake2b(body, digest_size=16).hexdigest())
+        if version is not None:
+            response_cache.put((version, key), entry)
+
+    body, etag = entry
+    response = Response(body, mimetype=app.json.mimetype)
+    response.set_etag(etag)
+    # Let clients keep the response, but have them check it's still current every time
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
 def get_request_graph():
-    request_graph = global_graph
     if request.args.get("timestamp"):
-        request_graph = OSPFGraph()
-        request_graph.update_from_timestamp(
-            datetime.datetime.fromtimestamp(int(request.args.get("timestamp")))
-        )
-    else:
-        request_graph.update_if_needed()
+        return get_history_graph(int(request.args.get("timestamp")))
+
+    # The background refresher keeps global_graph up to date, pin the current snapshot so that
+    # the whole request is served from it, even if a refresh is published mid-request
+    request_graph = global_graph.pinned()
+    if not request_graph.has_link_data:
+        abort(Response("Link data hasn't been loaded yet, try again shortly", 503))
 
     return request_graph
 
+
+@app.route("/ready", methods=["GET"])
+def get_ready():
+    """
+    Whether we have link data to serve yet, and if so which snapshot of it is live: when its
+    link data was updated, its content digest, when the API last confirmed it's current, and
+    whether it's stale (i.e. we couldn't refresh it, or haven't yet since starting up)
+    """
+    live_graph = global_graph.pinned()
+    if not live_graph.has_link_data:
+        return {"ready": False}, 503
+
+    snapshot = live_graph.snapshot
+    return {
+        "ready": True,
+        **get_update_metadata(live_graph),
+        "content_digest": snapshot.content_digest.hex() if snapshot.content_digest else None,
+        "last_checked": (
+            int(global_graph.last_checked.timestamp()) if global_graph.last_checked else None
+        ),
+        "stale_since": (
+            int(live_graph.stale_since.timestamp()) if live_graph.stale_since else None
+        ),
+    }
+
+
+def get_history_graph(timestamp: int) -> OSPFGraph:
+    # The history API only has minute granularity, so share one graph for the whole minute
+    minute_timestamp = timestamp - timestamp % 60
+
+    history_graph = history_graph_cache.get(minute_timestamp)
+    if history_graph is None:
+        # If several users open the same minute at once, only fetch & build it one time
+        history_graph = history_graph_loads.do(
+            minute_timestamp, lambda: load_history_graph(minute_timestamp)
+        )
+
+    return history_graph
+
+
+def load_history_graph(minute_timestamp: int) -> OSPFGraph:
+    history_graph = history_graph_cache.get(minute_timestamp)
+    if history_graph is None:
+        history_graph = OSPFGraph(load_data=False, store=snapshot_store)
+        history_graph.update_from_timestamp(datetime.datetime.fromtimestamp(minute_timestamp))
+        history_graph_cache.put(minute_timestamp, history_graph)
+
+    return history_graph
+
+
 @app.route("/simulate-outage", methods=["GET"])
 def simulate_outage():
     request_graph = get_request_graph()
@@ -73,31 +311,182 @@ def simulate_outage():
     nodes = nodes_param.split(",") if nodes_param else []
     edges = [edge_str.split("->") for edge_str in edges_param.split(",")] if edges_param else []
 
+    error = validate_outage_scenario(request_graph, nodes, edges)
+    if error:
+        return error, 400
+
+    # Taking out a->b is the same as taking out b->a, and order doesn't matter, so these all
+    # share one cache entry
+    nodes, edges = OSPFGraph.canonicalize_outage_scenario(nodes, edges)
+    return get_cached_json_response(
+        request_graph,
+        ("simulate-outage", nodes, edges),
+        lambda: request_graph.simulate_outage(list(nodes), [list(edge) for edge in edges]),
+    )
+
+
+def validate_outage_scenario(request_graph: OSPFGraph, nodes: list, edges: list):
     if not nodes and not edges:
-        return str("Must provide at least one of: edges, nodes"), 400
+        return str("Must provide at least one of: edges, nodes")
 
     for node in nodes:
         if not request_graph.contains_router(node):
-            return str(f"Couldn't find router with ID: {node}"), 400
+            return str(f"Couldn't find router with ID: {node}")
 
     for edge in edges:
+        if len(edge) != 2:
+            return str(f"Edges must connect exactly two routers: {edge}")
+
         for router_id in edge:
             if not request_graph.contains_router(router_id):
-                return str(f"Couldn't find router with ID: {router_id}"), 400
+                return str(f"Couldn't find router with ID: {router_id}")
 
         if edge[0] == edge[1]:
-            return str(f"Self loops don't exist"), 400
+            return str(f"Self loops don't exist")
 
         graph_edges = request_graph.get_edges_for_node_pair(edge[0], edge[1])
         if len(graph_edges) == 0:
-            return str(f"Couldn't find edge connecting routers: {edge[0]} & {edge[1]}"), 400
+            return str(f"Couldn't find edge connecting routers: {edge[0]} & {edge[1]}")
+
+    return None
+
+
+@app.route("/simulate-outages", methods=["POST"])
+def simulate_outages():
+    """
+    Simulate a batch of outage scenarios, posted as a JSON body of the form:
+        {"scenarios": [{"nodes": ["10.69.0.1", ...], "edges": [["10.69.0.2", "10.69.0.3"], ...]}]}
+
+    The outage lists for each scenario are streamed back as newline delimited JSON, one line
+    per scenario, in the order they finish. Each line has the position(s) of the scenario in the
+    request, so clients can match them up
+
+    By default (OUTAGE_BATCH_WORKERS=0) scenarios are simulated right here in the request, which
+    is faster than a worker pool for meshes of up to a couple of thousand routers. Set it to
+    spread large batches over that many worker processes instead
+    """
+    request_graph = get_request_graph()
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("scenarios"), list):
+        return str("Must provide a JSON body with a list of scenarios"), 400
+
+    if not body["scenarios"]:
+        return str("Must provide at least one scenario"), 400
+
+    if len(body["scenarios"]) > OUTAGE_BATCH_MAX_SCENARIOS:
+        return str(f"Can't simulate more than {OUTAGE_BATCH_MAX_SCENARIOS} scenarios at once"), 400
+
+    scenarios = []
+    for i, scenario in enumerate(body["scenarios"]):
+        if not isinstance(scenario, dict):
+            return str(f"Scenario {i}: must be an object with nodes and/or edges"), 400
+
+        nodes = scenario.get("nodes", [])
+        edges = scenario.get("edges", [])
+        if not isinstance(nodes, list) or not all(isinstance(node, str) for node in nodes):
+            return str(f"Scenario {i}: nodes must be a list of router IDs"), 400
+
+        if not isinstance(edges, list) or not all(
+            isinstance(edge, list) and all(isinstance(router_id, str) for router_id in edge)
+            for edge in edges
+        ):
+            return str(f"Scenario {i}: edges must be a list of router ID pairs"), 400
+
+        error = validate_outage_scenario(request_graph, nodes, edges)
+        if error:
+            return str(f"Scenario {i}: {error}"), 400
+
+        scenarios.append((nodes, edges))
+
+    update_metadata = get_update_metadata(request_graph)
+
+    def generate_results():
+        for indices, (nodes, edges), outage_lists in outage_batch_runner.run(
+            request_graph, scenarios
+        ):
+            result = {
+                "indices": indices,
+                "nodes": list(nodes),
+                "edges": [list(edge) for edge in edges],
+                "outage_lists": outage_lists,
+                **update_metadata,
+            }
+            yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(generate_results()), mimetype="application/x-ndjson")
+
+
+@app.route("/single-points-of-failure/<router_id>", methods=["GET"])
+def get_single_points_of_failure(router_id):
+    request_graph = get_request_graph()
+
+    if not request_graph.contains_router(router_id):
+        return str(f"Couldn't find router with ID: {router_id}"), 404
 
     return {
-        **request_graph.simulate_outage(nodes, edges),
-        "updated": int(request_graph.last_updated.timestamp()),
+        **request_graph.get_single_points_of_failure(router_id),
+        **get_update_metadata(request_graph),
     }
 
 
+@app.route("/criticality", methods=["GET"])
+def get_criticality():
+    """
+    How many routers would go offline & be rerouted if each single router or link went down,
+    most critical first. Only available for the live graph, not for historical timestamps. The
+    table is worked out in a background thread for each new snapshot, spread over a pool of
+    OUTAGE_BATCH_WORKERS processes if that's set
+    """
+    sort = request.args.get("sort", "offline")
+    if sort not in CRITICALITY_SORT_KEYS:
+        return str(f"Invalid sort, must be one of: {', '.join(CRITICALITY_SORT_KEYS)}"), 400
+
+    try:
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return str(f"Invalid limit: {request.args.get('limit')}"), 400
+
+    if limit < 0:
+        return str(f"Invalid limit, must not be negative: {limit}"), 400
+
+    if not global_graph.has_link_data:
+        return str("Link data hasn't been loaded yet, try again shortly"), 503
+
+    table, is_current = criticality_index.get(global_graph)
+    if table is None:
+        return str("Criticality table is still being computed, try again shortly"), 503
+
+    routers, links = table.top(sort, limit)
+    return {
+        "routers": routers,
+        "links": links,
+        "updated": table.updated,
+        # Either the link data itself, or the table (for older link data, while the one for the
+        # latest is computed) may not match the mesh anymore
+        "stale": global_graph.is_stale or not is_current,
+    }
+
+
+@app.route("/path/<router1_id>/<router2_id>", methods=["GET"])
+def get_path(router1_id, router2_id):
+    """
+    The OSPF path from router1_id to router2_id ("forward"), and the one back ("reverse"), each
+    with the cost of every hop & in total. Either is null if there's no such path
+    """
+    request_graph = get_request_graph()
+
+    for router_id in [router1_id, router2_id]:
+        if not request_graph.contains_router(router_id):
+            return str(f"Couldn't find router with ID: {router_id}"), 404
+
+    return get_cached_json_response(
+        request_graph,
+        ("path", router1_id, router2_id),
+        lambda: request_graph.get_paths_dict(router1_id, router2_id),
+    )
+
+
 @app.route("/edges/<router1_id>/<router2_id>", methods=["GET"])
 def get_edges(router1_id, router2_id):
     request_graph = get_request_graph()
@@ -109,11 +498,14 @@ def get_edges(router1_id, router2_id):
     if router1_id == router2_id:
         return str(f"Self loops don't exist"), 404
 
-    edges = request_graph.get_edges_for_node_pair(router1_id, router2_id)
-    if len(edges) == 0:
-        return str(f"Couldn't find edge connecting routers: {router1_id} & {router2_id}"), 404
+    def compute_edges() -> dict:
+        edges = request_graph.get_edges_for_node_pair(router1_id, router2_id)
+        if len(edges) == 0:
+            # Raised rather than returned, so it isn't cached
+            abort(
+                Response(f"Couldn't find edge connecting routers: {router1_id} & {router2_id}", 404)
+            )
 
-    return {
-        "edges": edges,
-        "updated": int(request_graph.last_updated.timestamp()),
-    }
+        return {"edges": edges}
+
+    return get_cached_json_response(request_graph, ("edges", router1_id, router2_id), compute_edges)
@@ -0,0 +1,233 @@
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from nycmesh_ospf_explorer.graph import GraphSnapshot, OSPFGraph
+
+OutageScenario = Tuple[Tuple[str, ...], Tuple[Tuple[str, str], ...]]
+
+# The snapshot each pool worker runs its scenarios against, set up by _init_worker()
+_worker_graph: Optional[OSPFGraph] = None
+
+
+def _init_worker(pickled_snapshot: bytes):
+    global _worker_graph
+    _worker_graph = OSPFGraph(load_data=False, snapshot=pickle.loads(pickled_snapshot))
+
+
+def _run_worker_scenario(scenario: OutageScenario) -> dict:
+    nodes, edges = scenario
+    return _worker_graph.get_outage_lists(list(nodes), list(edges))
+
+
+def _run_worker_outage_counts(scenarios: List[OutageScenario]) -> List[Tuple[int, int]]:
+    return _worker_graph.get_outage_counts((list(nodes), list(edges)) for nodes, edges in scenarios)
+
+
+def _get_python_executable() -> str:
+    """
+    The interpreter to start worker processes with. Under uWSGI (and other embedded Pythons)
+    sys.executable is the server's own binary, which can't run the multiprocessing start up code,
+    so look for the interpreter that goes with the running Python instead
+    """
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+
+    python_path = os.path.join(
+        sys.exec_prefix, "bin", f"python{sys.version_info.major}.{sys.version_info.minor}"
+    )
+    if os.path.exists(python_path):
+        return python_path
+
+    print(f"WARN: {sys.executable} doesn't look like a Python interpreter, outage workers may fail")
+    return sys.executable
+
+
+def _get_routing_state(snapshot: GraphSnapshot) -> Tuple[Any, ...]:
+    """The parts of a snapshot outage simulations read, see OSPFGraph.outage_snapshot()"""
+    return (
+        snapshot.csr,
+        snapshot.egress_forest,
+        snapshot.egress_return_paths,
+        snapshot.dominator_tree,
+    )
+
+
+class OutageBatchRunner:
+    """
+    Runs many outage scenarios against a single snapshot of the graph, spread over a pool of
+    worker processes, yielding the outage lists for each scenario as soon as it is done (or
+    just counting the routers each one affects, see count())
+
+    Scenarios are canonicalized first (see OSPFGraph.canonicalize_outage_scenario()), so
+    duplicates within a batch are only simulated once. Batches are only sent to the pool when
+    they're big enough (in scenarios times routers) to pay for the round trips to it, the rest
+    are run right here. The pool is kept between batches, and is only started again (handing
+    each worker a trimmed down copy of the snapshot) once the routing of the snapshot changes.
+    With max_workers < 2 there is no pool at all
+
+    Workers are started with forkserver (or spawn) rather than fork, since forking a process
+    with request & refresher threads running could copy a lock while another thread holds it.
+    Under uWSGI they're started with the Python interpreter next to the running one, rather
+    than with sys.executable (the uwsgi binary), see _get_python_executable()
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        min_scenario_routers_per_worker: int = 250_000,
+        min_count_routers_per_worker: int = 100_000,
+    ):
+        self.max_workers = max_workers
+        # How much work (scenarios * routers in the mesh) each worker needs before a batch is
+        # sent to the pool. Against the Sep 2023 snapshot (605 routers), simulating a scenario
+        # with 2 routers & 2 links down takes 0.5-1.2ms here, i.e. 1-2us per router. Lists go
+        # to the pool a scenario at a time, at about 2ms of executor overhead each (the outage
+        # lists themselves pickle in microseconds), so they only pay off from a couple of
+        # thousand routers, where a full batch of 256 scenarios gets 2 workers. Counts go in
+        # one chunk per worker, costing a few ms per batch, so they're worth spreading once each
+        # worker gets ~100ms of work, e.g. a criticality ranking of the Sep 2023 snapshot
+        # (~1,600 scenarios) gets 9
+        self.min_scenario_routers_per_worker = min_scenario_routers_per_worker
+        self.min_count_routers_per_worker = min_count_routers_per_worker
+
+        start_methods = multiprocessing.get_all_start_methods()
+        self._mp_context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in start_methods else "spawn"
+        )
+
+        self._pool_lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # The routing state the pool's workers were handed, see _get_routing_state()
+        self._pool_routing_state: Optional[Tuple[Any, ...]] = None
+
+    def _get_worker_count(
+        self, graph: OSPFGraph, scenario_count: int, min_scenario_routers_per_worker: int
+    ) -> int:
+        scenario_routers = scenario_count * len(graph.snapshot.csr)
+        return max(
+            1, min(self.max_workers, scenario_routers // max(1, min_scenario_routers_per_worker))
+        )
+
+    def _submit(
+        self, graph: OSPFGraph, fn: Callable, args_list: Iterable[Any]
+    ) -> Tuple[ProcessPoolExecutor, List[Future]]:
+        """
+        Submit fn(args) for each of args_list to the pool for graph's snapshot, starting it
+        first if there's no pool yet, or the one we have was handed another snapshot's routing
+        """
+        routing_state = _get_routing_state(graph.snapshot)
+        with self._pool_lock:
+            if self._pool is None or any(
+                state is not pool_state
+                for state, pool_state in zip(routing_state, self._pool_routing_state)
+            ):
+                if self._pool is not None:
+                    # Batches still running on the old pool are left to finish
+                    self._pool.shutdown(wait=False)
+
+                self._mp_context.set_executable(_get_python_executable())
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=self._mp_context,
+                    initializer=_init_worker,
+                    initargs=(pickle.dumps(graph.outage_snapshot()),),
+                )
+                self._pool_routing_state = routing_state
+
+            return self._pool, [self._pool.submit(fn, args) for args in args_list]
+
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        """Drop a pool whose workers died, so the next batch starts a new one"""
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+                self._pool_routing_state = None
+
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._pool_lock:
+            pool, self._pool, self._pool_routing_state = self._pool, None, None
+
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def run(
+        self, graph: OSPFGraph, scenarios: Iterable[Tuple[Iterable[str], Iterable[Tuple[str, str]]]]
+    ) -> Iterator[Tuple[List[int], OutageScenario, dict]]:
+        """
+        Simulate each (nodes, edges) scenario against graph's current snapshot. Yields
+        (indices, canonical scenario, outage lists) in the order scenarios finish, where indices
+        are the positions in scenarios of every scenario which canonicalized to the same one
+        """
+        pinned_graph = graph.pinned()
+        indices_by_scenario: Dict[OutageScenario, List[int]] = {}
+        for i, (nodes, edges) in enumerate(scenarios):
+            scenario = OSPFGraph.canonicalize_outage_scenario(nodes, edges)
+            indices_by_scenario.setdefault(scenario, []).append(i)
+
+        worker_count = self._get_worker_count(
+            pinned_graph, len(indices_by_scenario), self.min_scenario_routers_per_worker
+        )
+        if worker_count == 1:
+            # Not worth the round trips to the pool, run the scenarios right here
+            for scenario, indices in indices_by_scenario.items():
+                nodes, edges = scenario
+                yield indices, scenario, pinned_graph.get_outage_lists(list(nodes), list(edges))
+            return
+
+        pool, futures = self._submit(pinned_graph, _run_worker_scenario, indices_by_scenario)
+        pending = dict(zip(futures, indices_by_scenario))
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    scenario = pending.pop(future)
+                    yield indices_by_scenario[scenario], scenario, future.result()
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+        finally:
+            # If the caller stops early (e.g. the client went away mid-stream), don't keep
+            # simulating scenarios nobody will read
+            for future in pending:
+                future.cancel()
+
+    def count(
+        self, graph: OSPFGraph, scenarios: List[Tuple[List[str], List[Tuple[str, str]]]]
+    ) -> List[Tuple[int, int]]:
+        """
+        The (offline, rerouted) counts for each scenario (see OSPFGraph.get_outage_counts()),
+        in the same order as scenarios. Scenarios are split into one contiguous chunk per worker
+        """
+        pinned_graph = graph.pinned()
+        worker_count = self._get_worker_count(
+            pinned_graph, len(scenarios), self.min_count_routers_per_worker
+        )
+        if worker_count == 1:
+            return pinned_graph.get_outage_counts(scenarios)
+
+        chunk_size = -(-len(scenarios) // worker_count)
+        chunks = [
+            [
+                (tuple(nodes), tuple(tuple(edge) for edge in edges))
+                for nodes, edges in scenarios[start : start + chunk_size]
+            ]
+            for start in range(0, len(scenarios), chunk_size)
+        ]
+
+        pool, futures = self._submit(pinned_graph, _run_worker_outage_counts, chunks)
+        try:
+            return [counts for future in futures for counts in future.result()]
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
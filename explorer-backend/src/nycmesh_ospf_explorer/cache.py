@@ -0,0 +1,134 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+def _no_size(value) -> int:
+    return 0
+
+
+class LRUCache(Generic[V]):
+    """
+    A thread-safe least-recently-used cache, bounded by both the number of entries and the
+    (estimated) total size of the values it holds
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_size: Optional[int] = None,
+        size_of: Callable[[V], int] = _no_size,
+    ):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._size_of = size_of
+
+        self._entries: "OrderedDict[Hashable, V]" = OrderedDict()
+        self._sizes = {}
+        self._total_size = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # Locks can't be pickled, and caches are cheap to refill, so only the limits are kept
+        return {
+            "max_entries": self.max_entries,
+            "max_size": self.max_size,
+            "_size_of": self._size_of,
+        }
+
+    def __setstate__(self, state: dict):
+        self.__init__(state["max_entries"], state["max_size"], state["_size_of"])
+
+    def get(self, key: Hashable, default: Optional[V] = None) -> Optional[V]:
+        with self._lock:
+            if key not in self._entries:
+                return default
+
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: V):
+        size = self._size_of(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            if self.max_size is not None and size > self.max_size:
+                # Never going to fit, don't flush everything else out trying
+                return
+
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._total_size += size
+
+            while len(self._entries) > self.max_entries or (
+                self.max_size is not None and self._total_size > self.max_size
+            ):
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total_size = 0
+
+    def _remove(self, key: Hashable):
+        del self._entries[key]
+        self._total_size -= self._sizes.pop(key)
+
+    @property
+    def total_size(self) -> int:
+        return self._total_size
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight(Generic[V]):
+    """
+    Coalesces concurrent calls which share a key. The first caller for a key runs the function,
+    and every caller which arrives while it is still running waits for, and shares, its result
+    (or exception) instead of repeating the work
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _InFlightCall] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], V]) -> V:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
@@ -0,0 +1,128 @@
+import dataclasses
+import threading
+import traceback
+from typing import List, Optional, Tuple
+
+from nycmesh_ospf_explorer.batch import OutageBatchRunner
+from nycmesh_ospf_explorer.graph import GraphSnapshot, OSPFGraph
+
+CRITICALITY_SORT_KEYS = {
+    "offline": lambda row: (-row["offline"], -row["rerouted"]),
+    "rerouted": lambda row: (-row["rerouted"], -row["offline"]),
+    "impact": lambda row: (-(row["offline"] + row["rerouted"]), -row["offline"]),
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class CriticalityTable:
+    """
+    The N-1 criticality of a snapshot: how many routers would go offline, and how many would be
+    rerouted, if each single router or single (undirected) link in the mesh went down
+    """
+
+    updated: int
+    routers: List[dict]
+    links: List[dict]
+
+    @classmethod
+    def compute(cls, graph: OSPFGraph, runner: OutageBatchRunner) -> "CriticalityTable":
+        router_ids = sorted(graph._graph.nodes)
+        links = sorted({tuple(sorted(edge)) for edge in graph._graph.edges()})
+
+        counts = runner.count(
+            graph,
+            [([router_id], []) for router_id in router_ids] + [([], [link]) for link in links],
+        )
+
+        routers = [
+            {"id": router_id, "offline": offline, "rerouted": rerouted}
+            for router_id, (offline, rerouted) in zip(router_ids, counts)
+        ]
+        links = [
+            {"routers": list(link), "offline": offline, "rerouted": rerouted}
+            for link, (offline, rerouted) in zip(links, counts[len(router_ids) :])
+        ]
+
+        return cls(int(graph.last_updated.timestamp()), routers, links)
+
+    def top(self, sort: str = "offline", limit: Optional[int] = None) -> Tuple[List[dict], ...]:
+        """The (routers, links) rows, most critical first, by one of CRITICALITY_SORT_KEYS"""
+        sort_key = CRITICALITY_SORT_KEYS[sort]
+        return (
+            sorted(self.routers, key=sort_key)[:limit],
+            sorted(self.links, key=sort_key)[:limit],
+        )
+
+
+class CriticalityIndex:
+    """
+    Keeps the CriticalityTable for the latest link data of an OSPFGraph, computing it on a
+    background thread (and across the runner's worker processes) whenever a snapshot with new
+    content is published. Link data re-published without changes keeps its table. While the
+    table for new link data is being computed, get() keeps returning the previous one, marked
+    as not current, rather than nothing at all
+    """
+
+    def __init__(self, runner: OutageBatchRunner):
+        self.runner = runner
+
+        self._lock = threading.Lock()
+        # The latest snapshot we've started computing a table for
+        self._snapshot: Optional[GraphSnapshot] = None
+        # The latest table we've finished computing, and the content digest of its link data
+        self._table: Optional[CriticalityTable] = None
+        self._table_content_digest: Optional[bytes] = None
+
+    def update(self, graph: OSPFGraph):
+        """Start computing the table for graph's current snapshot, unless we already have"""
+        pinned_graph = graph.pinned()
+        snapshot = pinned_graph.snapshot
+        updated = int(snapshot.last_updated.timestamp())
+        with self._lock:
+            if (
+                self._snapshot is not None
+                and self._snapshot.content_digest == snapshot.content_digest
+            ):
+                if (
+                    self._table is not None
+                    and self._table_content_digest == snapshot.content_digest
+                    and self._table.updated < updated
+                ):
+                    # Same routing, only re-published since
+                    self._table = dataclasses.replace(self._table, updated=updated)
+                return
+
+            self._snapshot = snapshot
+
+        threading.Thread(
+            target=self._compute, args=(pinned_graph,), name="ospf-criticality", daemon=True
+        ).start()
+
+    def _compute(self, graph: OSPFGraph):
+        try:
+            table = CriticalityTable.compute(graph, self.runner)
+        except Exception:
+            print("WARN: Computing the N-1 criticality table failed")
+            traceback.print_exc()
+            return
+
+        with self._lock:
+            # Link data with other content may have been published while we were working on
+            # this one, in which case its table is on the way
+            if self._snapshot is graph.snapshot:
+                self._table = table
+                self._table_content_digest = graph.snapshot.content_digest
+
+    def get(self, graph: OSPFGraph) -> Tuple[Optional[CriticalityTable], bool]:
+        """
+        The latest table we have, and whether it's for the content of graph's current snapshot
+        (if not, the one for it is still being computed). None if we don't have any table yet
+        """
+        pinned_graph = graph.pinned()
+        self.update(pinned_graph)
+        with self._lock:
+            is_current = (
+                self._table is not None
+                and self._table_content_digest == pinned_graph.snapshot.content_digest
+            )
+            return self._table, is_current
@@ -0,0 +1,312 @@
+import heapq
+import itertools
+from array import array
+from typing import AbstractSet, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import networkx as nx
+
+
+def link_key(node: int, other_node: int) -> Tuple[int, int]:
+    """A key for the (undirected) link between two nodes, the same for both directions"""
+    return (node, other_node) if node < other_node else (other_node, node)
+
+
+class GraphMask:
+    """
+    A what-if view of a CSRGraph with some nodes, and every edge (in both directions) between
+    some pairs of nodes, taken out. The graph itself is shared and never copied, so a mask only
+    costs memory in proportion to the number of things it excludes. Searches, and the JSON
+    conversion in OSPFGraph, take a mask to run against the masked graph directly
+    """
+
+    def __init__(
+        self,
+        excluded_nodes: AbstractSet[int] = frozenset(),
+        excluded_links: AbstractSet[Tuple[int, int]] = frozenset(),
+    ):
+        self.excluded_nodes: FrozenSet[int] = frozenset(excluded_nodes)
+        self.excluded_links: FrozenSet[Tuple[int, int]] = frozenset(excluded_links)
+
+    @classmethod
+    def from_ids(
+        cls, graph: "CSRGraph", node_ids: Iterable[str], links: Iterable[Tuple[str, str]]
+    ) -> "GraphMask":
+        return cls(
+            {graph.index[node_id] for node_id in node_ids},
+            {link_key(graph.index[link[0]], graph.index[link[1]]) for link in links},
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.excluded_nodes or self.excluded_links)
+
+    def __or__(self, other: "GraphMask") -> "GraphMask":
+        """A mask which excludes everything either of these two does"""
+        return GraphMask(
+            self.excluded_nodes | other.excluded_nodes, self.excluded_links | other.excluded_links
+        )
+
+    def excludes_node(self, node: int) -> bool:
+        return node in self.excluded_nodes
+
+    def excludes_edge(self, node: int, other_node: int) -> bool:
+        """True if the edge(s) from node to other_node are excluded, including by either end"""
+        return (
+            node in self.excluded_nodes
+            or other_node in self.excluded_nodes
+            or link_key(node, other_node) in self.excluded_links
+        )
+
+
+class CSRGraph:
+    """
+    A compact, read-only directed multigraph
+
+    Router IDs are interned to dense integers (in the node order of the graph this was built
+    from), and out-edges are stored in compressed sparse row form: the out-edges of node i are
+    targets[offsets[i]:offsets[i + 1]], with the matching costs in weights. Parallel edges (e.g.
+    from network links) are kept as separate, adjacent entries, in the same order networkx
+    iterates them, so searches here break ties exactly the same way the networkx ones do
+    """
+
+    def __init__(
+        self,
+        node_ids: List[str],
+        offsets: array,
+        targets: array,
+        weights: array,
+    ):
+        self.node_ids = node_ids
+        self.index: Dict[str, int] = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+
+        self._reverse: Optional[CSRGraph] = None
+
+    @classmethod
+    def from_networkx(cls, graph: nx.MultiDiGraph) -> "CSRGraph":
+        node_ids = list(graph.nodes)
+        index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+        offsets = array("l", [0])
+        targets = array("l")
+        weights = array("l")
+        for node_id in node_ids:
+            for other_node_id, edges in graph.adj[node_id].items():
+                for edge_data in edges.values():
+                    targets.append(index[other_node_id])
+                    weights.append(edge_data["weight"])
+            offsets.append(len(targets))
+
+        return cls(node_ids, offsets, targets, weights)
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.index
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.targets)
+
+    def out_edges(self, node: int, mask: GraphMask = None) -> Iterable[Tuple[int, int]]:
+        for i in range(self.offsets[node], self.offsets[node + 1]):
+            if mask is None or not mask.excludes_edge(node, self.targets[i]):
+                yield self.targets[i], self.weights[i]
+
+    def out_degree(self, node: int) -> int:
+        return self.offsets[node + 1] - self.offsets[node]
+
+    def edge_weights(self, node: int, other_node: int) -> List[int]:
+        return [
+            self.weights[i]
+            for i in range(self.offsets[node], self.offsets[node + 1])
+            if self.targets[i] == other_node
+        ]
+
+    def reverse(self) -> "CSRGraph":
+        """
+        The same graph with every edge flipped. Edges are ordered the same way
+        nx.MultiDiGraph.reverse() orders them. Computed once, and shared after that
+        """
+        if self._reverse is None:
+            node_count = len(self.node_ids)
+            in_degrees = [0] * (node_count + 1)
+            for target in self.targets:
+                in_degrees[target + 1] += 1
+
+            offsets = array("l", itertools.accumulate(in_degrees))
+            targets = array("l", bytes(self.targets.itemsize * len(self.targets)))
+            weights = array("l", bytes(self.weights.itemsize * len(self.weights)))
+
+            next_slot = list(offsets[:-1])
+            for node in range(node_count):
+                for i in range(self.offsets[node], self.offsets[node + 1]):
+                    slot = next_slot[self.targets[i]]
+                    targets[slot] = node
+                    weights[slot] = self.weights[i]
+                    next_slot[self.targets[i]] += 1
+
+            self._reverse = CSRGraph(self.node_ids, offsets, targets, weights)
+            self._reverse._reverse = self
+
+        return self._reverse
+
+    def subgraph(self, nodes: Iterable[int]) -> "CSRGraph":
+        """
+        The subgraph induced by the given nodes, which keep their relative order. Note that
+        nodes are re-numbered, use the returned graph's index to look them up by ID
+        """
+        node_set = set(nodes)
+        kept_nodes = [node for node in range(len(self.node_ids)) if node in node_set]
+        new_index = {node: i for i, node in enumerate(kept_nodes)}
+
+        offsets = array("l", [0])
+        targets = array("l")
+        weights = array("l")
+        for node in kept_nodes:
+            for i in range(self.offsets[node], self.offsets[node + 1]):
+                if self.targets[i] in new_index:
+                    targets.append(new_index[self.targets[i]])
+                    weights.append(self.weights[i])
+            offsets.append(len(targets))
+
+        return CSRGraph([self.node_ids[node] for node in kept_nodes], offsets, targets, weights)
+
+    def bfs(self, source: int, max_depth: int, mask: GraphMask = None) -> List[int]:
+        """
+        All nodes reachable from source within max_depth hops, in the order they're discovered
+        """
+        return self.bounded_bfs(source, max_depth, mask=mask)[0]
+
+    def bounded_bfs(
+        self, source: int, max_depth: int, max_nodes: int = None, mask: GraphMask = None
+    ) -> Tuple[List[int], int, bool]:
+        """
+        Like bfs(), but stops once max_nodes nodes have been discovered. Returns the nodes (in
+        the order they're discovered), the depth up to which every reachable node was included,
+        and whether the search was cut short by max_nodes. Only each new frontier is expanded,
+        so the cost is linear in the number of nodes & edges visited, whatever max_depth is
+        """
+        if mask is not None and mask.excludes_node(source):
+            return [], 0, False
+
+        seen = {source}
+        discovered = [source]
+        frontier = [source]
+        depth = 0
+        while depth < max_depth:
+            next_frontier = []
+            for node in frontier:
+                for i in range(self.offsets[node], self.offsets[node + 1]):
+                    other_node = self.targets[i]
+                    if other_node not in seen and (
+                        mask is None or not mask.excludes_edge(node, other_node)
+                    ):
+                        if len(discovered) + len(next_frontier) == max_nodes:
+                            # Out of budget, with nodes left at this depth which didn't fit
+                            discovered.extend(next_frontier)
+                            return discovered, depth, True
+
+                        seen.add(other_node)
+                        next_frontier.append(other_node)
+
+            if not next_frontier:
+                break
+
+            discovered.extend(next_frontier)
+            frontier = next_frontier
+            depth += 1
+
+        return discovered, depth, False
+
+    def dijkstra(
+        self,
+        sources: Iterable[Tuple[int, int]],
+        cutoff: Optional[int] = None,
+        settled: List[int] = None,
+        mask: GraphMask = None,
+    ) -> Tuple[List[Optional[int]], List[int], List[Optional[int]]]:
+        """
+        Multi-source Dijkstra, starting from each (node, initial distance) source pair
+
+        Returns (distance, predecessor, predecessor edge cost) lists indexed by node. Unreached
+        nodes have a distance of None, and sources & unreached nodes have a predecessor of -1.
+        Parallel edges are treated as a single edge with the cheapest of their costs, and ties
+        go to the first path found, both matching the networkx implementation
+
+        If a settled list is passed in, every reached node is appended to it, in the order their
+        distances were finalized. If a mask is passed in, the search runs on the masked graph
+        """
+        if not mask:
+            mask = None
+
+        node_count = len(self.node_ids)
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+
+        dist: List[Optional[int]] = [None] * node_count
+        seen: List[Optional[int]] = [None] * node_count
+        pred = [-1] * node_count
+        pred_weight: List[Optional[int]] = [None] * node_count
+
+        counter = itertools.count()
+        fringe = []
+        for source, source_dist in sources:
+            if mask is not None and mask.excludes_node(source):
+                continue
+
+            if seen[source] is None or source_dist < seen[source]:
+                seen[source] = source_dist
+                heapq.heappush(fringe, (source_dist, next(counter), source))
+
+        while fringe:
+            node_dist, _, node = heapq.heappop(fringe)
+            if dist[node] is not None:
+                continue
+
+            dist[node] = node_dist
+            if settled is not None:
+                settled.append(node)
+
+            i, end = offsets[node], offsets[node + 1]
+            while i < end:
+                other_node = targets[i]
+                weight = weights[i]
+                i += 1
+                while i < end and targets[i] == other_node:
+                    weight = min(weight, weights[i])
+                    i += 1
+
+                if dist[other_node] is not None:
+                    continue
+
+                if mask is not None and mask.excludes_edge(node, other_node):
+                    continue
+
+                other_dist = node_dist + weight
+                if cutoff is not None and other_dist > cutoff:
+                    continue
+
+                if seen[other_node] is None or other_dist < seen[other_node]:
+                    seen[other_node] = other_dist
+                    heapq.heappush(fringe, (other_dist, next(counter), other_node))
+                    pred[other_node] = node
+                    pred_weight[other_node] = weight
+
+        return dist, pred, pred_weight
+
+    def path_from_predecessors(
+        self, pred: List[int], pred_weight: List[Optional[int]], node: int
+    ) -> List[Tuple[str, Optional[int]]]:
+        """
+        Walk a predecessor list (from dijkstra()) back from node to its source, returning the
+        path in source -> node order, with the cost of the edge used to reach each hop
+        """
+        path = []
+        while node != -1:
+            path.append((self.node_ids[node], pred_weight[node]))
+            node = pred[node]
+
+        path.reverse()
+        return path
@@ -0,0 +1,184 @@
+from array import array
+from typing import Dict, Iterable, List, Set, Tuple
+
+from nycmesh_ospf_explorer.csr import CSRGraph, link_key
+from nycmesh_ospf_explorer.spf import ShortestPathTree
+
+
+class DominatorTree:
+    """
+    The dominator tree of the mesh as seen from the internet: X dominates a router if every
+    path that router has to any exit goes through X. So the routers below X in this tree are
+    exactly the ones which lose all egress if X goes down, found with a single subtree lookup
+
+    The tree is computed over the reversed graph, from the same kind of virtual super-exit the
+    egress SPF uses (see compute_egress_spf()), connected to every exit. To also answer this
+    for links, each undirected link gets a midpoint node which every edge between its two
+    routers is routed through, in either direction. Nodes are numbered as: routers (in CSRGraph
+    order), then link midpoints (in the order of links), then the super-exit
+    """
+
+    def __init__(self, csr: CSRGraph, links: List[Tuple[int, int]], tree: ShortestPathTree):
+        self.csr = csr
+        self.links = links
+        self.link_index: Dict[Tuple[int, int], int] = {
+            link: len(csr) + i for i, link in enumerate(links)
+        }
+        self.tree = tree
+
+    @classmethod
+    def compute(cls, csr: CSRGraph, exit_nodes: Iterable[int]) -> "DominatorTree":
+        node_count = len(csr)
+        links = sorted(
+            {
+                link_key(node, other_node)
+                for node in range(node_count)
+                for other_node, _ in csr.out_edges(node)
+            }
+        )
+        link_index = {link: node_count + i for i, link in enumerate(links)}
+        super_exit = node_count + len(links)
+
+        # The reversed graph with link midpoints: if there are edges from a to b, traffic from
+        # a can get out via b, i.e. b -> midpoint -> a here
+        successors: List[List[int]] = [[] for _ in range(super_exit + 1)]
+        successors[super_exit] = sorted(set(exit_nodes))
+        reverse_csr = csr.reverse()
+        for node in range(node_count):
+            for other_node, _ in reverse_csr.out_edges(node):
+                midpoint = link_index[link_key(node, other_node)]
+                if midpoint not in successors[node]:
+                    successors[node].append(midpoint)
+                if other_node not in successors[midpoint]:
+                    successors[midpoint].append(other_node)
+
+        idom = cls._compute_idom(successors, super_exit)
+
+        node_ids = csr.node_ids + [
+            f"{csr.node_ids[link[0]]}-{csr.node_ids[link[1]]}" for link in links
+        ]
+        node_ids.append("0.0.0.0/0")
+        parent = array(
+            "l", (-1 if node == super_exit else idom[node] for node in range(super_exit + 1))
+        )
+
+        # Parents always come before their children in reverse post-order, so a single pass in
+        # that order is enough to fill in the depths
+        depth = array("l", [-1]) * (super_exit + 1)
+        for node in cls._reverse_post_order(successors, super_exit):
+            depth[node] = 0 if node == super_exit else depth[idom[node]] + 1
+
+        tree = ShortestPathTree(
+            node_ids,
+            {node_id: node for node, node_id in enumerate(node_ids)},
+            parent,
+            depth,
+            {super_exit: 0},
+        )
+        return cls(csr, links, tree)
+
+    @staticmethod
+    def _reverse_post_order(successors: List[List[int]], root: int) -> List[int]:
+        post_order = []
+        seen = {root}
+        stack = [(root, iter(successors[root]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child not in seen:
+                    seen.add(child)
+                    stack.append((child, iter(successors[child])))
+                    break
+            else:
+                stack.pop()
+                post_order.append(node)
+
+        post_order.reverse()
+        return post_order
+
+    @staticmethod
+    def _compute_idom(successors: List[List[int]], root: int) -> List[int]:
+        """
+        Immediate dominators, with the iterative algorithm from Cooper, Harvey & Kennedy's
+        "A Simple, Fast Dominance Algorithm". -1 for nodes which can't be reached from root
+        """
+        order = DominatorTree._reverse_post_order(successors, root)
+        rank = {node: i for i, node in enumerate(order)}
+
+        predecessors: Dict[int, List[int]] = {node: [] for node in order}
+        for node in order:
+            for child in successors[node]:
+                predecessors[child].append(node)
+
+        idom = [-1] * len(successors)
+        idom[root] = root
+
+        def intersect(node: int, other_node: int) -> int:
+            while node != other_node:
+                while rank[node] > rank[other_node]:
+                    node = idom[node]
+                while rank[other_node] > rank[node]:
+                    other_node = idom[other_node]
+            return node
+
+        changed = True
+        while changed:
+            changed = False
+            for node in order[1:]:
+                new_idom = -1
+                for predecessor in predecessors[node]:
+                    if idom[predecessor] == -1:
+                        continue
+                    new_idom = predecessor if new_idom == -1 else intersect(predecessor, new_idom)
+
+                if idom[node] != new_idom:
+                    idom[node] = new_idom
+                    changed = True
+
+        return idom
+
+    def _get_tree_nodes(
+        self, router_ids: Iterable[str], links: Iterable[Tuple[str, str]]
+    ) -> List[int]:
+        index = self.csr.index
+        tree_nodes = [index[router_id] for router_id in router_ids if router_id in index]
+        for router1_id, router2_id in links:
+            if router1_id in index and router2_id in index:
+                key = link_key(index[router1_id], index[router2_id])
+                if key in self.link_index:
+                    tree_nodes.append(self.link_index[key])
+
+        return tree_nodes
+
+    def get_dominated_routers(
+        self, router_ids: Iterable[str], links: Iterable[Tuple[str, str]]
+    ) -> Set[str]:
+        """
+        Every router which loses all egress if any one of router_ids or links goes down (not
+        including router_ids themselves). Note that this only covers single failures: routers
+        which lose egress only when several of these go down together aren't included
+        """
+        return {
+            self.csr.node_ids[node]
+            for node in self.tree.subtree_nodes(self._get_tree_nodes(router_ids, links))
+            if node < len(self.csr)
+        }
+
+    def get_single_points_of_failure(
+        self, router_id: str
+    ) -> Tuple[List[str], List[Tuple[str, str]]]:
+        """
+        The (routers, links) which would each take away all of router_id's egress if they went
+        down on their own, nearest first. Empty if router_id has no egress to begin with
+        """
+        routers, links = [], []
+        node = self.tree.parent[self.csr.index[router_id]]
+        while node != -1 and self.tree.parent[node] != -1:
+            if node < len(self.csr):
+                routers.append(self.csr.node_ids[node])
+            else:
+                link = self.links[node - len(self.csr)]
+                links.append((self.csr.node_ids[link[0]], self.csr.node_ids[link[1]]))
+            node = self.tree.parent[node]
+
+        return routers, links
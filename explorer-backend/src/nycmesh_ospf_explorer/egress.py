@@ -0,0 +1,478 @@
+import threading
+from array import array
+from collections import defaultdict
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import networkx as nx
+from nycmesh_ospf_explorer.csr import CSRGraph, GraphMask, link_key
+from nycmesh_ospf_explorer.spf import ShortestPathTree
+
+EXIT_PLACEHOLDER_SUFFIX = "_0.0.0.0/0"
+
+
+def compute_egress_spf(
+    csr: CSRGraph,
+    exit_costs: Iterable[Tuple[int, int]],
+    settled: List[int] = None,
+    mask: GraphMask = None,
+) -> Tuple[List[int], List[Optional[int]]]:
+    """
+    Compute the shortest path from every router to its nearest exit, in a single pass
+
+    This is one Dijkstra run over the reversed graph from a virtual super-source, which is
+    connected to each exit by an edge weighted with that exit's external (0.0.0.0/0) metric.
+    No copies of the graph are made, and no per-node paths are kept. Instead, returns:
+      - parent: the next hop towards the internet for each router. -1 for routers which
+        egress via their own exit, and for routers which can't reach any exit
+      - dist: the total cost to the internet for each router, including the external
+        metric of the exit used. None for routers which can't reach any exit
+
+    If a mask is passed in, this runs against the masked graph instead
+    """
+    dist, parent, _ = csr.reverse().dijkstra(exit_costs, settled=settled, mask=mask)
+    return parent, dist
+
+
+class EgressForest(ShortestPathTree):
+    """
+    The shortest path from every router to the internet, as a forest of trees rooted at the
+    exits (i.e. the shortest path tree of the reversed graph, from the exits). Stored as flat
+    arrays indexed by node (in CSRGraph order), along with precomputed per-node exit, exit cost
+    & depth, so those are O(1) lookups and full exit paths can be built in O(depth) without
+    any recursion:
+      - parent: the next hop towards the internet, -1 for exits egressing via their own
+        default route, and for routers which can't reach any exit
+      - dist: the total cost to the internet, -1 for routers which can't reach any exit
+      - exit_node: the exit at the root of this router's tree, -1 if there isn't one
+      - depth: the number of hops to that exit
+
+    Everything upstream of a router (every router whose path to the internet goes through it)
+    is its subtree, see ShortestPathTree.subtree_nodes()
+    """
+
+    def __init__(
+        self,
+        node_ids: List[str],
+        index: Dict[str, int],
+        parent: array,
+        dist: array,
+        sources: Dict[int, int],
+        settle_rank: array = None,
+        mask: GraphMask = None,
+        exit_node: array = None,
+        depth: array = None,
+    ):
+        super().__init__(node_ids, index, parent, dist, sources, settle_rank, mask)
+
+        if exit_node is not None and depth is not None:
+            self.exit_node = exit_node
+            self.depth = depth
+            return
+
+        node_count = len(node_ids)
+        self.exit_node = array("l", [-1]) * node_count
+        self.depth = array("l", [-1]) * node_count
+
+        for node in range(node_count):
+            if dist[node] == -1 or self.exit_node[node] != -1:
+                continue
+
+            # Walk up to the nearest node we already know the exit of, then fill in the way down
+            path_up = []
+            current_node = node
+            while self.exit_node[current_node] == -1 and parent[current_node] != -1:
+                path_up.append(current_node)
+                current_node = parent[current_node]
+
+            if self.exit_node[current_node] == -1:
+                self.exit_node[current_node] = current_node
+                self.depth[current_node] = 0
+
+            for current_depth, path_node in enumerate(
+                reversed(path_up), start=self.depth[current_node] + 1
+            ):
+                self.exit_node[path_node] = self.exit_node[current_node]
+                self.depth[path_node] = current_depth
+
+    @classmethod
+    def compute(
+        cls, csr: CSRGraph, exit_costs: Iterable[Tuple[int, int]], mask: GraphMask = None
+    ) -> "EgressForest":
+        exit_costs = dict(exit_costs)
+        settled = []
+        parent, dist = compute_egress_spf(csr, exit_costs.items(), settled, mask)
+        return cls(
+            csr.node_ids,
+            csr.index,
+            array("l", parent),
+            array("l", (-1 if node_dist is None else node_dist for node_dist in dist)),
+            exit_costs,
+            cls._get_settle_rank(settled, len(csr)),
+            mask,
+        )
+
+    def without(self, csr: CSRGraph, mask: GraphMask) -> "EgressForest":
+        """
+        The egress forest with everything mask excludes down, repaired from this one (see
+        ShortestPathTree.without()). csr is the graph this forest was computed from
+        """
+        return self._repaired(csr, mask)
+
+    def with_raised_edges(self, csr: CSRGraph, edges: Iterable[Tuple[int, int]]) -> "EgressForest":
+        """
+        The egress forest over csr, a copy of the graph this forest was computed from with the
+        same routers & exits, where only the given (router, next hop) edges were dropped or made
+        more expensive (see ShortestPathTree.with_raised_edges())
+        """
+        # The forest is searched over the reversed graph, where the edge runs next hop -> router
+        cut_nodes = [node for node, next_hop in edges if self.parent[node] == next_hop]
+        return self._repaired(csr, GraphMask(), cut_nodes)
+
+    def _repaired(
+        self, csr: CSRGraph, mask: GraphMask, cut_nodes: Iterable[int] = ()
+    ) -> "EgressForest":
+        parent, dist, mask, affected, reached = self._repair(csr.reverse(), mask, cut_nodes)
+
+        exit_node = array("l", self.exit_node)
+        depth = array("l", self.depth)
+        for node in affected:
+            exit_node[node] = -1
+            depth[node] = -1
+
+        # Nodes are reached after their next hop, so that's always already filled in
+        for node in reached:
+            if parent[node] == -1:
+                exit_node[node] = node
+                depth[node] = 0
+            else:
+                exit_node[node] = exit_node[parent[node]]
+                depth[node] = depth[parent[node]] + 1
+
+        return EgressForest(
+            csr.node_ids,
+            csr.index,
+            parent,
+            dist,
+            self.sources,
+            self.settle_rank,
+            mask,
+            exit_node,
+            depth,
+        )
+
+    @classmethod
+    def from_networkx(cls, egress_forest: nx.DiGraph, csr: CSRGraph = None) -> "EgressForest":
+        """
+        Convert an egress forest in the networkx representation (edges point at the next hop,
+        and each exit points at an "<exit>_0.0.0.0/0" placeholder) into this one. If csr is
+        passed, routers are numbered in its order (with any it has that egress_forest doesn't
+        as unreached), so the result lines up with everything else built over it. Otherwise
+        they're numbered in the order of egress_forest
+        """
+        if csr is not None:
+            node_ids = csr.node_ids
+            index = csr.index
+        else:
+            node_ids = [
+                node_id
+                for node_id in egress_forest
+                if not node_id.endswith(EXIT_PLACEHOLDER_SUFFIX)
+            ]
+            index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+        parent = array("l", [-1]) * len(node_ids)
+        parent_cost = [0] * len(node_ids)
+        # Every router in the forest has an edge out, to its next hop or to its exit placeholder
+        in_forest = [False] * len(node_ids)
+        for node_id, next_hop_id, cost in egress_forest.edges(data="weight"):
+            if node_id not in index:
+                continue
+
+            if next_hop_id in index:
+                parent[index[node_id]] = index[next_hop_id]
+            parent_cost[index[node_id]] = cost
+            in_forest[index[node_id]] = True
+
+        dist = array("l", [-1]) * len(node_ids)
+        for node in range(len(node_ids)):
+            if not in_forest[node]:
+                continue
+
+            path_up = []
+            current_node = node
+            while dist[current_node] == -1 and parent[current_node] != -1:
+                path_up.append(current_node)
+                current_node = parent[current_node]
+
+            if dist[current_node] == -1:
+                dist[current_node] = parent_cost[current_node]
+
+            for path_node in reversed(path_up):
+                dist[path_node] = dist[parent[path_node]] + parent_cost[path_node]
+
+        return cls(
+            node_ids,
+            index,
+            parent,
+            dist,
+            {
+                node: dist[node]
+                for node in range(len(node_ids))
+                if parent[node] == -1 and in_forest[node]
+            },
+        )
+
+    def to_networkx(self) -> nx.DiGraph:
+        egress_forest = nx.DiGraph()
+        for node, node_dist in enumerate(self.dist):
+            if node_dist == -1:
+                continue
+
+            node_id = self.node_ids[node]
+            parent_node = self.parent[node]
+            if parent_node == -1:
+                egress_forest.add_edge(node_id, node_id + EXIT_PLACEHOLDER_SUFFIX, weight=node_dist)
+            else:
+                egress_forest.add_edge(
+                    node_id,
+                    self.node_ids[parent_node],
+                    weight=node_dist - self.dist[parent_node],
+                )
+
+        return egress_forest
+
+    def __contains__(self, router_id: str) -> bool:
+        """True if router_id is in the forest, i.e. it has a way to reach the internet"""
+        node = self.index.get(router_id)
+        return node is not None and self.dist[node] != -1
+
+    def get_upstream_nodes(self, router_ids: Iterable[str]) -> Set[str]:
+        """
+        Every router whose path to the internet goes through any of router_ids (not including
+        those routers themselves, unless one is upstream of another)
+        """
+        return {
+            self.node_ids[node]
+            for node in self.subtree_nodes(
+                self.index[router_id] for router_id in router_ids if router_id in self.index
+            )
+        }
+
+    def has_edge(self, router_id: str, next_hop_id: str) -> bool:
+        node = self.index.get(router_id)
+        next_hop = self.index.get(next_hop_id)
+        return node is not None and next_hop is not None and self.parent[node] == next_hop
+
+    def get_exit_node(self, router_id: str) -> Optional[str]:
+        if router_id not in self:
+            return None
+
+        return self.node_ids[self.exit_node[self.index[router_id]]]
+
+    def get_exit_cost(self, router_id: str) -> Optional[int]:
+        """The external metric of the exit this router uses"""
+        if router_id not in self:
+            return None
+
+        return self.dist[self.exit_node[self.index[router_id]]]
+
+    def get_exit_path(self, router_id: str) -> Optional[List[Tuple[str, Optional[int]]]]:
+        """
+        The path from this router to the internet, with the cost of each hop. The last hop is
+        the "<exit>_0.0.0.0/0" placeholder, with the exit's external metric as its cost
+        """
+        if router_id not in self:
+            return None
+
+        node = self.index[router_id]
+        path = [(router_id, None)]
+        while self.parent[node] != -1:
+            parent_node = self.parent[node]
+            path.append((self.node_ids[parent_node], self.dist[node] - self.dist[parent_node]))
+            node = parent_node
+
+        path.append((self.node_ids[node] + EXIT_PLACEHOLDER_SUFFIX, self.dist[node]))
+        return path
+
+
+class EgressReturnPaths(Mapping):
+    """
+    The path traffic takes from the internet back to each router, i.e. from the exit the router
+    egresses via, back to the router itself, with the cost of each hop. None for routers which
+    don't egress anywhere
+
+    Rather than storing every path, this keeps one shortest path tree per exit which actually
+    carries egress traffic, and builds each path from those trees when it is looked up. That's
+    O(exits x nodes) memory, rather than O(exits x nodes x path length). Trees are only
+    computed the first time a path which needs them is looked up
+
+    The first time it's needed, an inverted index from each router and each (undirected) link
+    to the routers whose return path crosses it is built too, so dependency lookups don't need
+    to scan every path
+    """
+
+    def __init__(
+        self,
+        csr: CSRGraph,
+        exit_by_node: Sequence[int],
+        mask: GraphMask = None,
+        compute_tree: Callable[[int], ShortestPathTree] = None,
+    ):
+        self._csr = csr
+        self._exit_by_node = exit_by_node
+        self._mask = mask
+        self._compute_tree = compute_tree
+        self._trees: Dict[int, ShortestPathTree] = {}
+        self._trees_lock = threading.Lock()
+
+        self._crossing_index: Optional[
+            Tuple[Dict[int, List[int]], Dict[Tuple[int, int], List[int]]]
+        ] = None
+        self._crossing_index_lock = threading.Lock()
+
+    def _get_tree(self, exit_node: int) -> ShortestPathTree:
+        with self._trees_lock:
+            if exit_node not in self._trees:
+                if self._compute_tree is not None:
+                    self._trees[exit_node] = self._compute_tree(exit_node)
+                else:
+                    self._trees[exit_node] = ShortestPathTree.compute(
+                        self._csr, [(exit_node, 0)], self._mask
+                    )
+
+            return self._trees[exit_node]
+
+    def __getstate__(self) -> dict:
+        # Locks can't be pickled, and the trees repaired by without() are computed by a closure,
+        # so only return paths which compute their own trees can be sent to another process
+        if self._compute_tree is not None:
+            raise TypeError("Only EgressReturnPaths which compute their own trees can be pickled")
+
+        state = self.__dict__.copy()
+        del state["_trees_lock"]
+        del state["_crossing_index_lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._trees_lock = threading.Lock()
+        self._crossing_index_lock = threading.Lock()
+
+    def without(self, exit_by_node: Sequence[int], mask: GraphMask) -> "EgressReturnPaths":
+        """
+        The return paths with everything mask excludes down, for routers egressing via the
+        exits in exit_by_node. Each tree is repaired from this one's tree for the same exit
+        (see ShortestPathTree.without()), and only when a path which needs it is looked up
+        """
+        return EgressReturnPaths(
+            self._csr,
+            exit_by_node,
+            compute_tree=lambda exit_node: self._get_tree(exit_node).without(self._csr, mask),
+        )
+
+    def with_raised_edges(
+        self, csr: CSRGraph, exit_by_node: Sequence[int], edges: Iterable[Tuple[int, int]]
+    ) -> "EgressReturnPaths":
+        """
+        The return paths over csr, a copy of the graph these were computed over with the same
+        routers, where only the given edges were dropped or made more expensive, for routers
+        egressing via the exits in exit_by_node. Trees already computed here for exits which
+        are still used are repaired (see ShortestPathTree.with_raised_edges()), the rest are
+        computed when they're first needed, as usual
+        """
+        edges = list(edges)
+        with self._trees_lock:
+            trees = dict(self._trees)
+
+        return_paths = EgressReturnPaths(csr, exit_by_node)
+        for exit_node in set(exit_by_node) & trees.keys():
+            return_paths._trees[exit_node] = trees[exit_node].with_raised_edges(csr, edges)
+
+        return return_paths
+
+    def __getitem__(self, router_id: str) -> Optional[List[Tuple[str, Optional[int]]]]:
+        node = self._csr.index[router_id]
+        exit_node = self._exit_by_node[node]
+        if exit_node == -1:
+            return None
+
+        tree = self._get_tree(exit_node)
+        if tree.dist[node] == -1:
+            # There's a way out, but no way back in (only possible with one-way links)
+            return None
+
+        path = []
+        while node != exit_node:
+            parent_node = tree.parent[node]
+            path.append((self._csr.node_ids[node], tree.dist[node] - tree.dist[parent_node]))
+            node = parent_node
+
+        path.append((self._csr.node_ids[exit_node], None))
+        path.reverse()
+        return path
+
+    def _get_crossing_index(
+        self,
+    ) -> Tuple[Dict[int, List[int]], Dict[Tuple[int, int], List[int]]]:
+        with self._crossing_index_lock:
+            if self._crossing_index is None:
+                routers_by_node = defaultdict(list)
+                routers_by_link = defaultdict(list)
+                for node, exit_node in enumerate(self._exit_by_node):
+                    if exit_node == -1:
+                        continue
+
+                    tree = self._get_tree(exit_node)
+                    if tree.dist[node] == -1:
+                        continue
+
+                    hop = node
+                    while hop != exit_node:
+                        routers_by_node[hop].append(node)
+                        routers_by_link[link_key(hop, tree.parent[hop])].append(node)
+                        hop = tree.parent[hop]
+                    routers_by_node[exit_node].append(node)
+
+                self._crossing_index = (dict(routers_by_node), dict(routers_by_link))
+
+            return self._crossing_index
+
+    def precompute(self):
+        """Compute every tree a lookup could need, and the crossing index, ahead of time"""
+        self._get_crossing_index()
+
+    def get_routers_crossing(
+        self, router_ids: Iterable[str], links: Iterable[Tuple[str, str]]
+    ) -> Set[str]:
+        """
+        Every router whose return path goes through one of router_ids (other than that router
+        itself), or crosses one of links in either direction
+        """
+        routers_by_node, routers_by_link = self._get_crossing_index()
+        index = self._csr.index
+
+        crossing_routers = set()
+        for router_id in router_ids:
+            if router_id in index:
+                node = index[router_id]
+                crossing_routers.update(
+                    router for router in routers_by_node.get(node, []) if router != node
+                )
+
+        for router1_id, router2_id in links:
+            if router1_id in index and router2_id in index:
+                crossing_routers.update(
+                    routers_by_link.get(link_key(index[router1_id], index[router2_id]), [])
+                )
+
+        return {self._csr.node_ids[router] for router in crossing_routers}
+
+    def __contains__(self, router_id) -> bool:
+        return router_id in self._csr.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._csr.node_ids)
+
+    def __len__(self) -> int:
+        return len(self._csr)
@@ -0,0 +1,254 @@
+import dataclasses
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from nycmesh_ospf_explorer.linkdb import STREAM_CHUNK_SIZE_BYTES, LinkDB, LinkDBSource
+
+FETCH_POOL_MAX_CONNECTIONS = 8
+
+FETCH_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("FETCH_CONNECT_TIMEOUT_SECONDS", 3))
+FETCH_READ_TIMEOUT_SECONDS = float(os.environ.get("FETCH_READ_TIMEOUT_SECONDS", 10))
+FETCH_DEADLINE_SECONDS = float(os.environ.get("FETCH_DEADLINE_SECONDS", 20))
+FETCH_MAX_ATTEMPTS = int(os.environ.get("FETCH_MAX_ATTEMPTS", 3))
+FETCH_BACKOFF_SECONDS = float(os.environ.get("FETCH_BACKOFF_SECONDS", 0.5))
+FETCH_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("FETCH_BREAKER_FAILURE_THRESHOLD", 3))
+FETCH_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("FETCH_BREAKER_COOLDOWN_SECONDS", 30))
+
+# Statuses which mean the upstream is struggling (rather than that we asked for something
+# that doesn't exist), so they're worth retrying, and count against its circuit breaker
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LinkDBFetchError(RuntimeError):
+    """Link data couldn't be fetched from the API"""
+
+
+class CircuitOpenError(LinkDBFetchError):
+    """The API has been failing, so we didn't even try to fetch from it"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclasses.dataclass(frozen=True)
+class FetchPolicy:
+    """
+    How long a single fetch may take, and how hard to try. connect_timeout and read_timeout
+    bound each network operation, deadline bounds the whole fetch, across every attempt and
+    the backoff between them (including streaming the body, which a slow server could
+    otherwise drip feed to us one chunk at a time, just inside the read timeout)
+    """
+
+    connect_timeout: float = FETCH_CONNECT_TIMEOUT_SECONDS
+    read_timeout: float = FETCH_READ_TIMEOUT_SECONDS
+    deadline: float = FETCH_DEADLINE_SECONDS
+    max_attempts: int = FETCH_MAX_ATTEMPTS
+    backoff: float = FETCH_BACKOFF_SECONDS
+    breaker_failure_threshold: int = FETCH_BREAKER_FAILURE_THRESHOLD
+    breaker_cooldown: float = FETCH_BREAKER_COOLDOWN_SECONDS
+
+
+class CircuitBreaker:
+    """
+    Stops us from calling an upstream which keeps failing. After failure_threshold failures in
+    a row the breaker opens, and calls fail straight away until cooldown seconds have passed.
+    Then a single call is let through to probe the upstream: if it succeeds the breaker closes
+    again, if it fails the breaker stays open for another cooldown
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        cooldown: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker will let a call through again, 0 if it already would"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(0.0, self._opened_at + self.cooldown - self._clock())
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+
+            if self._probing or self._clock() < self._opened_at + self.cooldown:
+                return False
+
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._probing = False
+
+
+def create_session(pool_max_connections: int = FETCH_POOL_MAX_CONNECTIONS) -> requests.Session:
+    """A session which keeps connections to the API open between fetches, for re-use"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_max_connections, pool_maxsize=pool_max_connections)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _iter_until(chunks: Iterable[bytes], deadline: float) -> Iterator[bytes]:
+    for chunk in chunks:
+        if time.monotonic() > deadline:
+            raise requests.exceptions.ReadTimeout("Deadline passed while reading link data")
+        yield chunk
+
+
+class LinkDBFetcher:
+    """
+    Fetches link data over a persistent, pooled HTTP session, so each poll re-uses an open
+    connection rather than setting up a new one
+
+    If the source of the link data we already have is passed in, the request is made
+    conditional on it (with If-None-Match / If-Modified-Since), and nothing is downloaded or
+    parsed when the server says it hasn't been modified
+
+    Every fetch is bounded by policy (see FetchPolicy): failed attempts are retried with
+    jittered exponential backoff while there's time left, and each host gets a CircuitBreaker,
+    so while the API is down we fail fast instead of tying up a thread for the full deadline.
+    Endpoints of the same host which fail independently of each other can be given breakers of
+    their own, with a breaker_key
+    """
+
+    def __init__(self, session: requests.Session = None, policy: FetchPolicy = None):
+        self.session = session if session is not None else create_session()
+        self.policy = policy if policy is not None else FetchPolicy()
+
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._breakers_lock = threading.Lock()
+
+    def get_breaker(self, url: str, breaker_key: str = None) -> CircuitBreaker:
+        """The breaker for breaker_key, or if there isn't one, for the host of url"""
+        if breaker_key is None:
+            breaker_key = urlsplit(str(url)).netloc
+
+        with self._breakers_lock:
+            if breaker_key not in self._breakers:
+                self._breakers[breaker_key] = CircuitBreaker(
+                    self.policy.breaker_failure_threshold, self.policy.breaker_cooldown
+                )
+            return self._breakers[breaker_key]
+
+    def fetch(
+        self,
+        url: str,
+        previous_source: Optional[LinkDBSource] = None,
+        breaker_key: str = None,
+    ) -> Optional[LinkDB]:
+        """
+        The link data at url, or None if it's unchanged since previous_source was fetched.
+        Raises LinkDBFetchError if it couldn't be fetched within the policy's deadline
+        """
+        url = str(url)
+        deadline = time.monotonic() + self.policy.deadline
+
+        breaker = self.get_breaker(url, breaker_key)
+        if not breaker.allow():
+            retry_after = breaker.retry_after()
+            raise CircuitOpenError(
+                f"Not loading graph data from {url}, it has been failing recently. "
+                f"Retrying in {retry_after:.0f}s",
+                retry_after,
+            )
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                link_db = self._fetch_once(url, previous_source, deadline)
+            except requests.exceptions.HTTPError as e:
+                if e.response.status_code not in RETRYABLE_STATUS_CODES:
+                    # The API is up, we just asked for something it doesn't have
+                    breaker.record_success()
+                    raise LinkDBFetchError(f"Error loading graph data from {url}: {e}") from e
+                error = e
+            except (requests.exceptions.RequestException, ValueError) as e:
+                error = e
+            except Exception:
+                breaker.record_failure()
+                raise
+            else:
+                breaker.record_success()
+                return link_db
+
+            backoff = random.uniform(0, self.policy.backoff * 2 ** (attempt - 1))
+            if attempt >= self.policy.max_attempts or time.monotonic() + backoff >= deadline:
+                breaker.record_failure()
+                raise LinkDBFetchError(
+                    f"Error loading graph data from {url} after {attempt} attempt(s): {error}\n"
+                    "Do you have connectivity to that endpoint?"
+                ) from error
+
+            time.sleep(backoff)
+
+    def _fetch_once(
+        self, url: str, previous_source: Optional[LinkDBSource], deadline: float
+    ) -> Optional[LinkDB]:
+        headers = {}
+        if previous_source is not None and previous_source.url == url:
+            if previous_source.etag:
+                headers["If-None-Match"] = previous_source.etag
+            if previous_source.last_modified:
+                headers["If-Modified-Since"] = previous_source.last_modified
+
+        remaining = deadline - time.monotonic()
+        timeout = (
+            min(self.policy.connect_timeout, remaining),
+            min(self.policy.read_timeout, remaining),
+        )
+        with self.session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 304:
+                # Read the (empty) body, so the connection goes back to the pool
+                response.content
+                return None
+
+            response.raise_for_status()
+            link_db = LinkDB.from_chunks(
+                _iter_until(response.iter_content(STREAM_CHUNK_SIZE_BYTES), deadline)
+            )
+            return dataclasses.replace(
+                link_db,
+                source=LinkDBSource(
+                    url, response.headers.get("ETag"), response.headers.get("Last-Modified")
+                ),
+            )
+
+
+default_fetcher = LinkDBFetcher()
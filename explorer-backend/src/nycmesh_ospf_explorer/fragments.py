@@ -0,0 +1,112 @@
+from typing import Iterable, List, Mapping, Optional, Set, Tuple
+
+import networkx as nx
+from nycmesh_ospf_explorer.csr import CSRGraph
+from nycmesh_ospf_explorer.egress import EgressForest
+from nycmesh_ospf_explorer.utils import compute_nn_from_ip, compute_nn_string_from_ip
+
+
+class NodeFragments:
+    """
+    The parts of each router's JSON output which only depend on the snapshot (its NN, egress
+    paths & networks), along with the JSON for each of its out-edges, built once when the
+    snapshot is published. Converting a subgraph to JSON then only has to work out which of
+    each router's edges stay inside the subgraph, in O(degree) per router
+
+    Fragments are shared between every response built from them, so must never be modified
+    """
+
+    def __init__(
+        self,
+        csr: CSRGraph,
+        nodes: List[dict],
+        networks: List[dict],
+        edges: List[List[Tuple[int, dict]]],
+    ):
+        self.csr = csr
+        self.nodes = nodes
+        self.networks = networks
+        self.edges = edges
+
+    @classmethod
+    def compute(
+        cls,
+        graph: nx.MultiDiGraph,
+        csr: CSRGraph,
+        egress_forest: EgressForest,
+        egress_return_paths: Mapping[str, Optional[List[Tuple[str, Optional[int]]]]],
+    ) -> "NodeFragments":
+        nodes = []
+        networks = []
+        edges = []
+        for node, node_id in enumerate(csr.node_ids):
+            nodes.append(
+                cls.compute_node(
+                    node_id,
+                    egress_forest.get_exit_path(node_id),
+                    egress_return_paths[node_id] if node_id in egress_return_paths else None,
+                )
+            )
+            networks.append(graph.nodes[node_id]["networks"])
+            edges.append(
+                [
+                    (
+                        other_node,
+                        {"from": node_id, "to": csr.node_ids[other_node], "weight": weight},
+                    )
+                    for other_node, weight in csr.out_edges(node)
+                ]
+            )
+
+        return cls(csr, nodes, networks, edges)
+
+    @staticmethod
+    def compute_node(
+        node_id: str,
+        exit_path: Optional[List[Tuple[str, Optional[int]]]],
+        return_path: Optional[List[Tuple[str, Optional[int]]]],
+    ) -> dict:
+        """The JSON for a router, minus the fields which depend on the subgraph it's output in"""
+        node_fragment = {
+            "id": node_id,
+            "nn": None,
+            "nn_int": None,
+            "exit_network_cost": exit_path[-1][1] if exit_path else None,
+            "exit_paths": {
+                "outbound": exit_path[:-1] if exit_path else None,
+                "return": return_path,
+            },
+        }
+
+        try:
+            node_fragment["nn"] = compute_nn_string_from_ip(node_id)
+            node_fragment["nn_int"] = compute_nn_from_ip(node_id)
+        except ValueError:
+            pass
+
+        return node_fragment
+
+    def to_json(
+        self, nodes: Iterable[int], neighbor_set: Set = None, include_networks: bool = True
+    ) -> dict:
+        """The JSON for the subgraph induced by nodes, in graph order"""
+        node_set = set(nodes)
+        output = {"nodes": [], "edges": []}
+
+        for node in sorted(node_set):
+            node_edges = self.edges[node]
+            inside_edges = [edge for other_node, edge in node_edges if other_node in node_set]
+
+            output_node = {
+                **self.nodes[node],
+                "missing_edges": len(node_edges) - len(inside_edges),
+            }
+            if neighbor_set:
+                output_node["in_neighbor_set"] = output_node["id"] in neighbor_set
+            if include_networks:
+                output_node["networks"] = self.networks[node]
+
+            output["nodes"].append(output_node)
+            output["edges"].extend(inside_edges)
+
+        return output
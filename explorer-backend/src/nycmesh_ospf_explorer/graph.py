@@ -1,11 +1,21 @@
+import dataclasses
 import datetime
 import os
-from typing import Dict, List, Optional, Set, Tuple
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple, Union
 
 import networkx as nx
-import requests
 import urlpath
 from dotenv import load_dotenv
+from nycmesh_ospf_explorer.cache import LRUCache, SingleFlight
+from nycmesh_ospf_explorer.csr import CSRGraph, GraphMask
+from nycmesh_ospf_explorer.dominators import DominatorTree
+from nycmesh_ospf_explorer.egress import EgressForest, EgressReturnPaths
+from nycmesh_ospf_explorer.fetch import LinkDBFetcher, LinkDBFetchError, default_fetcher
+from nycmesh_ospf_explorer.fragments import NodeFragments
+from nycmesh_ospf_explorer.linkdb import LinkDB, LinkDBSource, NetworkLSA, RouterLSA
+from nycmesh_ospf_explorer.spf import ShortestPathTree
+from nycmesh_ospf_explorer.store import SnapshotStore
 from nycmesh_ospf_explorer.utils import compute_nn_from_ip, compute_nn_string_from_ip
 
 load_dotenv()
@@ -13,61 +23,579 @@ load_dotenv()
 API_URL = os.environ.get("API_URL", "http://api.andrew.mesh/api/v1/ospf/linkdb")
 HISTORY_API_BASE_URL = (urlpath.URL(API_URL) / "../history").resolve()
 
+# Rough per-node/per-edge memory footprint of a loaded graph, including its egress state and the
+# compacted link data it was built from. Measured with tracemalloc against the Sep 2023 snapshot
+APPROX_BYTES_PER_GRAPH_ELEMENT = 1536
+
+# How many neighborhoods (by hops or by cost) each snapshot keeps, for the routers opened the most
+NEIGHBORHOOD_CACHE_MAX_ENTRIES = int(os.environ.get("NEIGHBORHOOD_CACHE_MAX_ENTRIES", 256))
+# How many single-source shortest path trees each snapshot keeps, for point-to-point paths
+SPF_TREE_CACHE_MAX_ENTRIES = int(os.environ.get("SPF_TREE_CACHE_MAX_ENTRIES", 128))
+
+
+class Neighborhood(NamedTuple):
+    """
+    The routers within some number of hops (or some cost) of a router. If the search ran out of
+    its node budget, truncated is set, and only the routers up to radius hops (or cost) away
+    are all included
+    """
+
+    router_ids: FrozenSet[str]
+    radius: int
+    truncated: bool
+
+
+@dataclasses.dataclass(frozen=True)
+class GraphSnapshot:
+    """
+    Everything we derive from a single load of the OSPF link data. Snapshots are never modified
+    after they are published, so a reader holding one always sees a complete & consistent view
+    of the mesh, even while the next snapshot is being built
+    """
+
+    last_updated: datetime.datetime = datetime.datetime.fromtimestamp(0)
+    routers: Dict[str, RouterLSA] = dataclasses.field(default_factory=dict)
+    networks: Dict[str, NetworkLSA] = dataclasses.field(default_factory=dict)
+    full_graph: nx.MultiDiGraph = dataclasses.field(default_factory=nx.MultiDiGraph)
+    graph: nx.MultiDiGraph = dataclasses.field(default_factory=nx.MultiDiGraph)
+    csr: CSRGraph = dataclasses.field(
+        default_factory=lambda: CSRGraph.from_networkx(nx.MultiDiGraph())
+    )
+    egress_forest: EgressForest = dataclasses.field(
+        default_factory=lambda: EgressForest.from_networkx(nx.DiGraph())
+    )
+    egress_return_paths: EgressReturnPaths = dataclasses.field(
+        default_factory=lambda: EgressReturnPaths(CSRGraph.from_networkx(nx.MultiDiGraph()), [])
+    )
+    dominator_tree: DominatorTree = dataclasses.field(
+        default_factory=lambda: DominatorTree.compute(CSRGraph.from_networkx(nx.MultiDiGraph()), [])
+    )
+    # The snapshot-only parts of each router's JSON output, None to build it all per request
+    node_fragments: Optional[NodeFragments] = None
+    # ("hops" or "cost", router ID, radius, max nodes) -> Neighborhood
+    neighborhoods: LRUCache = dataclasses.field(
+        default_factory=lambda: LRUCache(NEIGHBORHOOD_CACHE_MAX_ENTRIES), compare=False
+    )
+    # (router ID, reverse) -> ShortestPathTree, see OSPFGraph.get_path()
+    spf_trees: LRUCache = dataclasses.field(
+        default_factory=lambda: LRUCache(SPF_TREE_CACHE_MAX_ENTRIES), compare=False
+    )
+    # Where the link data came from (for conditional re-fetches), and a digest of its content
+    source: Optional[LinkDBSource] = None
+    content_digest: Optional[bytes] = None
 
-class OSPFGraph:
-    def __init__(self, load_data=True):
-        self.routers = {}
-        self.networks = {}
-        self.last_updated = datetime.datetime.fromtimestamp(0)
 
-        self._graph = nx.MultiDiGraph()
-        self._egress_forest = nx.DiGraph()
+class OSPFGraph:
+    def __init__(
+        self,
+        load_data=True,
+        snapshot: GraphSnapshot = None,
+        fetcher: LinkDBFetcher = None,
+        stale_since: Optional[datetime.datetime] = None,
+        store: SnapshotStore = None,
+    ):
+        self._snapshot = snapshot if snapshot is not None else GraphSnapshot()
+        self._fetcher = fetcher if fetcher is not None else default_fetcher
+        # Where to save every snapshot we load, and look for them before fetching, if anywhere
+        self._store = store
+        self._update_lock = threading.Lock()
+        self._refresh_flight = SingleFlight()
+        # The last time the API told us our link data is still current
+        self._last_checked = datetime.datetime.fromtimestamp(0)
+        # When we started serving link data the API hasn't confirmed is current (because our
+        # refreshes began failing, or we were warm started from the store), None while it is
+        self._stale_since = stale_since
 
         if load_data:
             self.update_link_data()
 
-    def _update_graph(self):
-        self._graph = nx.MultiDiGraph()
-        for router_id, router in self.routers.items():
-            for other_router in router.get("links", {}).get("router", []):
-                self._graph.add_edge(router_id, other_router["id"], weight=other_router["metric"])
-            is_exit = any(
-                link["id"] == "0.0.0.0/0" for link in router.get("links", {}).get("external", [])
+    @property
+    def snapshot(self) -> GraphSnapshot:
+        return self._snapshot
+
+    @property
+    def routers(self) -> Dict[str, RouterLSA]:
+        return self._snapshot.routers
+
+    @property
+    def networks(self) -> Dict[str, NetworkLSA]:
+        return self._snapshot.networks
+
+    @property
+    def last_updated(self) -> datetime.datetime:
+        return self._snapshot.last_updated
+
+    @property
+    def is_stale(self) -> bool:
+        """
+        True if the last attempt to refresh from the API failed (or there hasn't been one since
+        we were warm started), so the link data we're serving may no longer match the mesh
+        """
+        return self._stale_since is not None
+
+    @property
+    def stale_since(self) -> Optional[datetime.datetime]:
+        return self._stale_since
+
+    @property
+    def last_checked(self) -> Optional[datetime.datetime]:
+        """The last time the API told us our link data is current, None if it never has"""
+        if self._last_checked == datetime.datetime.fromtimestamp(0):
+            return None
+        return self._last_checked
+
+    @property
+    def has_link_data(self) -> bool:
+        return bool(self._snapshot.routers)
+
+    @property
+    def _full_graph(self) -> nx.MultiDiGraph:
+        return self._snapshot.full_graph
+
+    @property
+    def _graph(self) -> nx.MultiDiGraph:
+        return self._snapshot.graph
+
+    @_graph.setter
+    def _graph(self, graph: nx.MultiDiGraph):
+        self._snapshot = dataclasses.replace(
+            self._snapshot,
+            graph=graph,
+            csr=CSRGraph.from_networkx(graph),
+            node_fragments=None,
+            neighborhoods=LRUCache(NEIGHBORHOOD_CACHE_MAX_ENTRIES),
+            spf_trees=LRUCache(SPF_TREE_CACHE_MAX_ENTRIES),
+        )
+
+    @property
+    def _csr(self) -> CSRGraph:
+        return self._snapshot.csr
+
+    @property
+    def _egress_forest(self) -> EgressForest:
+        return self._snapshot.egress_forest
+
+    @_egress_forest.setter
+    def _egress_forest(self, egress_forest: Union[EgressForest, nx.DiGraph]):
+        # Numbered in the order of our CSR graph, which the dominator tree & repairs index by
+        egress_forest = self._as_egress_forest(egress_forest, self._csr)
+        self._snapshot = dataclasses.replace(
+            self._snapshot,
+            egress_forest=egress_forest,
+            dominator_tree=self._build_dominator_tree(self._csr, egress_forest),
+            node_fragments=None,
+        )
+
+    @property
+    def _dominator_tree(self) -> DominatorTree:
+        return self._snapshot.dominator_tree
+
+    @property
+    def _egress_return_paths(self) -> EgressReturnPaths:
+        return self._snapshot.egress_return_paths
+
+    @_egress_return_paths.setter
+    def _egress_return_paths(self, egress_return_paths: EgressReturnPaths):
+        self._snapshot = dataclasses.replace(
+            self._snapshot, egress_return_paths=egress_return_paths, node_fragments=None
+        )
+
+    def pinned(self) -> "OSPFGraph":
+        """
+        Get a read-only OSPFGraph which keeps serving the current snapshot, even if a newer
+        one is published while it is still in use (e.g. for the duration of a request)
+        """
+        return OSPFGraph(
+            load_data=False,
+            snapshot=self._snapshot,
+            fetcher=self._fetcher,
+            stale_since=self._stale_since,
+            store=self._store,
+        )
+
+    def outage_snapshot(self) -> GraphSnapshot:
+        """
+        A copy of the current snapshot with only what get_outage_lists() needs, i.e. without the
+        raw link data or the networkx graphs, to keep it small enough to send to other processes
+        """
+        return dataclasses.replace(
+            self._snapshot,
+            routers={},
+            networks={},
+            full_graph=nx.MultiDiGraph(),
+            graph=nx.MultiDiGraph(),
+            node_fragments=None,
+        )
+
+    @staticmethod
+    def _get_router_links(
+        routers: Dict[str, RouterLSA], networks: Dict[str, NetworkLSA], router_id: str
+    ) -> Tuple[List[Tuple[str, int]], dict]:
+        router = routers[router_id]
+        edges = [
+            (other_router["id"], other_router["metric"])
+            for other_router in router.links.get("router", [])
+        ]
+
+        network_connected_routers = []
+        for network_cidr, cost in router.network_links:
+            for other_router_id in networks[network_cidr].routers:
+                if other_router_id != router_id:
+                    network_connected_routers.append({"id": other_router_id, "metric": cost})
+                    edges.append((other_router_id, cost))
+
+        # The node attributes share the compacted links (which already leave out the network
+        # links), rather than keeping a second copy of them
+        router_networks = router.links
+        if network_connected_routers:
+            # Build a new dict & list, so we don't modify the links we are diffing against later
+            router_networks = {
+                **router_networks,
+                "router": router_networks.get("router", []) + network_connected_routers,
+            }
+
+        return edges, router_networks
+
+    @staticmethod
+    def _build_full_graph(
+        routers: Dict[str, RouterLSA], networks: Dict[str, NetworkLSA]
+    ) -> nx.MultiDiGraph:
+        full_graph = nx.MultiDiGraph()
+        for router_id in routers:
+            edges, router_networks = OSPFGraph._get_router_links(routers, networks, router_id)
+            for other_router_id, weight in edges:
+                full_graph.add_edge(router_id, other_router_id, weight=weight)
+
+            full_graph.add_node(router_id, networks=router_networks)
+
+        OSPFGraph._drop_no_metadata_nodes(full_graph, routers)
+        return full_graph
+
+    @staticmethod
+    def _get_network_referrers(routers: Dict[str, RouterLSA]) -> Dict[str, Set[str]]:
+        """The IDs of the routers which link to each network, by network CIDR"""
+        network_referrers: Dict[str, Set[str]] = {}
+        for router_id, router in routers.items():
+            for network_cidr, _ in router.network_links:
+                network_referrers.setdefault(network_cidr, set()).add(router_id)
+
+        return network_referrers
+
+    @staticmethod
+    def _get_changed_routers(
+        previous_routers: Dict[str, RouterLSA],
+        previous_networks: Dict[str, NetworkLSA],
+        routers: Dict[str, RouterLSA],
+        networks: Dict[str, NetworkLSA],
+    ) -> Set[str]:
+        """
+        Find the routers which need to be re-ingested to bring a graph built from the previous
+        link data up to date. That is routers whose own LSA changed, routers which link to a
+        router that appeared or disappeared, and the routers attached to (or linking to) a
+        network which changed, or which lists a router that appeared or disappeared
+        """
+        changed_routers = {
+            router_id
+            for router_id in previous_routers.keys() | routers.keys()
+            if router_id not in previous_routers
+            or router_id not in routers
+            or previous_routers[router_id].digest != routers[router_id].digest
+        }
+
+        changed_networks = {
+            network_cidr
+            for network_cidr in previous_networks.keys() | networks.keys()
+            if network_cidr not in previous_networks
+            or network_cidr not in networks
+            or previous_networks[network_cidr].digest != networks[network_cidr].digest
+        }
+
+        added_or_removed = previous_routers.keys() ^ routers.keys()
+        if added_or_removed:
+            for router_id, router in routers.items():
+                if any(
+                    other_router["id"] in added_or_removed
+                    for other_router in router.links.get("router", [])
+                ):
+                    changed_routers.add(router_id)
+
+            # Networks only lead to routers which have an LSA, so one appearing or disappearing
+            # changes the edges of every network listing it, even if the network didn't change
+            for network_entries in (previous_networks, networks):
+                changed_networks.update(
+                    network_cidr
+                    for network_cidr, network in network_entries.items()
+                    if not added_or_removed.isdisjoint(network.routers)
+                )
+
+        if changed_networks:
+            # A router's edges come from every network it links to, whether or not the network
+            # lists it as attached, so those routers need re-ingesting too
+            for router_entries in (previous_routers, routers):
+                network_referrers = OSPFGraph._get_network_referrers(router_entries)
+                for network_cidr in changed_networks:
+                    changed_routers.update(network_referrers.get(network_cidr, ()))
+
+            for network_entries in (previous_networks, networks):
+                for network_cidr in changed_networks:
+                    if network_cidr in network_entries:
+                        changed_routers.update(network_entries[network_cidr].routers)
+
+        return changed_routers
+
+    @staticmethod
+    def _patch_full_graph(
+        full_graph: nx.MultiDiGraph,
+        changed_routers: Set[str],
+        routers: Dict[str, RouterLSA],
+        networks: Dict[str, NetworkLSA],
+    ) -> Set[str]:
+        """
+        Re-ingest the given routers into full_graph in place. Returns the subset of them whose
+        edges or exit costs changed, i.e. the ones that could have changed the egress state
+        """
+        routing_changed_routers = set()
+        dropped_nodes = set()
+        for router_id in changed_routers:
+            if router_id not in routers:
+                if router_id in full_graph:
+                    full_graph.remove_node(router_id)
+                    routing_changed_routers.add(router_id)
+                continue
+
+            edges, router_networks = OSPFGraph._get_router_links(routers, networks, router_id)
+            dropped_nodes.update(
+                other_router_id for other_router_id, _ in edges if other_router_id not in routers
+            )
+            edges = [
+                (other_router_id, weight)
+                for other_router_id, weight in edges
+                if other_router_id in routers
+            ]
+
+            if router_id in full_graph:
+                previous_edges = [
+                    (other_router_id, edge_data["weight"])
+                    for _, other_router_id, edge_data in full_graph.out_edges(router_id, data=True)
+                ]
+                previous_exit_cost = OSPFGraph._get_exit_cost(full_graph.nodes[router_id])
+            else:
+                previous_edges = None
+                previous_exit_cost = None
+
+            if previous_edges is None or sorted(previous_edges) != sorted(edges):
+                if previous_edges:
+                    full_graph.remove_edges_from(list(full_graph.out_edges(router_id, keys=True)))
+                for other_router_id, weight in edges:
+                    full_graph.add_edge(router_id, other_router_id, weight=weight)
+                routing_changed_routers.add(router_id)
+
+            full_graph.add_node(router_id, networks=router_networks)
+            if previous_exit_cost != OSPFGraph._get_exit_cost(full_graph.nodes[router_id]):
+                routing_changed_routers.add(router_id)
+
+        if dropped_nodes:
+            print(
+                f"WARN: Dropped the following nodes {sorted(dropped_nodes)} becauase we didn't find router entries for them. "
+                f"However, they appeared as links from other nodes. Check OSPF DB consistency."
             )
 
-            network_connected_routers = []
-            for network_link_info in router.get("links", {}).get("network", []):
-                network_cidr = network_link_info["id"]
-                cost = network_link_info["metric"]
-                for other_router_id in self.networks[network_cidr]["routers"]:
-                    if other_router_id != router_id:
-                        network_connected_routers.append({"id": other_router_id, "metric": cost})
-                        self._graph.add_edge(router_id, other_router_id, weight=cost)
+        return routing_changed_routers
 
-            networks = router.get("links").copy()
-            if "network" in networks:
-                del networks["network"]
+    @staticmethod
+    def _build_snapshot(
+        link_data: Union[dict, LinkDB], previous_snapshot: Optional[GraphSnapshot] = None
+    ) -> GraphSnapshot:
+        """
+        Build the snapshot for the given link data (either the parsed JSON document, or its
+        compacted form), off to the side of any published snapshot. The raw document is never
+        kept, only the compacted routers & networks are
+
+        If previous_snapshot is provided, only the difference between its link data and the new
+        link data is applied to a copy of its graph. The previous egress state is re-used
+        whenever the routing of the largest connected component is unaffected by that
+        difference, and repaired when links were only dropped or made more expensive (see
+        _repair_egress_state()). Otherwise, e.g. for new or cheaper links, it is recomputed for
+        the whole component. The per-router JSON fragments are always rebuilt
+        """
+        if not isinstance(link_data, LinkDB):
+            link_data = LinkDB.from_json(link_data)
+
+        last_updated = datetime.datetime.fromtimestamp(link_data.updated)
+        routers = link_data.routers
+        networks = link_data.networks
+        link_data_fields = {
+            "source": link_data.source,
+            "content_digest": link_data.get_content_digest(),
+        }
 
-            if network_connected_routers:
-                networks["router"] = networks.get("router", [])
-                networks["router"].extend(network_connected_routers)
+        if previous_snapshot is None or len(previous_snapshot.full_graph) == 0:
+            full_graph = OSPFGraph._build_full_graph(routers, networks)
+            return dataclasses.replace(
+                OSPFGraph._build_snapshot_from_full_graph(
+                    last_updated, routers, networks, full_graph
+                ),
+                **link_data_fields,
+            )
 
-            self._graph.add_node(router_id, networks=networks)
+        if previous_snapshot.content_digest == link_data_fields["content_digest"]:
+            # Nothing in the OSPF DB changed, it has just been re-published since. Keep all of
+            # the previous state, without even looking for what changed
+            return dataclasses.replace(
+                previous_snapshot, last_updated=last_updated, **link_data_fields
+            )
 
-        self._drop_no_metadata_nodes()
+        changed_routers = OSPFGraph._get_changed_routers(
+            previous_snapshot.routers, previous_snapshot.networks, routers, networks
+        )
+        if not changed_routers:
+            return dataclasses.replace(
+                previous_snapshot,
+                last_updated=last_updated,
+                routers=routers,
+                networks=networks,
+                **link_data_fields,
+            )
+
+        # Copy-on-write, readers may still be holding on to the previous snapshot
+        full_graph = previous_snapshot.full_graph.copy()
+        routing_changed_routers = OSPFGraph._patch_full_graph(
+            full_graph, changed_routers, routers, networks
+        )
+
+        return dataclasses.replace(
+            OSPFGraph._build_snapshot_from_full_graph(
+                last_updated,
+                routers,
+                networks,
+                full_graph,
+                previous_snapshot,
+                routing_changed_routers,
+            ),
+            **link_data_fields,
+        )
 
+    @staticmethod
+    def _build_snapshot_from_full_graph(
+        last_updated: datetime.datetime,
+        routers: Dict[str, RouterLSA],
+        networks: Dict[str, NetworkLSA],
+        full_graph: nx.MultiDiGraph,
+        previous_snapshot: Optional[GraphSnapshot] = None,
+        routing_changed_routers: Set[str] = None,
+    ) -> GraphSnapshot:
         # Get only the largest connected component
-        largest_connected = max(nx.connected_components(self._graph.to_undirected()), key=len)
-        self._graph = self._graph.subgraph(largest_connected).copy()
-        self._egress_forest = self._compute_egress_forest(self._graph)
-        self._egress_return_paths = self._compute_egress_return_paths(
-            self._graph, self._egress_forest
+        largest_connected = OSPFGraph._get_largest_connected_component(full_graph)
+        if len(largest_connected) == len(full_graph):
+            graph = full_graph
+        else:
+            graph = full_graph.subgraph(largest_connected).copy()
+
+        egress_state = None
+        if previous_snapshot is not None and largest_connected == set(
+            previous_snapshot.graph.nodes
+        ):
+            component_changed_routers = [
+                router_id for router_id in routing_changed_routers if router_id in largest_connected
+            ]
+            if not component_changed_routers:
+                egress_state = (
+                    previous_snapshot.csr,
+                    previous_snapshot.egress_forest,
+                    previous_snapshot.egress_return_paths,
+                    previous_snapshot.dominator_tree,
+                )
+            else:
+                egress_state = OSPFGraph._repair_egress_state(
+                    graph, previous_snapshot, component_changed_routers
+                )
+
+        if egress_state is not None:
+            csr, egress_forest, egress_return_paths, dominator_tree = egress_state
+        else:
+            csr = CSRGraph.from_networkx(graph)
+            egress_forest = OSPFGraph._build_egress_forest(graph, csr)
+            egress_return_paths = OSPFGraph._compute_egress_return_paths(graph, egress_forest, csr)
+            dominator_tree = OSPFGraph._build_dominator_tree(csr, egress_forest)
+
+        # The networks of each router may have changed even if the routing hasn't
+        node_fragments = NodeFragments.compute(graph, csr, egress_forest, egress_return_paths)
+
+        return GraphSnapshot(
+            last_updated=last_updated,
+            routers=routers,
+            networks=networks,
+            full_graph=full_graph,
+            graph=graph,
+            csr=csr,
+            egress_forest=egress_forest,
+            egress_return_paths=egress_return_paths,
+            dominator_tree=dominator_tree,
+            node_fragments=node_fragments,
+        )
+
+    @staticmethod
+    def _repair_egress_state(
+        graph: nx.MultiDiGraph, previous_snapshot: GraphSnapshot, changed_routers: List[str]
+    ) -> Optional[Tuple[CSRGraph, EgressForest, EgressReturnPaths, DominatorTree]]:
+        """
+        The egress state for graph, repaired from previous_snapshot's rather than recomputed,
+        when graph has the same routers & exits as its graph, and the edges out of
+        changed_routers were only dropped or made more expensive. Paths can only get longer
+        then, so only the routers whose egress or return path used one of those edges are
+        recomputed. None when that isn't the case, and the state needs recomputing in full
+        """
+        csr = CSRGraph.from_networkx(graph)
+        previous_csr = previous_snapshot.csr
+        if csr.node_ids != previous_csr.node_ids:
+            return None
+
+        previous_egress_forest = previous_snapshot.egress_forest
+        if dict(OSPFGraph._get_exit_costs(graph, csr)) != previous_egress_forest.sources:
+            return None
+
+        raised_edges = []
+        links_changed = False
+        for router_id in changed_routers:
+            node = csr.index[router_id]
+            previous_weights: Dict[int, int] = {}
+            for other_node, weight in previous_csr.out_edges(node):
+                previous_weights[other_node] = min(weight, previous_weights.get(other_node, weight))
+            weights: Dict[int, int] = {}
+            for other_node, weight in csr.out_edges(node):
+                weights[other_node] = min(weight, weights.get(other_node, weight))
+
+            for other_node in previous_weights.keys() | weights.keys():
+                previous_weight = previous_weights.get(other_node)
+                weight = weights.get(other_node)
+                if weight is not None and (previous_weight is None or weight < previous_weight):
+                    # A new or cheaper edge can shorten paths anywhere downstream of it
+                    return None
+                if previous_weight is not None and (weight is None or weight > previous_weight):
+                    raised_edges.append((node, other_node))
+                    links_changed = links_changed or weight is None
+
+        egress_forest = previous_egress_forest.with_raised_edges(csr, raised_edges)
+        egress_return_paths = previous_snapshot.egress_return_paths.with_raised_edges(
+            csr, egress_forest.exit_node, raised_edges
         )
 
-    def _drop_no_metadata_nodes(self):
-        nodes_to_drop = [node for node in self._graph.nodes if node not in self.routers]
+        if links_changed:
+            dominator_tree = OSPFGraph._build_dominator_tree(csr, egress_forest)
+        else:
+            # Dominators only depend on which links there are, not what they cost
+            previous_dominator_tree = previous_snapshot.dominator_tree
+            dominator_tree = DominatorTree(
+                csr, previous_dominator_tree.links, previous_dominator_tree.tree
+            )
+
+        return csr, egress_forest, egress_return_paths, dominator_tree
+
+    @staticmethod
+    def _drop_no_metadata_nodes(graph: nx.MultiDiGraph, routers: Dict[str, RouterLSA]):
+        nodes_to_drop = [node for node in graph.nodes if node not in routers]
         for node in nodes_to_drop:
-            self._graph.remove_node(node)
+            graph.remove_node(node)
 
         if nodes_to_drop:
             print(
@@ -76,119 +604,223 @@ class OSPFGraph:
             )
 
     @staticmethod
-    def _create_graph_with_exit_placeholders_from_graph(
-        graph: nx.MultiDiGraph,
-    ) -> Tuple[nx.MultiDiGraph, Set[Tuple[str, dict]]]:
-        graph_with_exit_placeholders: nx.MultiDiGraph = graph.copy()
-
-        exit_placeholders = set()
-        nodes_with_exit = [
-            node
-            for node in graph.nodes.data()
-            if any(
-                network["id"] == "0.0.0.0/0"
-                for network in node[1].get("networks", {}).get("external", [])
-            )
-        ]
+    def _get_largest_connected_component(graph: nx.MultiDiGraph) -> Set[str]:
+        return max(nx.weakly_connected_components(graph), key=len)
 
-        for node in nodes_with_exit:
-            external_costs = {
-                link["id"]: link.get("metric") if "metric" in link else link.get("metric2")
-                for link in node[1].get("networks", {}).get("external", [])
-            }
-            direct_exit_cost = external_costs.get("0.0.0.0/0")
-            if direct_exit_cost is not None:
-                graph_with_exit_placeholders.add_node(node[0] + "_0.0.0.0/0")
-                graph_with_exit_placeholders.add_edge(
-                    node[0],
-                    node[0] + "_0.0.0.0/0",
-                    weight=direct_exit_cost,
-                )
-                graph_with_exit_placeholders.add_edge(
-                    node[0] + "_0.0.0.0/0",
-                    node[0],
-                    weight=direct_exit_cost,
-                )
-                exit_placeholders.add(node[0] + "_0.0.0.0/0")
+    @staticmethod
+    def _get_exit_cost(node_data: dict) -> Optional[int]:
+        for link in node_data.get("networks", {}).get("external", []):
+            if link["id"] == "0.0.0.0/0":
+                return link.get("metric") if "metric" in link else link.get("metric2")
 
-        return graph_with_exit_placeholders, exit_placeholders
+        return None
 
     @staticmethod
-    def _compute_egress_forest(graph: nx.MultiDiGraph) -> nx.DiGraph:
-        (
-            graph_with_exit_placeholders,
-            exit_placeholders,
-        ) = OSPFGraph._create_graph_with_exit_placeholders_from_graph(graph)
-        graph_with_exit_placeholders = graph_with_exit_placeholders.reverse()
-
-        paths = nx.algorithms.multi_source_dijkstra_path(
-            graph_with_exit_placeholders, exit_placeholders
-        )
+    def _get_exit_costs(graph: nx.MultiDiGraph, csr: CSRGraph) -> List[Tuple[int, int]]:
+        """
+        The (node, external metric) pairs of every router with a default route to the internet
+        """
+        exit_costs = []
+        for node_id, node_data in graph.nodes.data():
+            exit_cost = OSPFGraph._get_exit_cost(node_data)
+            if exit_cost is not None:
+                exit_costs.append((csr.index[node_id], exit_cost))
 
-        egress_forest = nx.DiGraph()
-        for node_id, egress_path in paths.items():
-            if len(egress_path) > 1:
-                egress_forest.add_edge(
-                    node_id,
-                    egress_path[-2],
-                    weight=min(
-                        edge[1]["weight"]
-                        for edge in graph_with_exit_placeholders[egress_path[-2]][node_id].items()
-                    ),
-                )
+        return exit_costs
+
+    @staticmethod
+    def _build_egress_forest(graph: nx.MultiDiGraph, csr: CSRGraph = None) -> EgressForest:
+        if csr is None:
+            csr = CSRGraph.from_networkx(graph)
+
+        return EgressForest.compute(csr, OSPFGraph._get_exit_costs(graph, csr))
+
+    @staticmethod
+    def _build_dominator_tree(csr: CSRGraph, egress_forest: EgressForest) -> DominatorTree:
+        # The roots of the egress forest are the exits
+        return DominatorTree.compute(csr, egress_forest.sources)
+
+    @staticmethod
+    def _compute_egress_forest(graph: nx.MultiDiGraph, csr: CSRGraph = None) -> nx.DiGraph:
+        return OSPFGraph._build_egress_forest(graph, csr).to_networkx()
+
+    @staticmethod
+    def _as_egress_forest(
+        egress_forest: Union[EgressForest, nx.DiGraph], csr: CSRGraph = None
+    ) -> EgressForest:
+        if isinstance(egress_forest, nx.DiGraph):
+            return EgressForest.from_networkx(egress_forest, csr)
+
+        if csr is not None and egress_forest.node_ids is not csr.node_ids:
+            if egress_forest.node_ids != csr.node_ids:
+                # Built over another graph, or with its routers in another order
+                return EgressForest.from_networkx(egress_forest.to_networkx(), csr)
 
         return egress_forest
 
     @staticmethod
     def _compute_egress_return_paths(
         graph: nx.MultiDiGraph,
-        egress_forest: nx.DiGraph,
-    ) -> Dict[str, List[Tuple[str, Optional[int]]]]:
-        nodes_with_exit = [
-            node[0]
-            for node in graph.nodes.data()
-            if any(
-                network["id"] == "0.0.0.0/0"
-                for network in node[1].get("networks", {}).get("external", [])
-            )
-        ]
-
-        shortest_paths_by_exit_node = {
-            exit_node: nx.algorithms.single_source_dijkstra_path(graph, exit_node)
-            for exit_node in nodes_with_exit
-        }
+        egress_forest: Union[EgressForest, nx.DiGraph],
+        csr: CSRGraph = None,
+    ) -> EgressReturnPaths:
+        if csr is None:
+            csr = CSRGraph.from_networkx(graph)
 
-        egreess_return_paths = {}
-        for node in graph:
-            egress_path = OSPFGraph._get_exit_path_for_node(egress_forest, node)
-            if egress_path is not None:
-                exit_node_used = egress_path[-2][0]  # -1 is the exit placeholder, -2 is exit node
-                egress_return_path = shortest_paths_by_exit_node[exit_node_used][node]
-                egress_return_path_with_costs = [(egress_return_path[0], None)] + [
-                    (node2, min(edge["weight"] for edge in graph[node1][node2].values()))
-                    for node1, node2 in zip(egress_return_path, egress_return_path[1:])
-                ]
-                egreess_return_paths[node] = egress_return_path_with_costs
-            else:
-                egreess_return_paths[node] = None
+        egress_forest = OSPFGraph._as_egress_forest(egress_forest, csr)
+        exit_by_node = []
+        for node_id in csr.node_ids:
+            exit_node_id = egress_forest.get_exit_node(node_id)
+            exit_by_node.append(csr.index[exit_node_id] if exit_node_id is not None else -1)
 
-        return egreess_return_paths
+        return EgressReturnPaths(csr, exit_by_node)
 
     def _get_neighbors_subgraph(self, router_id: str, neighbor_depth: int = 1) -> nx.MultiDiGraph:
         neighbor_set = self._get_neighbors_set(router_id, neighbor_depth)
         return self._graph.subgraph(neighbor_set).copy()
 
-    def _get_neighbors_set(self, router_id: str, neighbor_depth: int = 1) -> Set:
-        node_set = {router_id}
-        for i in range(neighbor_depth):
-            new_nodes = set({})
-            for already_neighbor_node in node_set:
-                for node in self._graph.neighbors(already_neighbor_node):
-                    new_nodes.add(node)
+    def _get_neighbors_set(
+        self,
+        router_id: str,
+        neighbor_depth: int = 1,
+        max_nodes: int = None,
+        max_cost: int = None,
+    ) -> FrozenSet[str]:
+        if max_cost is not None:
+            return self.get_cost_neighborhood(router_id, max_cost, max_nodes).router_ids
+
+        return self.get_neighborhood(router_id, neighbor_depth, max_nodes).router_ids
+
+    def get_neighborhood(
+        self, router_id: str, neighbor_depth: int = 1, max_nodes: int = None
+    ) -> Neighborhood:
+        """
+        The routers within neighbor_depth hops of router_id, at most max_nodes of them (nearest
+        first). Neighborhoods are cached per snapshot, so popular routers are only searched once
+        """
+        snapshot = self._snapshot
+        key = ("hops", router_id, neighbor_depth, max_nodes)
+        neighborhood = snapshot.neighborhoods.get(key)
+        if neighborhood is None:
+            csr = snapshot.csr
+            nodes, depth, truncated = csr.bounded_bfs(
+                csr.index[router_id], neighbor_depth, max_nodes
+            )
+            neighborhood = Neighborhood(
+                frozenset(csr.node_ids[node] for node in nodes), depth, truncated
+            )
+            snapshot.neighborhoods.put(key, neighborhood)
 
-            node_set = node_set.union(new_nodes)
+        return neighborhood
 
-        return node_set
+    def get_cost_neighborhood(
+        self, router_id: str, max_cost: int, max_nodes: int = None
+    ) -> Neighborhood:
+        """
+        The routers router_id can reach at an OSPF cost of at most max_cost, at most max_nodes
+        of them (cheapest first). Found with a Dijkstra run which stops expanding past max_cost,
+        so the cost scales with the size of the neighborhood. Cached like get_neighborhood()
+        """
+        snapshot = self._snapshot
+        key = ("cost", router_id, max_cost, max_nodes)
+        neighborhood = snapshot.neighborhoods.get(key)
+        if neighborhood is None:
+            csr = snapshot.csr
+            settled = []
+            dist, _, _ = csr.dijkstra([(csr.index[router_id], 0)], max_cost, settled)
+
+            radius, truncated = max_cost, False
+            if max_nodes is not None and len(settled) > max_nodes:
+                # Costs are whole numbers, so everything cheaper than the first router left
+                # out is included
+                radius, truncated = dist[settled[max_nodes]] - 1, True
+                settled = settled[:max_nodes]
+
+            neighborhood = Neighborhood(
+                frozenset(csr.node_ids[node] for node in settled), radius, truncated
+            )
+            snapshot.neighborhoods.put(key, neighborhood)
+
+        return neighborhood
+
+    def _get_spf_tree(self, router_id: str, reverse: bool = False) -> ShortestPathTree:
+        """
+        The shortest path tree from router_id to every router, or if reverse is set, from every
+        router to router_id (i.e. a run over the reversed graph, where each node's parent is its
+        next hop towards router_id). Cached per snapshot
+        """
+        snapshot = self._snapshot
+        key = (router_id, reverse)
+        tree = snapshot.spf_trees.get(key)
+        if tree is None:
+            csr = snapshot.csr.reverse() if reverse else snapshot.csr
+            tree = ShortestPathTree.compute(csr, [(csr.index[router_id], 0)])
+            snapshot.spf_trees.put(key, tree)
+
+        return tree
+
+    def get_path(
+        self, router1_id: str, router2_id: str
+    ) -> Optional[List[Tuple[str, Optional[int]]]]:
+        """
+        The OSPF path from router1_id to router2_id, with the cost of each hop, or None if
+        router2_id can't be reached from router1_id. Both directions are answered from trees
+        rooted at router1_id, so looking up many paths to or from one router costs at most two
+        Dijkstra runs. Of several equal cost paths, only one is returned
+        """
+        csr = self._csr
+        node1, node2 = csr.index[router1_id], csr.index[router2_id]
+
+        tree = self._get_spf_tree(router1_id)
+        if tree.dist[node2] == -1:
+            return None
+
+        path = []
+        node = node2
+        while node != node1:
+            parent_node = tree.parent[node]
+            path.append((csr.node_ids[node], tree.dist[node] - tree.dist[parent_node]))
+            node = parent_node
+
+        path.append((router1_id, None))
+        path.reverse()
+        return path
+
+    def get_reverse_path(
+        self, router1_id: str, router2_id: str
+    ) -> Optional[List[Tuple[str, Optional[int]]]]:
+        """The OSPF path from router2_id back to router1_id, like get_path()"""
+        csr = self._csr
+        node1, node2 = csr.index[router1_id], csr.index[router2_id]
+
+        tree = self._get_spf_tree(router1_id, reverse=True)
+        if tree.dist[node2] == -1:
+            return None
+
+        path = [(router2_id, None)]
+        node = node2
+        while node != node1:
+            parent_node = tree.parent[node]
+            path.append((csr.node_ids[parent_node], tree.dist[node] - tree.dist[parent_node]))
+            node = parent_node
+
+        return path
+
+    def get_paths_dict(self, router1_id: str, router2_id: str) -> dict:
+        """
+        The path from router1_id to router2_id, and the path back, with the total cost of each,
+        since OSPF costs (and so paths) can differ by direction
+        """
+        paths = {}
+        for direction, path in [
+            ("forward", self.get_path(router1_id, router2_id)),
+            ("reverse", self.get_reverse_path(router1_id, router2_id)),
+        ]:
+            paths[direction] = (
+                {"path": path, "cost": sum(cost for _, cost in path[1:])} if path else None
+            )
+
+        return paths
 
     def _convert_subgraph_to_json(
         self,
@@ -196,144 +828,238 @@ class OSPFGraph:
         neighbor_set: Set = None,
         include_networks: bool = True,
         whole_graph: nx.MultiDiGraph = None,
-        egress_forest: nx.DiGraph = None,
-        egress_return_paths: Dict[str, List[Tuple[str, int]]] = None,
+        egress_forest: Union[EgressForest, nx.DiGraph] = None,
+        egress_return_paths: Mapping[str, Optional[List[Tuple[str, Optional[int]]]]] = None,
+    ) -> dict:
+        if whole_graph is None or whole_graph is self._graph:
+            csr = self._csr
+        else:
+            csr = CSRGraph.from_networkx(whole_graph)
+
+        return self._convert_nodes_to_json(
+            [csr.index[node_id] for node_id in subgraph.nodes],
+            neighbor_set,
+            include_networks,
+            egress_forest=egress_forest,
+            egress_return_paths=egress_return_paths,
+            csr=csr,
+        )
+
+    def _convert_nodes_to_json(
+        self,
+        nodes: Iterable[int],
+        neighbor_set: Set = None,
+        include_networks: bool = True,
+        mask: GraphMask = None,
+        egress_forest: Union[EgressForest, nx.DiGraph] = None,
+        egress_return_paths: Mapping[str, Optional[List[Tuple[str, Optional[int]]]]] = None,
+        csr: CSRGraph = None,
     ) -> dict:
-        if whole_graph is None:
-            whole_graph = self._graph
+        """
+        Convert the subgraph induced by the given nodes of csr (the current graph by default),
+        as seen through mask if there is one, to JSON. Nodes are output in graph order
+        """
+        node_fragments = self._snapshot.node_fragments
+        if (
+            node_fragments is not None
+            and (csr is None or csr is node_fragments.csr)
+            and mask is None
+            and egress_forest is None
+            and egress_return_paths is None
+        ):
+            return node_fragments.to_json(nodes, neighbor_set, include_networks)
+
+        if csr is None:
+            csr = self._csr
 
         if egress_return_paths is None:
             egress_return_paths = self._egress_return_paths
 
         if egress_forest is None:
             egress_forest = self._egress_forest
+        egress_forest = self._as_egress_forest(egress_forest, csr)
+
+        node_set = set(nodes)
+        if mask is not None:
+            node_set -= mask.excluded_nodes
 
         output = {"nodes": [], "edges": []}
 
-        for node_id in subgraph.nodes:
-            node = subgraph.nodes[node_id]
+        for node in sorted(node_set):
+            node_id = csr.node_ids[node]
+            out_edges = list(csr.out_edges(node, mask))
 
-            exit_path = self._get_exit_path_for_node(egress_forest, node_id)
+            exit_path = egress_forest.get_exit_path(node_id)
             return_path = egress_return_paths[node_id] if node_id in egress_return_paths else None
 
             output_node = {
-                "id": node_id,
-                "nn": None,
-                "nn_int": None,
-                "exit_network_cost": exit_path[-1][1] if exit_path else None,
-                "exit_paths": {
-                    "outbound": exit_path[:-1] if exit_path else None,
-                    "return": return_path,
-                },
+                **NodeFragments.compute_node(node_id, exit_path, return_path),
                 "missing_edges": sum(
-                    1 for edge in whole_graph.out_edges(node_id) if edge not in subgraph.edges
+                    1 for other_node, _ in out_edges if other_node not in node_set
                 ),
             }
 
-            try:
-                output_node["nn"] = compute_nn_string_from_ip(node_id)
-                output_node["nn_int"] = compute_nn_from_ip(node_id)
-            except ValueError:
-                pass
-
             if neighbor_set:
                 output_node["in_neighbor_set"] = node_id in neighbor_set
 
             if include_networks:
-                output_node["networks"] = node["networks"]
+                output_node["networks"] = self._graph.nodes[node_id]["networks"]
 
             output["nodes"].append(output_node)
 
-        for edge in subgraph.edges:
-            output["edges"].append(
-                {
-                    "from": edge[0],
-                    "to": edge[1],
-                    "weight": subgraph.get_edge_data(*edge[:2])[edge[2]]["weight"],
-                }
-            )
+            for other_node, weight in out_edges:
+                if other_node in node_set:
+                    output["edges"].append(
+                        {"from": node_id, "to": csr.node_ids[other_node], "weight": weight}
+                    )
 
         return output
 
-    def update_link_data(self, json_link_data: dict = None):
+    def _fetch_link_data(self, url) -> Optional[LinkDB]:
+        """
+        The link data at url, streamed straight into its compact form. None if url is where
+        our current link data came from, and the server says it hasn't changed since
+        """
+        # The history API gets a circuit breaker of its own, so timestamps it's slow or failing
+        # on don't also cut us off from the live link data
+        breaker_key = None
+        if str(url).startswith(str(HISTORY_API_BASE_URL)):
+            breaker_key = str(HISTORY_API_BASE_URL)
+
+        return self._fetcher.fetch(url, self._snapshot.source, breaker_key)
+
+    def _refresh_from_api(self, incremental: bool = True, age_limit: datetime.timedelta = None):
+        # Re-check once we're the one doing the refresh, someone may have just finished one
+        if age_limit is not None and not self._is_older_than(age_limit):
+            return
+
+        try:
+            link_data = self._fetch_link_data(API_URL)
+        except LinkDBFetchError:
+            if self._stale_since is None:
+                self._stale_since = datetime.datetime.now()
+            raise
+
+        if link_data is not None:
+            self.update_link_data(link_data, incremental)
+            if self._store is not None:
+                self._store.put(self._snapshot)
+
+        self._last_checked = datetime.datetime.now()
+        self._stale_since = None
+
+    def _is_older_than(self, age_limit: datetime.timedelta) -> bool:
+        # If the API has no newer link data for us, we're as fresh as we can be
+        last_fresh = max(self.last_updated, self._last_checked)
+        return last_fresh < datetime.datetime.now() - age_limit
+
+    def update_link_data(
+        self, json_link_data: Union[dict, LinkDB] = None, incremental: bool = True
+    ):
         if json_link_data is None:
-            try:
-                json_link_data = requests.get(API_URL).json()
-            except requests.exceptions.RequestException:
-                raise RuntimeError(
-                    f"Error loading graph data from {API_URL}\nDo you have connectivity to that endpoint?"
-                )
+            # Concurrent refreshes all share the result of a single fetch & rebuild
+            self._refresh_flight.do(API_URL, lambda: self._refresh_from_api(incremental))
+            return
+
+        with self._update_lock:
+            snapshot = self._build_snapshot(json_link_data, self._snapshot if incremental else None)
+
+            # Publish everything at once, so readers never see a mix of old and new state
+            self._snapshot = snapshot
+
+    def load_latest_from_store(self) -> bool:
+        """
+        Publish the most recent snapshot in the store, to serve (marked as stale) until the first
+        refresh from the API succeeds. Returns False if there isn't one
+        """
+        if self._store is None:
+            return False
 
-        self.last_updated = datetime.datetime.fromtimestamp(json_link_data["updated"])
-        self.routers = json_link_data["areas"]["0.0.0.0"]["routers"]
-        self.networks = json_link_data["areas"]["0.0.0.0"]["networks"]
+        snapshot = self._store.get_latest()
+        if snapshot is None:
+            return False
 
-        self._update_graph()
+        with self._update_lock:
+            self._snapshot = snapshot
+            self._stale_since = datetime.datetime.now()
+
+        return True
 
     def update_if_needed(self, age_limit=datetime.timedelta(minutes=1)):
-        if self.last_updated < datetime.datetime.now() - age_limit:
+        if self._is_older_than(age_limit):
             if os.environ.get("DEBUG") == "true":
                 print("In debug mode, skipping update")
                 return
 
-            self.update_link_data()
+            try:
+                self._refresh_flight.do(
+                    API_URL, lambda: self._refresh_from_api(age_limit=age_limit)
+                )
+            except LinkDBFetchError as e:
+                if not self.has_link_data:
+                    raise
+
+                # Better to answer from the last link data we loaded than not at all
+                print(f"WARN: Refresh failed, serving link data from {self.last_updated}: {e}")
 
     def update_from_timestamp(self, timestamp: datetime.datetime):
         query_url = HISTORY_API_BASE_URL / (
             timestamp.astimezone(datetime.timezone.utc).strftime("%Y/%m/%d/%H/%M") + ".json"
         )
-        try:
-            json_link_data = requests.get(query_url).json()
-        except requests.exceptions.RequestException:
-            raise RuntimeError(
-                f"Error loading graph data from {query_url}\nDo you have connectivity to that endpoint?"
-            )
+        if self._store is not None:
+            snapshot = self._store.get(timestamp)
+            if snapshot is not None:
+                with self._update_lock:
+                    self._snapshot = snapshot
+                return
 
-        self.update_link_data(json_link_data)
+        link_data = self._fetch_link_data(query_url)
+        if link_data is not None:
+            self.update_link_data(link_data)
+            if self._store is not None:
+                self._store.put(self._snapshot, timestamp)
+
+    def estimated_size_bytes(self) -> int:
+        return APPROX_BYTES_PER_GRAPH_ELEMENT * (
+            self._full_graph.number_of_nodes() + self._full_graph.number_of_edges()
+        )
 
     def contains_router(self, router_id: str):
-        return router_id in self._graph
+        return router_id in self._csr
 
     def get_edges_for_node_pair(self, router1_id: str, router2_id: str):
-        try:
-            return [
-                {"from": router1_id, "to": router2_id, **edge_props}
-                for edge_props in self._graph[router1_id][router2_id].values()
-            ]
-        except KeyError:
+        csr = self._csr
+        if router1_id not in csr or router2_id not in csr:
             return []
 
+        return [
+            {"from": router1_id, "to": router2_id, "weight": weight}
+            for weight in csr.edge_weights(csr.index[router1_id], csr.index[router2_id])
+        ]
+
     def get_networks_for_node(self, router_id: str) -> dict:
         return self._graph.nodes[router_id]["networks"]
 
     @staticmethod
-    def _get_exit_path_for_node(egress_forest: nx.DiGraph, router_id: str):
-        if not router_id in egress_forest.nodes:
-            return None
-
-        def recurse_exit_path(current_path):
-            current_node = current_path[-1][0]
-            out_edges = egress_forest[current_node].items()
-
-            if len(out_edges) == 0:
-                # If there is nowhere else to go, this must be the exit
-                return current_path
-
-            assert len(out_edges) == 1
-            next_node, edge_data = out_edges.__iter__().__next__()
-            current_path.append((next_node, edge_data["weight"]))
-
-            return recurse_exit_path(current_path)
-
-        return recurse_exit_path([(router_id, None)])
+    def _get_exit_path_for_node(egress_forest: Union[EgressForest, nx.DiGraph], router_id: str):
+        return OSPFGraph._as_egress_forest(egress_forest).get_exit_path(router_id)
 
     def get_exit_path_for_node(self, router_id: str) -> List[str]:
         return self._get_exit_path_for_node(self._egress_forest, router_id)
 
     def get_neighbors_dict(
-        self, router_id: str, neighbor_depth: int = 1, include_egress=False
+        self,
+        router_id: str,
+        neighbor_depth: int = 1,
+        include_egress=False,
+        max_nodes: int = None,
+        max_cost: int = None,
     ) -> dict:
-        neighbor_set = self._get_neighbors_set(router_id, neighbor_depth)
+        """
+        The JSON for the routers within neighbor_depth hops of router_id, or if max_cost is set,
+        within that OSPF cost of it instead (see get_cost_neighborhood())
+        """
+        neighbor_set = self._get_neighbors_set(router_id, neighbor_depth, max_nodes, max_cost)
         nodes_to_include = neighbor_set
 
         if include_egress:
@@ -349,36 +1075,47 @@ class OSPFGraph:
                 | egress_return_path_nodes
             )
 
-        return self._convert_subgraph_to_json(self._graph.subgraph(nodes_to_include), neighbor_set)
+        csr = self._csr
+        return self._convert_nodes_to_json(
+            [csr.index[node_id] for node_id in nodes_to_include], neighbor_set
+        )
 
     @staticmethod
-    def _get_upstream_nodes(forest: nx.DiGraph, node) -> Set[str]:
-        upstream_nodes = set()
-        for n in forest.pred[node]:
-            upstream_nodes.add(n)
-            upstream_nodes = upstream_nodes.union(OSPFGraph._get_upstream_nodes(forest, n))
-
-        return upstream_nodes
+    def _get_upstream_nodes(forest: EgressForest, node) -> Set[str]:
+        """
+        Every router whose path to the internet goes through node (not including node itself)
+        """
+        return forest.get_upstream_nodes([node])
 
-    def _get_graph_without_nodes_and_edges(
-        self, nodes: List[str], edges: List[Tuple[str, str]]
-    ) -> nx.MultiDiGraph:
-        modified_graph: nx.MultiDiGraph = self._graph.copy()
+    def _get_outage_mask(self, nodes: List[str], edges: List[Tuple[str, str]]) -> GraphMask:
+        """
+        A mask over the graph which takes out the given nodes, and every edge connecting each
+        pair of nodes in edges (in both directions, since there could be more than one)
+        """
+        return GraphMask.from_ids(self._csr, nodes, edges)
 
-        for edge in edges:
-            # Ensure we remove all edges, since there could be more than one for each direction
-            for i in range(len(modified_graph[edge[0]][edge[1]])):
-                modified_graph.remove_edge(edge[0], edge[1])
-            for i in range(len(modified_graph[edge[1]][edge[0]])):
-                modified_graph.remove_edge(edge[1], edge[0])
+    def _get_outage_egress_state(self, mask: GraphMask) -> Tuple[EgressForest, EgressReturnPaths]:
+        """
+        The egress forest & return paths with everything mask excludes down. These are repaired
+        from the current ones, so the cost scales with the number of routers which are affected
+        by the outage, rather than with the size of the mesh
+        """
+        egress_forest = self._egress_forest.without(self._csr, mask)
+        egress_return_paths = self._egress_return_paths.without(egress_forest.exit_node, mask)
 
-        for node in nodes:
-            modified_graph.remove_node(node)
+        return egress_forest, egress_return_paths
 
-        return modified_graph
+    @staticmethod
+    def _is_single_failure(nodes: List[str], edges: List[Tuple[str, str]]) -> bool:
+        """True if nodes & edges take out exactly one router, or exactly one link"""
+        failed_nodes, failed_links = OSPFGraph.canonicalize_outage_scenario(nodes, edges)
+        return len(failed_nodes) + len(failed_links) == 1
 
     def get_dependent_nodes(
-        self, nodes: List[str], edges: List[Tuple[str, str]]
+        self,
+        nodes: List[str],
+        edges: List[Tuple[str, str]],
+        outage_egress_forest: EgressForest = None,
     ) -> Tuple[Set[str], Set[str]]:
         """
         Compute partially and fully dependent nodes of the union of the input node and edge lists
@@ -387,62 +1124,137 @@ class OSPFGraph:
         nodes they connect. That is, the direction of the edges specified doesn't matter, nor does
         the selection of a specific edge when dealing with multi-edge scenarios. All edges directly
         connecting the pair of nodes will be considered, even if only a single edge is provided
-        """
-        dependent_nodes = set({})
-        for node in nodes:
-            dependent_nodes = dependent_nodes.union(
-                self._get_upstream_nodes(self._egress_forest, node)
-            )
 
+        outage_egress_forest can be passed in if the caller already has the egress forest with
+        these nodes and edges down (see _get_outage_egress_state()), to avoid computing it again
+        """
+        # Everything upstream of a dropped node, or of the far end (from the exit) of a dropped
+        # edge in the egress forest, found with a single union of Euler tour ranges
+        upstream_of = list(nodes)
         for edge in edges:
             if self._egress_forest.has_edge(edge[0], edge[1]):
-                dependent_nodes = dependent_nodes.union(
-                    self._get_upstream_nodes(self._egress_forest, edge[0])
-                )
+                upstream_of.append(edge[0])
             if self._egress_forest.has_edge(edge[1], edge[0]):
-                dependent_nodes = dependent_nodes.union(
-                    self._get_upstream_nodes(self._egress_forest, edge[1])
-                )
+                upstream_of.append(edge[1])
 
-        for candidate_dependent_node, egress_return_path in self._egress_return_paths.items():
-            egress_path_nodes_only = [egress_node for egress_node, _ in egress_return_path]
-            for egress_node in egress_path_nodes_only:
-                for dropped_node in nodes:
-                    if egress_node == dropped_node and candidate_dependent_node != dropped_node:
-                        dependent_nodes.add(candidate_dependent_node)
-
-            for egress_node1, egress_node2 in zip(
-                egress_path_nodes_only, egress_path_nodes_only[1:]
-            ):
-                for dropped_edge in edges:
-                    if set(dropped_edge) == {egress_node1, egress_node2}:
-                        dependent_nodes.add(candidate_dependent_node)
-
-        new_egress_forest = self._compute_egress_forest(
-            self._get_graph_without_nodes_and_edges(nodes, edges)
-        )
+        dependent_nodes = self._egress_forest.get_upstream_nodes(upstream_of)
+
+        # Plus everything whose return path from the internet crosses a dropped node or edge
+        dependent_nodes |= self._egress_return_paths.get_routers_crossing(nodes, edges)
+
+        if outage_egress_forest is None and self._is_single_failure(nodes, edges):
+            # The routers which lose all egress are exactly the ones the failure dominates, so
+            # the common case of a single failure doesn't need any SPF work at all
+            fully_dependent_nodes = dependent_nodes & self._dominator_tree.get_dominated_routers(
+                nodes, edges
+            )
+            return dependent_nodes - fully_dependent_nodes, fully_dependent_nodes
+
+        if outage_egress_forest is None:
+            outage_egress_forest, _ = self._get_outage_egress_state(
+                self._get_outage_mask(nodes, edges)
+            )
 
         partially_dependent_nodes: set[str] = {
-            node for node in dependent_nodes if node in new_egress_forest.nodes
+            node for node in dependent_nodes if node in outage_egress_forest
         }
         fully_dependent_nodes: set[str] = dependent_nodes.difference(partially_dependent_nodes)
 
         return partially_dependent_nodes, fully_dependent_nodes
 
+    def get_single_points_of_failure(self, router_id: str) -> dict:
+        """
+        The routers and links which would each cut router_id off from the internet on their
+        own (nearest first), and the routers which router_id itself is a single point of
+        failure for. Both come straight from the dominator tree, without any SPF work
+        """
+        routers, links = self._dominator_tree.get_single_points_of_failure(router_id)
+        return {
+            "points_of_failure": {
+                "routers": routers,
+                "links": [list(link) for link in links],
+            },
+            "dependents": sorted(self._dominator_tree.get_dominated_routers([router_id], [])),
+        }
+
+    @staticmethod
+    def canonicalize_outage_scenario(
+        nodes: Iterable[str], edges: Iterable[Tuple[str, str]]
+    ) -> Tuple[Tuple[str, ...], Tuple[Tuple[str, str], ...]]:
+        """
+        Sort and de-duplicate the nodes and edges of an outage scenario, so that scenarios
+        which take out the same things compare (and hash) equal. Since edge direction doesn't
+        matter to get_dependent_nodes(), each edge is stored with its lower router ID first
+        """
+        return (
+            tuple(sorted(set(nodes))),
+            tuple(sorted({tuple(sorted(edge)) for edge in edges})),
+        )
+
+    @staticmethod
+    def _get_outage_lists(
+        nodes: List[str], partially_dependent_nodes: Set[str], fully_dependent_nodes: Set[str]
+    ) -> dict:
+        return {
+            "removed": sorted(nodes),
+            "offline": sorted(list(fully_dependent_nodes - set(nodes))),
+            "rerouted": sorted(list(partially_dependent_nodes)),
+        }
+
+    def get_outage_lists(self, nodes: List[str], edges: List[Tuple[str, str]]) -> dict:
+        """
+        Just the "outage_lists" part of simulate_outage(), without building any of the JSON
+        needed to display the impacted part of the graph
+        """
+        partially_dependent_nodes, fully_dependent_nodes = self.get_dependent_nodes(nodes, edges)
+        return self._get_outage_lists(nodes, partially_dependent_nodes, fully_dependent_nodes)
+
+    def _cuts_egress_forest(self, nodes: List[str], edges: List[Tuple[str, str]]) -> bool:
+        """
+        True if taking out these nodes and edges changes the egress forest at all. Taking things
+        out can only make paths longer, so if none of them are part of the forest, every router
+        keeps the path it already has
+        """
+        return any(node in self._egress_forest for node in nodes) or any(
+            self._egress_forest.has_edge(edge[0], edge[1])
+            or self._egress_forest.has_edge(edge[1], edge[0])
+            for edge in edges
+        )
+
+    def get_outage_counts(
+        self, scenarios: Iterable[Tuple[List[str], List[Tuple[str, str]]]]
+    ) -> List[Tuple[int, int]]:
+        """
+        The number of (offline, rerouted) routers get_outage_lists() would report for each
+        (nodes, edges) scenario. Meant for sweeping over lots of small scenarios, like every
+        single router or link going down: the Euler tour, return path index & dominator tree
+        are shared by all of them, single failures are answered from the dominator tree, and
+        otherwise repairs only touch the subtree below the cut (and are skipped entirely for
+        scenarios which don't cut the egress forest at all)
+        """
+        counts = []
+        for nodes, edges in scenarios:
+            outage_egress_forest = None
+            if not self._cuts_egress_forest(nodes, edges):
+                outage_egress_forest = self._egress_forest
+
+            partially_dependent_nodes, fully_dependent_nodes = self.get_dependent_nodes(
+                nodes, edges, outage_egress_forest
+            )
+            counts.append((len(fully_dependent_nodes - set(nodes)), len(partially_dependent_nodes)))
+
+        return counts
+
     def simulate_outage(self, nodes: List[str], edges: List[Tuple[str, str]]) -> dict:
         nodes_of_removed_edges = set()
         for edge in edges:
             nodes_of_removed_edges.add(edge[0])
             nodes_of_removed_edges.add(edge[1])
 
-        partially_dependent_nodes, fully_dependent_nodes = self.get_dependent_nodes(nodes, edges)
-
-        # It's not crazy efficient to do this a second time, but it makes the code simpler sooooo...
-        modified_graph = self._get_graph_without_nodes_and_edges(nodes, edges)
-
-        modified_egress_forest = self._compute_egress_forest(modified_graph)
-        modified_egress_return_paths = self._compute_egress_return_paths(
-            modified_graph, modified_egress_forest
+        mask = self._get_outage_mask(nodes, edges)
+        modified_egress_forest, modified_egress_return_paths = self._get_outage_egress_state(mask)
+        partially_dependent_nodes, fully_dependent_nodes = self.get_dependent_nodes(
+            nodes, edges, modified_egress_forest
         )
 
         nodes_to_include_egress_paths_for = (
@@ -474,9 +1286,11 @@ class OSPFGraph:
             for egress_path_half in [egress_outbound_path, egress_return_path]:
                 nodes_to_display |= set(node_id for node_id, edge_cost in egress_path_half)
 
-        impacted_subgraph = self._convert_subgraph_to_json(
-            modified_graph.subgraph(nodes_to_display),
-            whole_graph=modified_graph,
+        csr = self._csr
+        impacted_subgraph = self._convert_nodes_to_json(
+            # Skipping the exit placeholders
+            [csr.index[node_id] for node_id in nodes_to_display if node_id in csr.index],
+            mask=mask,
             egress_forest=modified_egress_forest,
             egress_return_paths=modified_egress_return_paths,
             include_networks=False,
@@ -484,7 +1298,10 @@ class OSPFGraph:
 
         all_removed_edges = edges.copy()
         for node in nodes:
-            for other_node in set(self._graph[node]):
+            neighbors = {
+                csr.node_ids[other_node] for other_node, _ in csr.out_edges(csr.index[node])
+            }
+            for other_node in neighbors:
                 if other_node in nodes_to_display:
                     all_removed_edges.append([node, other_node])
 
@@ -512,9 +1329,7 @@ class OSPFGraph:
 
         return {
             **impacted_subgraph,
-            "outage_lists": {
-                "removed": sorted(nodes),
-                "offline": sorted(list(fully_dependent_nodes - set(nodes))),
-                "rerouted": sorted(list(partially_dependent_nodes)),
-            },
+            "outage_lists": self._get_outage_lists(
+                nodes, partially_dependent_nodes, fully_dependent_nodes
+            ),
         }
@@ -0,0 +1,243 @@
+import codecs
+import dataclasses
+import hashlib
+import json
+from typing import Any, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple, Union
+
+OSPF_AREA = "0.0.0.0"
+
+# Link data is read in chunks of this size when streamed, the whole document is never buffered
+STREAM_CHUNK_SIZE_BYTES = 64 * 1024
+
+
+class RouterLSA(NamedTuple):
+    """
+    The parts of a router's entry in the link data that we use. links is the router's links,
+    minus the ones to networks, which are kept as (network CIDR, metric) pairs instead. digest
+    identifies the full entry, so we can tell when it changes without keeping it around
+    """
+
+    digest: bytes
+    links: dict
+    network_links: Tuple[Tuple[str, int], ...]
+
+
+class NetworkLSA(NamedTuple):
+    """The routers attached to a (multi-access) network, and a digest of its full entry"""
+
+    digest: bytes
+    routers: Tuple[str, ...]
+
+
+class LinkDBSource(NamedTuple):
+    """
+    Where some link data was fetched from, along with the cache validators the server sent
+    with it, so the next fetch of the same URL can be made conditional
+    """
+
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+def _get_digest(value: Any) -> bytes:
+    return hashlib.blake2b(
+        json.dumps(value, sort_keys=True, separators=(",", ":")).encode(), digest_size=16
+    ).digest()
+
+
+def compact_router(router: dict) -> RouterLSA:
+    links = router.get("links", {})
+    return RouterLSA(
+        _get_digest(router),
+        {link_type: link_list for link_type, link_list in links.items() if link_type != "network"},
+        tuple(
+            (network_link["id"], network_link["metric"])
+            for network_link in links.get("network", [])
+        ),
+    )
+
+
+def compact_network(network: dict) -> NetworkLSA:
+    return NetworkLSA(_get_digest(network), tuple(network.get("routers", [])))
+
+
+@dataclasses.dataclass(frozen=True)
+class LinkDB:
+    """
+    A compact form of the OSPF link data (as served by the linkdb API) for the backbone area,
+    with only what's needed to build the graph, and to tell what changed from one load to the
+    next. Can be built from an already parsed document, or streamed from its raw text
+    """
+
+    updated: int
+    routers: Dict[str, RouterLSA]
+    networks: Dict[str, NetworkLSA]
+    source: Optional[LinkDBSource] = None
+
+    def get_content_digest(self) -> bytes:
+        """
+        A digest of every router & network, but not of the updated timestamp, so link data
+        which has been re-published without any changes to the OSPF DB has the same digest
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for entries in (self.routers, self.networks):
+            for entry_id in sorted(entries):
+                digest.update(entry_id.encode())
+                digest.update(entries[entry_id].digest)
+            digest.update(b"\0")
+
+        return digest.digest()
+
+    @classmethod
+    def from_json(cls, json_link_data: dict) -> "LinkDB":
+        area = json_link_data["areas"][OSPF_AREA]
+        return cls(
+            json_link_data["updated"],
+            {router_id: compact_router(router) for router_id, router in area["routers"].items()},
+            {
+                network_cidr: compact_network(network)
+                for network_cidr, network in area["networks"].items()
+            },
+        )
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Union[bytes, str]]) -> "LinkDB":
+        """
+        Parse the raw link data incrementally, compacting each router & network as soon as it
+        has been read, so peak memory is the compact form plus a single chunk, rather than the
+        whole document and the nested dicts parsed from it
+        """
+        updated = None
+        routers = {}
+        networks = {}
+        for event, key, value in StreamingLinkDBParser(chunks).parse():
+            if event == "updated":
+                updated = value
+            elif event == "router":
+                routers[key] = compact_router(value)
+            elif event == "network":
+                networks[key] = compact_network(value)
+
+        if updated is None:
+            raise ValueError("Link data is missing its updated timestamp")
+
+        return cls(updated, routers, networks)
+
+
+class StreamingLinkDBParser:
+    """
+    An incremental parser for the linkdb JSON document, which yields the "updated" timestamp,
+    and each router & network in the backbone area, as (event, key, value) tuples as soon as
+    they have been read. Everything else in the document is skipped over
+
+    Only the entries themselves are parsed with the json module (each of them is small), the
+    objects they're nested in are walked here one token at a time
+    """
+
+    def __init__(self, chunks: Iterable[Union[bytes, str]]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._exhausted = False
+
+    def _read_more(self) -> bool:
+        if self._exhausted:
+            return False
+
+        # Drop what we've already consumed, so the buffer never grows past about one entry
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+
+        for chunk in self._chunks:
+            if isinstance(chunk, bytes):
+                chunk = self._decoder.decode(chunk)
+            if chunk:
+                self._buffer += chunk
+                return True
+
+        self._buffer += self._decoder.decode(b"", final=True)
+        self._exhausted = True
+        return False
+
+    def _peek(self) -> str:
+        """The next non-whitespace character, without consuming it"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\n\r":
+                self._pos += 1
+
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._read_more():
+                raise ValueError("Unexpected end of link data")
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"Expected {char!r} in link data at {self._buffer[self._pos:][:20]!r}")
+
+        self._pos += 1
+
+    def _read_value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # Most likely the value is cut off at the end of the buffer, get more & retry
+                if not self._read_more():
+                    raise
+                continue
+
+            # A number right at the end of the buffer might continue in the next chunk
+            is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if is_number and end == len(self._buffer) and self._read_more():
+                continue
+
+            self._pos = end
+            return value
+
+    def _iter_object(self) -> Iterator[str]:
+        """Yield each key of the object at the current position, leaving the parser at its value"""
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self._read_value()
+            if not isinstance(key, str):
+                raise ValueError(f"Expected an object key in link data, got {key!r}")
+            self._expect(":")
+
+            yield key
+
+            if self._peek() == ",":
+                self._pos += 1
+            else:
+                self._expect("}")
+                return
+
+    def parse(self) -> Iterator[Tuple[str, str, Any]]:
+        for key in self._iter_object():
+            if key == "updated":
+                yield "updated", key, self._read_value()
+            elif key == "areas":
+                for area_id in self._iter_object():
+                    if area_id == OSPF_AREA:
+                        yield from self._parse_area()
+                    else:
+                        self._read_value()
+            else:
+                self._read_value()
+
+    def _parse_area(self) -> Iterator[Tuple[str, str, Any]]:
+        for key in self._iter_object():
+            if key in ("routers", "networks"):
+                event = key[:-1]
+                for entry_id in self._iter_object():
+                    yield event, entry_id, self._read_value()
+            else:
+                self._read_value()
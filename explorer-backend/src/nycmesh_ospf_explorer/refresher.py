@@ -0,0 +1,75 @@
+import datetime
+import threading
+import traceback
+from typing import Callable, Optional
+
+from nycmesh_ospf_explorer.graph import OSPFGraph
+
+
+class BackgroundRefresher:
+    """
+    Periodically reloads the link data for an OSPFGraph on a daemon thread
+
+    The next snapshot is built off to the side and published with a single swap (see
+    OSPFGraph.update_link_data()), so request handlers never wait on a refresh, and never see
+    a partially updated graph
+
+    If on_refresh is passed in, it's called with the graph after every successful refresh, e.g.
+    to kick off any precomputation for the new snapshot
+    """
+
+    def __init__(
+        self,
+        graph: OSPFGraph,
+        interval=datetime.timedelta(minutes=1),
+        on_refresh: Optional[Callable[[OSPFGraph], None]] = None,
+    ):
+        self.graph = graph
+        self.interval = interval
+        self.on_refresh = on_refresh
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, refresh_now: bool = False):
+        """
+        Start refreshing every interval. If refresh_now is set, the first refresh happens right
+        away (on the refresher's thread), rather than after the first interval
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(refresh_now,), name="ospf-graph-refresher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def refresh(self):
+        try:
+            self.graph.update_link_data()
+        except Exception:
+            # Keep serving the last snapshot we were able to load, and try again next interval
+            print("WARN: Background refresh of OSPF graph failed")
+            traceback.print_exc()
+            return
+
+        if self.on_refresh is not None:
+            self.on_refresh(self.graph)
+
+    def _run(self, refresh_now: bool):
+        if refresh_now:
+            self.refresh()
+
+        while not self._stop_event.wait(self.interval.total_seconds()):
+            self.refresh()
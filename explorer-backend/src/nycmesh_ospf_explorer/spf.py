@@ -0,0 +1,317 @@
+import heapq
+import itertools
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from nycmesh_ospf_explorer.csr import CSRGraph, GraphMask
+
+
+class ShortestPathTree:
+    """
+    The shortest path tree (or forest, when there are several sources) found by a Dijkstra run
+    over a CSRGraph (or a masked view of one), as flat arrays indexed by node:
+      - parent: the node each node was reached from, -1 for sources and unreached nodes
+      - dist: the distance from the nearest source, -1 for unreached nodes
+      - settle_rank: the order the run finalized each node's distance in (-1 if unreached),
+        used to break ties between equal cost paths when the tree is repaired
+    along with the (node -> initial distance) sources the run started from, and the mask
+    (if any) the graph was viewed through
+
+    Subtree queries are answered with an Euler tour of the tree (built the first time one is
+    needed): every tree is laid out in DFS pre-order in euler_order, so the subtree below a node
+    is the contiguous slice euler_order[tin[node] + 1 : tout[node]]
+    """
+
+    def __init__(
+        self,
+        node_ids: List[str],
+        index: Dict[str, int],
+        parent: array,
+        dist: array,
+        sources: Dict[int, int],
+        settle_rank: array = None,
+        mask: GraphMask = None,
+    ):
+        self.node_ids = node_ids
+        self.index = index
+        self.parent = parent
+        self.dist = dist
+        self.sources = sources
+        self.settle_rank = settle_rank if settle_rank is not None else array("l", dist)
+        self.mask = mask if mask is not None else GraphMask()
+
+        self._euler_tour: Optional[Tuple[array, array, array, array, array]] = None
+        self._euler_tour_lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # The Euler tour is cheap to build again, and its lock can't be pickled
+        state = self.__dict__.copy()
+        del state["_euler_tour"]
+        del state["_euler_tour_lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._euler_tour = None
+        self._euler_tour_lock = threading.Lock()
+
+    @classmethod
+    def compute(
+        cls, graph: CSRGraph, sources: Iterable[Tuple[int, int]], mask: GraphMask = None
+    ) -> "ShortestPathTree":
+        sources = dict(sources)
+        settled = []
+        dist, parent, _ = graph.dijkstra(sources.items(), settled=settled, mask=mask)
+        return cls(
+            graph.node_ids,
+            graph.index,
+            array("l", parent),
+            array("l", (-1 if node_dist is None else node_dist for node_dist in dist)),
+            sources,
+            cls._get_settle_rank(settled, len(graph)),
+            mask,
+        )
+
+    @staticmethod
+    def _get_settle_rank(settled: List[int], node_count: int) -> array:
+        settle_rank = array("l", [-1]) * node_count
+        for rank, node in enumerate(settled):
+            settle_rank[node] = rank
+
+        return settle_rank
+
+    def _get_euler_tour(self) -> Tuple[array, array, array, array, array]:
+        with self._euler_tour_lock:
+            if self._euler_tour is None:
+                self._euler_tour = self._compute_euler_tour()
+
+            return self._euler_tour
+
+    def _compute_euler_tour(self) -> Tuple[array, array, array, array, array]:
+        node_count = len(self.node_ids)
+
+        child_counts = [0] * (node_count + 1)
+        for parent_node in self.parent:
+            if parent_node != -1:
+                child_counts[parent_node + 1] += 1
+
+        children_offsets = array("l", itertools.accumulate(child_counts))
+        children = array("l", [0]) * children_offsets[-1]
+        next_slot = list(children_offsets[:-1])
+        for node, parent_node in enumerate(self.parent):
+            if parent_node != -1:
+                children[next_slot[parent_node]] = node
+                next_slot[parent_node] += 1
+
+        euler_order = array("l")
+        tin = array("l", [-1]) * node_count
+        tout = array("l", [-1]) * node_count
+        for root in range(node_count):
+            if self.parent[root] != -1 or self.dist[root] == -1:
+                continue
+
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                tin[node] = len(euler_order)
+                euler_order.append(node)
+                stack.extend(
+                    reversed(children[children_offsets[node] : children_offsets[node + 1]])
+                )
+
+        # Pre-order means every node comes after its parent, so walking the tour backwards
+        # visits every subtree before the node at the top of it
+        subtree_size = [1] * node_count
+        for node in reversed(euler_order):
+            tout[node] = tin[node] + subtree_size[node]
+            if self.parent[node] != -1:
+                subtree_size[self.parent[node]] += subtree_size[node]
+
+        return children_offsets, children, euler_order, tin, tout
+
+    @property
+    def euler_order(self) -> array:
+        return self._get_euler_tour()[2]
+
+    @property
+    def tin(self) -> array:
+        return self._get_euler_tour()[3]
+
+    @property
+    def tout(self) -> array:
+        return self._get_euler_tour()[4]
+
+    def children(self, node: int) -> array:
+        """The nodes which were reached through this one"""
+        children_offsets, children, _, _, _ = self._get_euler_tour()
+        return children[children_offsets[node] : children_offsets[node + 1]]
+
+    def subtree_range(self, node: int) -> Tuple[int, int]:
+        """The [start, end) slice of euler_order which holds every node below node"""
+        _, _, _, tin, tout = self._get_euler_tour()
+        if tin[node] == -1:
+            return 0, 0
+
+        return tin[node] + 1, tout[node]
+
+    def subtree_nodes(self, nodes: Iterable[int], include_roots: bool = False) -> List[int]:
+        """
+        Every node below any of the given nodes, without duplicates. The given nodes themselves
+        are only included if include_roots is set (or if one is below another)
+        """
+        _, _, euler_order, tin, _ = self._get_euler_tour()
+
+        ranges = []
+        for node in nodes:
+            start, end = self.subtree_range(node)
+            if include_roots and tin[node] != -1:
+                start -= 1
+            ranges.append((start, end))
+
+        # Subtree ranges are either nested or disjoint, so once sorted we only need to skip
+        # ranges which fall inside the last one we took
+        subtree_nodes = []
+        covered_until = 0
+        for start, end in sorted(ranges):
+            if start >= covered_until and start < end:
+                subtree_nodes.extend(euler_order[start:end])
+                covered_until = end
+
+        return subtree_nodes
+
+    def _repair(
+        self, graph: CSRGraph, mask: GraphMask, cut_nodes: Iterable[int] = ()
+    ) -> Tuple[array, array, GraphMask, List[int], List[int]]:
+        """
+        Decremental SPF: update this tree (found by a run over graph) for everything mask
+        excludes being taken out too. Removing things can only make paths longer, so only the
+        nodes whose tree path used something that was taken out need a new one. Those are cut
+        loose, re-seeded from their cheapest edge back into the intact part of the tree, and a
+        Dijkstra run restricted to them finishes the job.
+
+        graph may also differ from the one this tree was found over by edges which were dropped
+        or made more expensive, as long as cut_nodes has every node whose tree edge was one of
+        them (see with_raised_edges()). Those paths can only get longer too
+
+        Returns the new (parent, dist) arrays and the combined mask, along with the cut loose
+        nodes, and the ones among them which were reached again, in the order they were reached
+        """
+        cut_nodes = list(cut_nodes)
+        cut_nodes.extend(node for node in mask.excluded_nodes if self.dist[node] != -1)
+        for node, other_node in mask.excluded_links:
+            if self.parent[node] == other_node:
+                cut_nodes.append(node)
+            elif self.parent[other_node] == node:
+                cut_nodes.append(other_node)
+
+        affected = self.subtree_nodes(cut_nodes, include_roots=True)
+        affected_set = set(affected)
+
+        parent = array("l", self.parent)
+        dist = array("l", self.dist)
+        for node in affected:
+            parent[node] = -1
+            dist[node] = -1
+
+        mask = self.mask | mask
+
+        # A full Dijkstra run gives each node the first parent settled, among the ones which
+        # reach it at the lowest cost. Break ties the same way here (by distance, then by the
+        # order of the original run), so repaired trees match recomputed ones where possible
+        def is_better_parent(new_dist: int, new_parent: int, node: int) -> bool:
+            if node not in seen or new_dist < seen[node]:
+                return True
+
+            old_parent = parent[node]
+            return (
+                new_dist == seen[node]
+                and old_parent != -1
+                and (
+                    new_parent == -1
+                    or (dist[new_parent], self.settle_rank[new_parent])
+                    < (dist[old_parent], self.settle_rank[old_parent])
+                )
+            )
+
+        counter = itertools.count()
+        fringe = []
+        seen: Dict[int, int] = {}
+        for node in sorted(affected):
+            if mask.excludes_node(node):
+                continue
+
+            if node in self.sources:
+                seen[node] = self.sources[node]
+
+            for other_node, weight in graph.reverse().out_edges(node, mask):
+                if dist[other_node] == -1:
+                    continue
+
+                if is_better_parent(dist[other_node] + weight, other_node, node):
+                    seen[node] = dist[other_node] + weight
+                    parent[node] = other_node
+
+            if node in seen:
+                heapq.heappush(fringe, (seen[node], next(counter), node))
+
+        reached = []
+        while fringe:
+            node_dist, _, node = heapq.heappop(fringe)
+            if dist[node] != -1:
+                continue
+
+            dist[node] = node_dist
+            reached.append(node)
+
+            for other_node, weight in graph.out_edges(node, mask):
+                if other_node not in affected_set or dist[other_node] != -1:
+                    continue
+
+                other_dist = node_dist + weight
+                if other_node not in seen or other_dist < seen[other_node]:
+                    seen[other_node] = other_dist
+                    parent[other_node] = node
+                    heapq.heappush(fringe, (other_dist, next(counter), other_node))
+                elif is_better_parent(other_dist, node, other_node):
+                    parent[other_node] = node
+
+        return parent, dist, mask, affected, reached
+
+    def without(self, graph: CSRGraph, mask: GraphMask) -> "ShortestPathTree":
+        """
+        This tree, as it would be if it were computed over graph with everything mask excludes
+        taken out too. The cost of this scales with the number of nodes whose path changes, not
+        the size of the graph
+        """
+        parent, dist, mask, _, _ = self._repair(graph, mask)
+        return ShortestPathTree(
+            self.node_ids,
+            self.index,
+            parent,
+            dist,
+            self.sources,
+            self.settle_rank,
+            mask,
+        )
+
+    def with_raised_edges(
+        self, graph: CSRGraph, edges: Iterable[Tuple[int, int]]
+    ) -> "ShortestPathTree":
+        """
+        This tree as it would be if it were computed over graph, a copy of the graph it was
+        computed over with the same nodes, where only the given (node, other node) edges were
+        dropped or made more expensive. Like without(), only the nodes whose path used one of
+        those edges are recomputed
+        """
+        cut_nodes = [other_node for node, other_node in edges if self.parent[other_node] == node]
+        parent, dist, mask, _, _ = self._repair(graph, GraphMask(), cut_nodes)
+        return ShortestPathTree(
+            graph.node_ids,
+            graph.index,
+            parent,
+            dist,
+            self.sources,
+            self.settle_rank,
+            mask,
+        )
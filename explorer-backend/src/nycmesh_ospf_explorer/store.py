@@ -0,0 +1,302 @@
+import dataclasses
+import datetime
+import functools
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import traceback
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    from nycmesh_ospf_explorer.graph import GraphSnapshot
+
+SNAPSHOT_FILE_MAGIC = b"OSPFSNAP"
+# Bump this whenever the pickled state of anything a snapshot holds changes. The fields of
+# GraphSnapshot itself are covered by the schema digest, see _get_schema_digest()
+SNAPSHOT_FILE_VERSION = 2
+# Magic, format version, schema digest, payload length, content digest
+SNAPSHOT_FILE_HEADER = struct.Struct("<8sH8sQ16s")
+
+
+@functools.lru_cache(maxsize=None)
+def _get_schema_digest() -> bytes:
+    """
+    A digest of the names of the GraphSnapshot fields, so snapshots written before one was
+    added (or removed) are treated as unreadable, rather than loaded without it
+    """
+    # Imported here, since the graph module imports this one
+    from nycmesh_ospf_explorer.graph import GraphSnapshot
+
+    field_names = ",".join(field.name for field in dataclasses.fields(GraphSnapshot))
+    return hashlib.blake2b(field_names.encode(), digest_size=8).digest()
+
+
+class SnapshotStore:
+    """
+    A local, content-addressed store of graph snapshots, so loading link data we've already
+    seen (after a restart, or for a historical timestamp) doesn't need the network, nor parsing
+    the JSON & rebuilding the graph & egress state from scratch
+
+    Each distinct OSPF DB (by content digest, see LinkDB.get_content_digest()) is written once,
+    in objects/, as a small binary header followed by the pickled snapshot, with its egress
+    return path trees precomputed. Files are memory mapped to be loaded. index/ maps the minute
+    of each timestamp we stored a snapshot for to its digest and exact updated time, so link
+    data which was re-published without changes costs an index entry, not a whole snapshot
+
+    The total size of objects/ is kept under max_size_bytes by evicting the least recently
+    used snapshots (and their index entries). As entries are written, the index is pruned down
+    to the entries within index_retention of the newest one, plus the newest entry for each
+    snapshot, so every stored snapshot stays reachable. Writes go through a temporary file &
+    rename, so several processes can share one store directory. Only point this at a directory
+    you trust, snapshots are unpickled when loaded
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size_bytes: int,
+        index_retention: datetime.timedelta = datetime.timedelta(days=1),
+    ):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.index_retention = index_retention
+
+        self._objects_path = os.path.join(path, "objects")
+        self._index_path = os.path.join(path, "index")
+        os.makedirs(self._objects_path, exist_ok=True)
+        os.makedirs(self._index_path, exist_ok=True)
+
+        self._cleanup_lock = threading.Lock()
+
+    @staticmethod
+    def _get_minute_key(timestamp: datetime.datetime) -> str:
+        minute_timestamp = int(timestamp.timestamp())
+        return str(minute_timestamp - minute_timestamp % 60)
+
+    def _get_object_path(self, digest: bytes) -> str:
+        return os.path.join(self._objects_path, digest.hex() + ".snap")
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def put(self, snapshot: "GraphSnapshot", timestamp: datetime.datetime = None) -> bool:
+        """
+        Store snapshot, and index it under timestamp (by default, when its link data was
+        updated). Returns False if it couldn't be stored, a full or read-only disk should only
+        cost us the speed-up, not the snapshot
+        """
+        if snapshot.content_digest is None:
+            return False
+
+        try:
+            object_path = self._get_object_path(snapshot.content_digest)
+            if not os.path.exists(object_path):
+                self._write_atomic(object_path, self._serialize(snapshot))
+                self._evict()
+
+            updated = int(snapshot.last_updated.timestamp())
+            for index_timestamp in {snapshot.last_updated, timestamp or snapshot.last_updated}:
+                self._write_atomic(
+                    os.path.join(self._index_path, self._get_minute_key(index_timestamp)),
+                    f"{snapshot.content_digest.hex()} {updated}".encode(),
+                )
+            self._prune_index()
+        except OSError:
+            print("WARN: Couldn't write snapshot to the snapshot store")
+            traceback.print_exc()
+            return False
+
+        return True
+
+    def get(self, timestamp: datetime.datetime) -> Optional["GraphSnapshot"]:
+        """The snapshot stored for the minute of timestamp, or None if there isn't one"""
+        return self._get_indexed(self._get_minute_key(timestamp))
+
+    def get_latest(self) -> Optional["GraphSnapshot"]:
+        """The snapshot stored for the most recent minute, or None if the store is empty"""
+        try:
+            minute_keys = [name for name in os.listdir(self._index_path) if name.isdigit()]
+        except OSError:
+            return None
+
+        for minute_key in sorted(minute_keys, key=int, reverse=True):
+            snapshot = self._get_indexed(minute_key)
+            if snapshot is not None:
+                return snapshot
+
+        return None
+
+    def _get_indexed(self, minute_key: str) -> Optional["GraphSnapshot"]:
+        index_entry_path = os.path.join(self._index_path, minute_key)
+        try:
+            with open(index_entry_path) as index_entry:
+                digest_hex, updated = index_entry.read().split()
+        except (OSError, ValueError):
+            return None
+
+        try:
+            digest = bytes.fromhex(digest_hex)
+            last_updated = datetime.datetime.fromtimestamp(int(updated))
+        except ValueError:
+            print(f"WARN: Discarding unreadable snapshot index entry {index_entry_path}")
+            self._remove(index_entry_path)
+            return None
+
+        snapshot = self.get_by_digest(digest)
+        if snapshot is None:
+            # Its snapshot has been evicted (or was never written), don't look for it again
+            self._remove(index_entry_path)
+            return None
+
+        return dataclasses.replace(snapshot, last_updated=last_updated)
+
+    def get_by_digest(self, digest: bytes) -> Optional["GraphSnapshot"]:
+        object_path = self._get_object_path(digest)
+        try:
+            # Copying it checks it has every field, i.e. that it was written by this version
+            snapshot = dataclasses.replace(self._load(object_path, digest))
+            # Mark it as recently used, for eviction
+            os.utime(object_path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated, corrupt, or from an older format version (which can fail to unpickle
+            # in just about any way). Drop it & rebuild it next time
+            print(f"WARN: Discarding unreadable snapshot {object_path}")
+            traceback.print_exc()
+            self._remove(object_path)
+            return None
+
+        return snapshot
+
+    @staticmethod
+    def _serialize(snapshot: "GraphSnapshot") -> bytes:
+        # Pay for these once here, rather than after every load
+        snapshot.egress_return_paths.precompute()
+
+        payload = pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        return (
+            SNAPSHOT_FILE_HEADER.pack(
+                SNAPSHOT_FILE_MAGIC,
+                SNAPSHOT_FILE_VERSION,
+                _get_schema_digest(),
+                len(payload),
+                snapshot.content_digest,
+            )
+            + payload
+        )
+
+    @staticmethod
+    def _load(object_path: str, digest: bytes) -> "GraphSnapshot":
+        with open(object_path, "rb") as object_file:
+            with mmap.mmap(object_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if len(mapped) < SNAPSHOT_FILE_HEADER.size:
+                    raise ValueError("Snapshot file is truncated")
+
+                magic, version, schema_digest, payload_length, file_digest = (
+                    SNAPSHOT_FILE_HEADER.unpack_from(mapped)
+                )
+                if magic != SNAPSHOT_FILE_MAGIC or version != SNAPSHOT_FILE_VERSION:
+                    raise ValueError("Not a snapshot file, or an unsupported version of one")
+                if schema_digest != _get_schema_digest():
+                    raise ValueError("Snapshot file has different GraphSnapshot fields")
+                if file_digest != digest:
+                    raise ValueError("Snapshot file doesn't match its digest")
+
+                end = SNAPSHOT_FILE_HEADER.size + payload_length
+                if len(mapped) != end:
+                    raise ValueError("Snapshot file is truncated")
+
+                # Unpickle straight out of the page cache, without reading into a buffer first
+                with memoryview(mapped) as view, view[SNAPSHOT_FILE_HEADER.size : end] as payload:
+                    return pickle.loads(payload)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _list_objects(self) -> Tuple[list, int]:
+        objects = []
+        total_size = 0
+        with os.scandir(self._objects_path) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".snap"):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                objects.append((stat.st_mtime, entry.name, stat.st_size))
+                total_size += stat.st_size
+
+        return objects, total_size
+
+    def _evict(self):
+        with self._cleanup_lock:
+            objects, total_size = self._list_objects()
+            if total_size <= self.max_size_bytes:
+                return
+
+            evicted_digests = set()
+            for _, name, size in sorted(objects):
+                if total_size <= self.max_size_bytes:
+                    break
+
+                self._remove(os.path.join(self._objects_path, name))
+                evicted_digests.add(name[: -len(".snap")])
+                total_size -= size
+
+            # Drop the index entries which would point at nothing now
+            with os.scandir(self._index_path) as entries:
+                for entry in entries:
+                    try:
+                        with open(entry.path) as index_entry:
+                            digest_hex = index_entry.read().split()[0]
+                    except (OSError, IndexError):
+                        continue
+
+                    if digest_hex in evicted_digests:
+                        self._remove(entry.path)
+
+    def _prune_index(self):
+        with self._cleanup_lock:
+            minute_keys = [int(name) for name in os.listdir(self._index_path) if name.isdigit()]
+            if not minute_keys:
+                return
+
+            cutoff = max(minute_keys) - self.index_retention.total_seconds()
+            kept_digests = set()
+            for minute_key in sorted(
+                (minute_key for minute_key in minute_keys if minute_key < cutoff), reverse=True
+            ):
+                index_entry_path = os.path.join(self._index_path, str(minute_key))
+                try:
+                    with open(index_entry_path) as index_entry:
+                        digest_hex = index_entry.read().split()[0]
+                except (OSError, IndexError):
+                    continue
+
+                if digest_hex in kept_digests:
+                    self._remove(index_entry_path)
+                else:
+                    kept_digests.add(digest_hex)
+
+    def get_size_bytes(self) -> int:
+        return self._list_objects()[1]
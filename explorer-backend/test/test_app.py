@@ -0,0 +1,159 @@
+import copy
+import datetime
+import importlib
+import json
+
+import pytest
+from nycmesh_ospf_explorer import app as app_module
+from nycmesh_ospf_explorer.cache import LRUCache
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from test_graph import TEST_NINE_NODE_GRAPH
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(copy.deepcopy(TEST_NINE_NODE_GRAPH))
+    monkeypatch.setattr(app_module, "global_graph", graph, raising=False)
+    monkeypatch.setattr(app_module, "response_cache", LRUCache(64))
+    return graph
+
+
+@pytest.fixture
+def client(graph):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def pooled_app(monkeypatch):
+    """The app as configured to send outage batches of any size to a pool of 2 workers"""
+    monkeypatch.delenv("FLASK_ENV", raising=False)
+    monkeypatch.delenv("DEBUG", raising=False)
+    monkeypatch.setenv("SNAPSHOT_STORE_DIR", "")
+    monkeypatch.setenv("OUTAGE_BATCH_WORKERS", "2")
+    monkeypatch.setenv("OUTAGE_BATCH_MIN_SCENARIO_ROUTERS_PER_WORKER", "1")
+    importlib.reload(app_module)
+
+    yield app_module
+
+    app_module.outage_batch_runner.shutdown()
+    monkeypatch.undo()
+    importlib.reload(app_module)
+
+
+def post_outage_batch(client, graph):
+    scenarios = [([], [["10.69.0.1", "10.69.0.2"]]), (["10.69.0.3"], [])]
+    response = client.post(
+        "/simulate-outages",
+        json={"scenarios": [{"nodes": nodes, "edges": edges} for nodes, edges in scenarios]},
+    )
+    assert response.status_code == 200
+
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    for result in results:
+        (i,) = result["indices"]
+        expected_outage_lists = graph.get_outage_lists(*scenarios[i])
+        assert result["outage_lists"] == json.loads(json.dumps(expected_outage_lists))
+
+    assert sorted(result["indices"] for result in results) == [[0], [1]]
+
+
+def test_cached_response_is_conditional(client):
+    for url in ["/neighbors/10.69.0.1", "/path/10.69.0.1/10.69.0.3", "/edges/10.69.0.1/10.69.0.2"]:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers["Cache-Control"] == "no-cache"
+        etag = response.headers["ETag"]
+
+        not_modified_response = client.get(url, headers={"If-None-Match": etag})
+        assert not_modified_response.status_code == 304
+        assert not_modified_response.data == b""
+        assert not_modified_response.headers["ETag"] == etag
+
+        assert client.get(url, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_canonical_outage_arguments_share_a_cache_entry(client, monkeypatch):
+    simulate_calls = []
+    simulate_outage = OSPFGraph.simulate_outage
+
+    def counting_simulate_outage(self, nodes, edges):
+        simulate_calls.append((nodes, edges))
+        return simulate_outage(self, nodes, edges)
+
+    monkeypatch.setattr(OSPFGraph, "simulate_outage", counting_simulate_outage)
+
+    responses = [
+        client.get("/simulate-outage?nodes=10.69.0.3,10.69.0.4&edges=10.69.0.1->10.69.0.2"),
+        client.get("/simulate-outage?nodes=10.69.0.4,10.69.0.3&edges=10.69.0.2->10.69.0.1"),
+    ]
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert responses[0].data == responses[1].data
+    assert responses[0].headers["ETag"] == responses[1].headers["ETag"]
+    assert len(simulate_calls) == 1
+    assert len(app_module.response_cache) == 1
+
+
+def test_missing_edges_are_not_cached(client):
+    for _ in range(2):
+        response = client.get("/edges/10.69.0.1/10.69.0.3")
+        assert response.status_code == 404
+        assert "Couldn't find edge" in response.get_data(as_text=True)
+
+    assert len(app_module.response_cache) == 0
+
+
+def test_cached_responses_follow_the_snapshot(client, graph):
+    url = "/edges/10.69.0.1/10.69.0.2"
+    response = client.get(url)
+    assert response.json["edges"][0]["weight"] == 10
+
+    # New content
+    link_data = copy.deepcopy(TEST_NINE_NODE_GRAPH)
+    link_data["updated"] += 60
+    link_data["areas"]["0.0.0.0"]["routers"]["10.69.0.1"]["links"]["router"][0]["metric"] = 1000
+    graph.update_link_data(copy.deepcopy(link_data))
+
+    changed_response = client.get(url, headers={"If-None-Match": response.headers["ETag"]})
+    assert changed_response.status_code == 200
+    assert changed_response.json["edges"][0]["weight"] == 1000
+
+    # The same content re-published, which still moves the updated time
+    link_data["updated"] += 60
+    graph.update_link_data(copy.deepcopy(link_data))
+
+    republished_response = client.get(
+        url, headers={"If-None-Match": changed_response.headers["ETag"]}
+    )
+    assert republished_response.status_code == 200
+    assert republished_response.json["updated"] == link_data["updated"]
+    assert not republished_response.json["stale"]
+
+    # As if the last refresh failed
+    graph._stale_since = datetime.datetime.now()
+
+    stale_response = client.get(
+        url, headers={"If-None-Match": republished_response.headers["ETag"]}
+    )
+    assert stale_response.status_code == 200
+    assert stale_response.json["stale"]
+
+
+def test_criticality_rejects_invalid_limits(client):
+    for limit in ["-1", "ten"]:
+        response = client.get(f"/criticality?limit={limit}")
+        assert response.status_code == 400
+        assert "Invalid limit" in response.get_data(as_text=True)
+
+
+def test_small_outage_batch_runs_in_request(client, graph):
+    post_outage_batch(client, graph)
+    assert app_module.outage_batch_runner._pool is None
+
+
+def test_outage_batch_runs_in_configured_pool(pooled_app, graph, client):
+    assert pooled_app.outage_batch_runner.max_workers == 2
+
+    post_outage_batch(client, graph)
+    assert pooled_app.outage_batch_runner._pool is not None
@@ -0,0 +1,108 @@
+import copy
+import pickle
+
+from nycmesh_ospf_explorer.batch import OutageBatchRunner
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from test_graph import TEST_NINE_NODE_GRAPH, TEST_REAL_GRAPH_SEP_2023
+
+
+def test_canonicalize_outage_scenario():
+    assert OSPFGraph.canonicalize_outage_scenario(
+        ["10.69.0.2", "10.69.0.1", "10.69.0.2"],
+        [("10.69.0.3", "10.69.0.1"), ["10.69.0.1", "10.69.0.3"]],
+    ) == (("10.69.0.1", "10.69.0.2"), (("10.69.0.1", "10.69.0.3"),))
+
+
+def test_outage_snapshot_can_be_pickled():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_REAL_GRAPH_SEP_2023)
+    router_id = sorted(graph._graph.nodes)[0]
+    other_router_id = next(iter(graph._graph[router_id]))
+
+    # Make sure the lazily built state is pickled safely too
+    graph._egress_forest.euler_order
+    graph._egress_return_paths.get_routers_crossing([router_id], [])
+
+    unpickled_graph = OSPFGraph(
+        load_data=False, snapshot=pickle.loads(pickle.dumps(graph.outage_snapshot()))
+    )
+
+    for scenario in [([router_id], []), ([], [(router_id, other_router_id)])]:
+        assert unpickled_graph.get_outage_lists(*scenario) == graph.get_outage_lists(*scenario)
+
+
+def test_batch_runner_inline():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_NINE_NODE_GRAPH)
+
+    scenarios = [
+        (["10.69.0.1"], []),
+        ([], [("10.69.0.1", "10.69.0.2")]),
+        ([], [("10.69.0.2", "10.69.0.1")]),
+    ]
+    results = list(OutageBatchRunner(max_workers=1).run(graph, scenarios))
+
+    assert results == [
+        ([0], (("10.69.0.1",), ()), graph.get_outage_lists(["10.69.0.1"], [])),
+        (
+            [1, 2],
+            ((), (("10.69.0.1", "10.69.0.2"),)),
+            graph.get_outage_lists([], [("10.69.0.1", "10.69.0.2")]),
+        ),
+    ]
+
+
+def test_batch_runner_process_pool():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_REAL_GRAPH_SEP_2023)
+
+    router_ids = sorted(graph._graph.nodes)[::25]
+    scenarios = [([router_id], []) for router_id in router_ids]
+    scenarios += [
+        ([], [(router_id, next(iter(graph._graph[router_id])))]) for router_id in router_ids
+    ]
+
+    runner = OutageBatchRunner(max_workers=2, min_scenario_routers_per_worker=1)
+    results = list(runner.run(graph, scenarios))
+    runner.shutdown()
+
+    assert sorted(index for indices, _, _ in results for index in indices) == list(
+        range(len(scenarios))
+    )
+    for indices, (nodes, edges), outage_lists in results:
+        assert outage_lists == graph.get_outage_lists(*scenarios[indices[0]])
+        assert (nodes, edges) == OSPFGraph.canonicalize_outage_scenario(*scenarios[indices[0]])
+
+
+def test_batch_runner_keeps_pool_per_snapshot():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(copy.deepcopy(TEST_NINE_NODE_GRAPH))
+
+    scenarios = [(["10.69.0.1"], []), (["10.69.0.2"], [])]
+    runner = OutageBatchRunner(max_workers=2, min_scenario_routers_per_worker=1)
+    try:
+        # Small batches don't start a pool at all
+        inline_runner = OutageBatchRunner(max_workers=2)
+        list(inline_runner.run(graph, scenarios))
+        assert inline_runner._pool is None
+
+        list(runner.run(graph, scenarios))
+        pool = runner._pool
+        assert pool is not None
+
+        # Re-published link data keeps the same routing, and so the same pool
+        link_data = copy.deepcopy(TEST_NINE_NODE_GRAPH)
+        link_data["updated"] += 60
+        graph.update_link_data(copy.deepcopy(link_data))
+        list(runner.run(graph, scenarios))
+        assert runner._pool is pool
+
+        link_data["updated"] += 60
+        link_data["areas"]["0.0.0.0"]["routers"]["10.69.0.1"]["links"]["router"][0]["metric"] = 1000
+        graph.update_link_data(copy.deepcopy(link_data))
+        results = list(runner.run(graph, scenarios))
+        assert runner._pool is not pool
+        for indices, _, outage_lists in results:
+            assert outage_lists == graph.get_outage_lists(*scenarios[indices[0]])
+    finally:
+        runner.shutdown()
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+from nycmesh_ospf_explorer.cache import LRUCache, SingleFlight
+
+
+def test_lru_cache_get_and_put():
+    cache = LRUCache(max_entries=2)
+
+    assert cache.get("a") is None
+    assert cache.get("a", 5) == 5
+
+    cache.put("a", 1)
+    cache.put("b", 2)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") == 2
+    assert len(cache) == 2
+    assert "a" in cache
+    assert "c" not in cache
+
+
+def test_lru_cache_evicts_least_recently_used_entry():
+    cache = LRUCache(max_entries=2)
+
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+
+
+def test_lru_cache_evicts_by_size():
+    cache = LRUCache(max_entries=10, max_size=10, size_of=len)
+
+    cache.put("a", "xxxx")
+    cache.put("b", "xxxx")
+    assert cache.total_size == 8
+
+    cache.put("c", "xxxx")
+    assert "a" not in cache
+    assert cache.total_size == 8
+
+    # Replacing an entry should account for the size of the old value going away
+    cache.put("c", "x")
+    assert cache.total_size == 5
+
+    # Values that could never fit don't evict anything
+    cache.put("d", "x" * 11)
+    assert "d" not in cache
+    assert len(cache) == 2
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.total_size == 0
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(single_flight.do("key", slow_load)))
+        for _ in range(5)
+    ]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == ["result"] * 5
+
+    # Once the call finishes, the next one for the same key runs again
+    assert single_flight.do("key", lambda: "new result") == "new result"
+
+
+def test_single_flight_shares_exceptions():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing_load():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            single_flight.do("key", failing_load)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 3
+
+    with pytest.raises(RuntimeError):
+        single_flight.do("key", failing_load)
@@ -0,0 +1,127 @@
+import copy
+import threading
+import time
+
+from nycmesh_ospf_explorer.batch import OutageBatchRunner
+from nycmesh_ospf_explorer.criticality import CriticalityIndex, CriticalityTable
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from test_graph import TEST_NINE_NODE_GRAPH, TEST_REAL_GRAPH_SEP_2023
+
+
+def expected_counts(graph: OSPFGraph, nodes, edges):
+    outage_lists = graph.get_outage_lists(nodes, edges)
+    return len(outage_lists["offline"]), len(outage_lists["rerouted"])
+
+
+def test_outage_counts_match_outage_lists():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_REAL_GRAPH_SEP_2023)
+
+    scenarios = [([router_id], []) for router_id in graph._graph.nodes]
+    scenarios += [([], [edge]) for edge in list(graph._graph.edges())[::3]]
+
+    assert graph.get_outage_counts(scenarios) == [
+        expected_counts(graph, nodes, edges) for nodes, edges in scenarios
+    ]
+
+
+def test_criticality_table():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_NINE_NODE_GRAPH)
+
+    table = CriticalityTable.compute(graph, OutageBatchRunner(max_workers=1))
+
+    assert len(table.routers) == 9
+    assert len(table.links) == len({tuple(sorted(edge)) for edge in graph._graph.edges()})
+    for row in table.routers:
+        assert (row["offline"], row["rerouted"]) == expected_counts(graph, [row["id"]], [])
+    for row in table.links:
+        assert (row["offline"], row["rerouted"]) == expected_counts(graph, [], [row["routers"]])
+
+    routers, links = table.top("offline", limit=3)
+    assert len(routers) == 3 and len(links) == 3
+    assert routers[0]["offline"] == max(row["offline"] for row in table.routers)
+
+    routers, _ = table.top("impact")
+    impacts = [row["offline"] + row["rerouted"] for row in routers]
+    assert impacts == sorted(impacts, reverse=True)
+
+
+def test_criticality_table_process_pool():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_REAL_GRAPH_SEP_2023)
+
+    runner = OutageBatchRunner(max_workers=2, min_count_routers_per_worker=1)
+    assert CriticalityTable.compute(graph, runner) == CriticalityTable.compute(
+        graph, OutageBatchRunner(max_workers=1)
+    )
+    runner.shutdown()
+
+
+class BlockingOutageBatchRunner(OutageBatchRunner):
+    """Only finishes counting once allowed to, so we can look at the index in the meantime"""
+
+    def __init__(self):
+        super().__init__(max_workers=1)
+        self.allow_count = threading.Event()
+        self.count_calls = 0
+
+    def count(self, graph, scenarios):
+        self.count_calls += 1
+        self.allow_count.wait()
+        return super().count(graph, scenarios)
+
+
+def wait_for_current_table(index: CriticalityIndex, graph: OSPFGraph):
+    for _ in range(100):
+        table, is_current = index.get(graph)
+        if is_current:
+            return table
+        time.sleep(0.05)
+
+
+def test_criticality_index_follows_snapshots():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(copy.deepcopy(TEST_NINE_NODE_GRAPH))
+    index = CriticalityIndex(OutageBatchRunner(max_workers=1))
+
+    first_table = wait_for_current_table(index, graph)
+    assert first_table is not None
+    assert index.get(graph) == (first_table, True)
+
+    graph.update_link_data(TEST_REAL_GRAPH_SEP_2023, incremental=False)
+    second_table = wait_for_current_table(index, graph)
+    assert second_table is not None
+    assert len(second_table.routers) == len(graph._graph.nodes)
+
+
+def test_criticality_index_serves_previous_table_until_ready():
+    link_data = copy.deepcopy(TEST_NINE_NODE_GRAPH)
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(copy.deepcopy(link_data))
+
+    runner = BlockingOutageBatchRunner()
+    index = CriticalityIndex(runner)
+    assert index.get(graph) == (None, False)
+    runner.allow_count.set()
+    first_table = wait_for_current_table(index, graph)
+
+    # Re-published without changes, the table is kept rather than computed again
+    link_data["updated"] += 60
+    graph.update_link_data(copy.deepcopy(link_data))
+    table, is_current = index.get(graph)
+    assert is_current and table.routers == first_table.routers
+    assert table.updated == link_data["updated"]
+    assert runner.count_calls == 1
+
+    # Changed, the previous table is served (as not current) until the new one is ready
+    runner.allow_count.clear()
+    link_data["updated"] += 60
+    link_data["areas"]["0.0.0.0"]["routers"]["10.69.0.1"]["links"]["router"][0]["metric"] = 1000
+    graph.update_link_data(copy.deepcopy(link_data))
+    assert index.get(graph) == (table, False)
+
+    runner.allow_count.set()
+    new_table = wait_for_current_table(index, graph)
+    assert new_table is not None and new_table.updated == link_data["updated"]
+    assert runner.count_calls == 2
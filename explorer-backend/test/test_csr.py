@@ -0,0 +1,132 @@
+import networkx as nx
+from nycmesh_ospf_explorer.csr import CSRGraph
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from test_graph import TEST_FOUR_NODE_GRAPH, TEST_REAL_GRAPH_SEP_2023
+
+
+def load_networkx_graph(link_data: dict) -> nx.MultiDiGraph:
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(link_data)
+    return graph._graph
+
+
+def csr_edges(csr: CSRGraph):
+    return [
+        (csr.node_ids[node], csr.node_ids[other_node], weight)
+        for node in range(len(csr))
+        for other_node, weight in csr.out_edges(node)
+    ]
+
+
+def test_from_networkx():
+    graph = load_networkx_graph(TEST_FOUR_NODE_GRAPH)
+    csr = CSRGraph.from_networkx(graph)
+
+    assert csr.node_ids == ["10.69.0.1", "10.69.0.2", "10.69.0.3", "10.70.0.4"]
+    assert csr.index["10.69.0.3"] == 2
+    assert "10.69.0.3" in csr
+    assert "10.69.0.5" not in csr
+    assert len(csr) == 4
+    assert csr.edge_count == 8
+
+    assert csr_edges(csr) == list(graph.edges(data="weight"))
+    assert csr.out_degree(csr.index["10.69.0.3"]) == 3
+    assert csr.edge_weights(csr.index["10.69.0.3"], csr.index["10.70.0.4"]) == [10, 100]
+    assert csr.edge_weights(csr.index["10.69.0.1"], csr.index["10.70.0.4"]) == []
+
+
+def test_reverse_matches_networkx():
+    graph = load_networkx_graph(TEST_REAL_GRAPH_SEP_2023)
+    csr = CSRGraph.from_networkx(graph)
+
+    assert csr_edges(csr.reverse()) == list(graph.reverse().edges(data="weight"))
+    assert csr.reverse().reverse() is csr
+
+
+def test_dijkstra_matches_networkx():
+    graph = load_networkx_graph(TEST_REAL_GRAPH_SEP_2023)
+    csr = CSRGraph.from_networkx(graph)
+
+    for source in list(graph.nodes)[::25]:
+        expected_dist, expected_paths = nx.single_source_dijkstra(graph, source)
+        dist, pred, pred_weight = csr.dijkstra([(csr.index[source], 0)])
+
+        assert {
+            csr.node_ids[node]: node_dist
+            for node, node_dist in enumerate(dist)
+            if node_dist is not None
+        } == expected_dist
+
+        for node_id, expected_path in expected_paths.items():
+            path = csr.path_from_predecessors(pred, pred_weight, csr.index[node_id])
+            assert [hop for hop, _ in path] == expected_path
+            assert path[0][1] is None
+            assert sum(cost for _, cost in path[1:]) == expected_dist[node_id]
+
+
+def test_dijkstra_cutoff():
+    graph = load_networkx_graph(TEST_FOUR_NODE_GRAPH)
+    csr = CSRGraph.from_networkx(graph)
+
+    dist, _, _ = csr.dijkstra([(csr.index["10.70.0.4"], 0)], cutoff=10)
+    assert dist == [None, None, 10, 0]
+
+    dist, pred, pred_weight = csr.dijkstra(
+        [(csr.index["10.69.0.1"], 5), (csr.index["10.70.0.4"], 0)]
+    )
+    assert dist == [5, 15, 10, 0]
+    assert pred == [-1, 0, 3, -1]
+    assert pred_weight == [None, 10, 10, None]
+
+
+def test_bfs_matches_networkx():
+    graph = load_networkx_graph(TEST_REAL_GRAPH_SEP_2023)
+    csr = CSRGraph.from_networkx(graph)
+
+    for source in list(graph.nodes)[::50]:
+        for depth in range(4):
+            expected = nx.single_source_shortest_path_length(graph, source, cutoff=depth)
+            assert {csr.node_ids[node] for node in csr.bfs(csr.index[source], depth)} == set(
+                expected
+            )
+
+
+def test_subgraph_matches_networkx():
+    graph = load_networkx_graph(TEST_REAL_GRAPH_SEP_2023)
+    csr = CSRGraph.from_networkx(graph)
+
+    node_ids = list(graph.nodes)[::3]
+    subgraph = csr.subgraph(csr.index[node_id] for node_id in node_ids)
+
+    expected_subgraph = graph.subgraph(node_ids)
+    assert subgraph.node_ids == [node_id for node_id in graph.nodes if node_id in set(node_ids)]
+    assert sorted(csr_edges(subgraph)) == sorted(expected_subgraph.edges(data="weight"))
+
+
+def test_bounded_bfs_stops_at_node_budget():
+    graph = load_networkx_graph(TEST_REAL_GRAPH_SEP_2023)
+    csr = CSRGraph.from_networkx(graph)
+
+    source = list(graph.nodes)[0]
+    distances = nx.single_source_shortest_path_length(graph, source)
+
+    nodes, depth, truncated = csr.bounded_bfs(csr.index[source], 100)
+    assert not truncated
+    assert len(nodes) == len(distances)
+    assert depth == max(distances.values())
+
+    max_nodes = len(distances) // 2
+    nodes, depth, truncated = csr.bounded_bfs(csr.index[source], 100, max_nodes)
+    assert truncated
+    assert len(nodes) == max_nodes
+
+    # Nearest first, and every router up to depth hops away is included
+    node_distances = [distances[csr.node_ids[node]] for node in nodes]
+    assert node_distances == sorted(node_distances)
+    assert {node_id for node_id, distance in distances.items() if distance <= depth} <= {
+        csr.node_ids[node] for node in nodes
+    }
+    assert max(node_distances) == depth + 1
+
+    # Exactly enough budget for everything isn't truncated
+    assert not csr.bounded_bfs(csr.index[source], 100, len(distances))[2]
@@ -0,0 +1,75 @@
+import networkx as nx
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from test_graph import (
+    TEST_NINE_NODE_GRAPH,
+    TEST_NINE_NODE_GRAPH_WITH_ASYMMETRIC_COSTS,
+    TEST_REAL_GRAPH_SEP_2023,
+)
+
+
+def get_dependent_nodes_with_spf(graph: OSPFGraph, nodes, edges):
+    outage_egress_forest, _ = graph._get_outage_egress_state(graph._get_outage_mask(nodes, edges))
+    return graph.get_dependent_nodes(nodes, edges, outage_egress_forest)
+
+
+def test_single_failures_match_spf():
+    for link_data in [
+        TEST_NINE_NODE_GRAPH,
+        TEST_NINE_NODE_GRAPH_WITH_ASYMMETRIC_COSTS,
+        TEST_REAL_GRAPH_SEP_2023,
+    ]:
+        graph = OSPFGraph(load_data=False)
+        graph.update_link_data(link_data)
+
+        for router_id in graph._graph.nodes:
+            assert graph.get_dependent_nodes([router_id], []) == get_dependent_nodes_with_spf(
+                graph, [router_id], []
+            )
+
+        for edge in graph._graph.edges():
+            assert graph.get_dependent_nodes([], [edge]) == get_dependent_nodes_with_spf(
+                graph, [], [edge]
+            )
+
+
+def test_dominated_routers_lose_all_egress():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_REAL_GRAPH_SEP_2023)
+
+    exits = set(graph._egress_forest.get_exit_node(node) for node in graph._graph.nodes)
+    exits.discard(None)
+
+    for router_id in list(graph._graph.nodes)[::20]:
+        modified_graph = graph._graph.copy()
+        modified_graph.remove_node(router_id)
+        can_egress = set()
+        for exit_id in exits - {router_id}:
+            can_egress |= nx.ancestors(modified_graph, exit_id) | {exit_id}
+
+        assert graph._dominator_tree.get_dominated_routers([router_id], []) == (
+            set(modified_graph.nodes) - can_egress
+        )
+
+
+def test_single_points_of_failure():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_NINE_NODE_GRAPH)
+
+    # 10.69.0.9 only hangs off of 10.69.0.1, which itself has two ways out
+    assert graph._dominator_tree.get_single_points_of_failure("10.69.0.9") == (
+        ["10.69.0.1"],
+        [("10.69.0.1", "10.69.0.9")],
+    )
+    assert graph._dominator_tree.get_dominated_routers([], [("10.69.0.9", "10.69.0.1")]) == {
+        "10.69.0.9"
+    }
+
+
+def test_get_single_points_of_failure_dict():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_NINE_NODE_GRAPH)
+
+    assert graph.get_single_points_of_failure("10.69.0.1") == {
+        "points_of_failure": {"routers": [], "links": []},
+        "dependents": ["10.69.0.9"],
+    }
@@ -0,0 +1,237 @@
+import networkx as nx
+from nycmesh_ospf_explorer.csr import CSRGraph
+from nycmesh_ospf_explorer.egress import EgressForest, EgressReturnPaths, compute_egress_spf
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from test_graph import (
+    TEST_FOUR_NODE_GRAPH,
+    TEST_NINE_NODE_GRAPH_WITH_ASYMMETRIC_COSTS,
+    TEST_REAL_GRAPH_SEP_2023,
+)
+
+
+def load_graph(link_data: dict) -> OSPFGraph:
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(link_data)
+    return graph
+
+
+def networkx_egress_forest(graph: nx.MultiDiGraph) -> nx.DiGraph:
+    """
+    Reference implementation: add a placeholder node for each exit, reverse the whole graph
+    and keep the second to last hop of every multi-source shortest path
+    """
+    graph_with_exit_placeholders = graph.copy()
+    exit_placeholders = set()
+    for node_id, node_data in graph.nodes.data():
+        exit_cost = OSPFGraph._get_exit_cost(node_data)
+        if exit_cost is not None:
+            graph_with_exit_placeholders.add_edge(node_id, node_id + "_0.0.0.0/0", weight=exit_cost)
+            graph_with_exit_placeholders.add_edge(node_id + "_0.0.0.0/0", node_id, weight=exit_cost)
+            exit_placeholders.add(node_id + "_0.0.0.0/0")
+
+    graph_with_exit_placeholders = graph_with_exit_placeholders.reverse()
+    paths = nx.multi_source_dijkstra_path(graph_with_exit_placeholders, exit_placeholders)
+
+    egress_forest = nx.DiGraph()
+    for node_id, egress_path in paths.items():
+        if len(egress_path) > 1:
+            egress_forest.add_edge(
+                node_id,
+                egress_path[-2],
+                weight=min(
+                    edge_data["weight"]
+                    for edge_data in graph_with_exit_placeholders[egress_path[-2]][node_id].values()
+                ),
+            )
+
+    return egress_forest
+
+
+def test_compute_egress_spf():
+    graph = load_graph(TEST_FOUR_NODE_GRAPH)
+    csr = graph._csr
+
+    parent, dist = compute_egress_spf(csr, OSPFGraph._get_exit_costs(graph._graph, csr))
+
+    assert [csr.node_ids[node] if node != -1 else None for node in parent] == [
+        "10.69.0.2",
+        None,
+        "10.69.0.2",
+        "10.69.0.3",
+    ]
+    assert dist == [11, 1, 101, 111]
+
+
+def test_compute_egress_spf_unreachable():
+    graph = load_graph(TEST_FOUR_NODE_GRAPH)
+    csr = graph._csr
+
+    parent, dist = compute_egress_spf(csr, [])
+
+    assert parent == [-1, -1, -1, -1]
+    assert dist == [None, None, None, None]
+
+
+def test_egress_forest_matches_networkx():
+    graph = load_graph(TEST_REAL_GRAPH_SEP_2023)
+
+    assert sorted(OSPFGraph._compute_egress_forest(graph._graph).edges(data="weight")) == sorted(
+        networkx_egress_forest(graph._graph).edges(data="weight")
+    )
+
+
+def test_egress_forest_tables():
+    graph = load_graph(TEST_FOUR_NODE_GRAPH)
+    egress_forest = graph._egress_forest
+
+    assert list(egress_forest.exit_node) == [1, 1, 1, 1]
+    assert list(egress_forest.depth) == [1, 0, 1, 2]
+    assert list(egress_forest.children(1)) == [0, 2]
+    assert list(egress_forest.children(3)) == []
+
+    assert egress_forest.get_exit_node("10.70.0.4") == "10.69.0.2"
+    assert egress_forest.get_exit_cost("10.70.0.4") == 1
+    assert egress_forest.has_edge("10.70.0.4", "10.69.0.3")
+    assert not egress_forest.has_edge("10.69.0.3", "10.70.0.4")
+    assert egress_forest.get_exit_path("10.70.0.4") == [
+        ("10.70.0.4", None),
+        ("10.69.0.3", 10),
+        ("10.69.0.2", 100),
+        ("10.69.0.2_0.0.0.0/0", 1),
+    ]
+
+    assert "10.69.0.5" not in egress_forest
+    assert egress_forest.get_exit_path("10.69.0.5") is None
+    assert egress_forest.get_exit_node("10.69.0.5") is None
+
+
+def test_egress_forest_networkx_round_trip():
+    graph = load_graph(TEST_REAL_GRAPH_SEP_2023)
+    egress_forest = graph._egress_forest
+    networkx_forest = networkx_egress_forest(graph._graph)
+
+    assert sorted(egress_forest.to_networkx().edges(data="weight")) == sorted(
+        networkx_forest.edges(data="weight")
+    )
+
+    converted_forest = EgressForest.from_networkx(networkx_forest)
+    for node_id in graph._graph.nodes:
+        assert converted_forest.get_exit_path(node_id) == egress_forest.get_exit_path(node_id)
+
+
+def test_egress_forest_deep_chain():
+    # Far deeper than the recursion limit, to make sure nothing walks the forest recursively
+    chain_length = 5000
+    networkx_forest = nx.DiGraph()
+    networkx_forest.add_edge("0", "0_0.0.0.0/0", weight=5)
+    for i in range(1, chain_length):
+        networkx_forest.add_edge(str(i), str(i - 1), weight=1)
+
+    egress_forest = EgressForest.from_networkx(networkx_forest)
+
+    exit_path = egress_forest.get_exit_path(str(chain_length - 1))
+    assert len(exit_path) == chain_length + 1
+    assert exit_path[-1] == ("0_0.0.0.0/0", 5)
+    assert egress_forest.depth[egress_forest.index[str(chain_length - 1)]] == chain_length - 1
+    assert egress_forest.get_exit_cost(str(chain_length - 1)) == 5
+    assert len(OSPFGraph._get_upstream_nodes(egress_forest, "0")) == chain_length - 1
+
+
+def test_egress_forest_upstream_ranges_match_networkx():
+    graph = load_graph(TEST_REAL_GRAPH_SEP_2023)
+    egress_forest = graph._egress_forest
+    networkx_forest = networkx_egress_forest(graph._graph)
+
+    for node_id in list(graph._graph.nodes)[::7]:
+        assert egress_forest.get_upstream_nodes([node_id]) == nx.ancestors(networkx_forest, node_id)
+
+    node_ids = list(graph._graph.nodes)[::40]
+    assert egress_forest.get_upstream_nodes(node_ids) == set().union(
+        *(nx.ancestors(networkx_forest, node_id) for node_id in node_ids)
+    )
+
+
+def test_egress_return_paths_match_networkx():
+    graph = load_graph(TEST_REAL_GRAPH_SEP_2023)
+    egress_forest = networkx_egress_forest(graph._graph)
+
+    for node_id in graph._graph.nodes:
+        exit_path = OSPFGraph._get_exit_path_for_node(egress_forest, node_id)
+        if exit_path is None:
+            assert graph._egress_return_paths[node_id] is None
+            continue
+
+        exit_node_id = exit_path[-2][0]
+        expected_path = nx.dijkstra_path(graph._graph, exit_node_id, node_id)
+        return_path = graph._egress_return_paths[node_id]
+
+        assert [hop for hop, _ in return_path] == expected_path
+        assert return_path[0][1] is None
+        for (hop1, _), (hop2, cost) in zip(return_path, return_path[1:]):
+            assert cost == min(edge["weight"] for edge in graph._graph[hop1][hop2].values())
+
+
+def test_egress_return_paths_only_keeps_trees_for_used_exits():
+    graph = load_graph(TEST_NINE_NODE_GRAPH_WITH_ASYMMETRIC_COSTS)
+    csr = graph._csr
+
+    exit_by_node = [csr.index["10.69.0.2"]] * len(csr)
+    exit_by_node[csr.index["10.69.0.8"]] = -1
+    return_paths = EgressReturnPaths(csr, exit_by_node)
+
+    # Trees are only computed once a path needs them
+    assert list(return_paths._trees) == []
+    dict(return_paths)
+    assert list(return_paths._trees) == [csr.index["10.69.0.2"]]
+    assert len(return_paths) == 9
+    assert "10.69.0.8" in return_paths
+    assert "10.69.0.10" not in return_paths
+    assert return_paths["10.69.0.8"] is None
+    assert return_paths["10.69.0.2"] == [("10.69.0.2", None)]
+    assert return_paths["10.69.0.4"] == [
+        ("10.69.0.2", None),
+        ("10.69.0.6", 100),
+        ("10.69.0.7", 10),
+        ("10.69.0.4", 10),
+    ]
+
+
+def test_egress_return_paths_one_way_link():
+    graph = load_graph(TEST_FOUR_NODE_GRAPH)
+    csr = graph._csr
+
+    # 10.69.0.2 can reach 10.69.0.1 (and use it as an exit), but not the other way around
+    one_way_graph = graph._graph.copy()
+    one_way_graph.remove_edge("10.69.0.1", "10.69.0.2")
+    one_way_csr = CSRGraph.from_networkx(one_way_graph)
+
+    return_paths = EgressReturnPaths(one_way_csr, [-1, csr.index["10.69.0.1"], -1, -1])
+    assert return_paths["10.69.0.2"] is None
+
+
+def test_egress_return_paths_routers_crossing_matches_scan():
+    graph = load_graph(TEST_REAL_GRAPH_SEP_2023)
+    return_paths = graph._egress_return_paths
+    node_ids = list(graph._graph.nodes)
+
+    def scan(dropped_nodes, dropped_links):
+        crossing = set()
+        for router_id, return_path in return_paths.items():
+            hops = [hop for hop, _ in return_path or []]
+            if any(hop in dropped_nodes and hop != router_id for hop in hops):
+                crossing.add(router_id)
+            if any({hop1, hop2} in dropped_links for hop1, hop2 in zip(hops, hops[1:])):
+                crossing.add(router_id)
+
+        return crossing
+
+    for node_id in node_ids[::11]:
+        links = [(node_id, other_node_id) for other_node_id in graph._graph[node_id]]
+        assert return_paths.get_routers_crossing([node_id], []) == scan({node_id}, [])
+        assert return_paths.get_routers_crossing([], links) == scan(
+            set(), [set(link) for link in links]
+        )
+
+    assert (
+        return_paths.get_routers_crossing(["10.69.0.999"], [("10.69.0.999", node_ids[0])]) == set()
+    )
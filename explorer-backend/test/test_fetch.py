@@ -0,0 +1,266 @@
+import copy
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import urlpath
+from nycmesh_ospf_explorer import graph as graph_module
+from nycmesh_ospf_explorer.fetch import (
+    CircuitOpenError,
+    FetchPolicy,
+    LinkDBFetcher,
+    LinkDBFetchError,
+)
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from nycmesh_ospf_explorer.linkdb import LinkDB
+from test_graph import TEST_FOUR_NODE_GRAPH, TEST_NINE_NODE_GRAPH
+
+
+class LinkDBServer:
+    """A local stand-in for the linkdb API, which supports conditional requests"""
+
+    def __init__(self, link_data: dict, etag: str = '"v1"', last_modified: str = None):
+        self.link_data = link_data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.requests = []
+        self.client_ports = set()
+        # How many of the next requests get a 500 (-1 for all of them), and how long to stall
+        # before responding to each one
+        self.failures_to_serve = 0
+        self.delay = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                server.client_ports.add(self.client_address[1])
+                time.sleep(server.delay)
+
+                if server.failures_to_serve != 0:
+                    server.failures_to_serve -= 1
+                    self.send_response(500)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                if self.path != "/linkdb":
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                not_modified = (
+                    server.etag is not None and self.headers.get("If-None-Match") == server.etag
+                ) or (
+                    server.last_modified is not None
+                    and self.headers.get("If-Modified-Since") == server.last_modified
+                )
+                if not_modified:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                body = json.dumps(server.link_data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if server.etag is not None:
+                    self.send_header("ETag", server.etag)
+                if server.last_modified is not None:
+                    self.send_header("Last-Modified", server.last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}/linkdb"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def test_conditional_fetch_with_etag():
+    with LinkDBServer(TEST_NINE_NODE_GRAPH) as server:
+        fetcher = LinkDBFetcher()
+
+        link_db = fetcher.fetch(server.url)
+        assert link_db.routers == LinkDB.from_json(TEST_NINE_NODE_GRAPH).routers
+        assert link_db.source.etag == '"v1"'
+        assert "If-None-Match" not in server.requests[0]
+
+        assert fetcher.fetch(server.url, link_db.source) is None
+        assert server.requests[1]["If-None-Match"] == '"v1"'
+
+        server.link_data = TEST_FOUR_NODE_GRAPH
+        server.etag = '"v2"'
+        link_db = fetcher.fetch(server.url, link_db.source)
+        assert link_db.routers.keys() == TEST_FOUR_NODE_GRAPH["areas"]["0.0.0.0"]["routers"].keys()
+
+        # Every request went over the same pooled connection
+        assert len(server.client_ports) == 1
+
+
+def test_conditional_fetch_with_last_modified():
+    last_modified = "Sat, 30 Sep 2023 00:00:00 GMT"
+    with LinkDBServer(TEST_NINE_NODE_GRAPH, etag=None, last_modified=last_modified) as server:
+        fetcher = LinkDBFetcher()
+
+        link_db = fetcher.fetch(server.url)
+        assert link_db.source.last_modified == last_modified
+        assert fetcher.fetch(server.url, link_db.source) is None
+        assert server.requests[1]["If-Modified-Since"] == last_modified
+
+        # Validators are only ever sent back to the URL they came from
+        with pytest.raises(RuntimeError):
+            fetcher.fetch(server.url.replace("/linkdb", "/other"), link_db.source)
+        assert "If-Modified-Since" not in server.requests[2]
+
+
+def test_refresh_skips_unchanged_link_data(monkeypatch):
+    with LinkDBServer(copy.deepcopy(TEST_NINE_NODE_GRAPH)) as server:
+        monkeypatch.setattr(graph_module, "API_URL", server.url)
+
+        graph = OSPFGraph(fetcher=LinkDBFetcher())
+        assert graph.contains_router("10.69.0.9")
+        snapshot = graph.snapshot
+
+        # Not modified, so there's nothing to download, parse or rebuild
+        graph.update_link_data()
+        assert graph.snapshot is snapshot
+        assert len(server.requests) == 2
+
+        # Re-published with a new timestamp, but the same content: only the timestamp changes
+        server.link_data["updated"] += 60
+        server.etag = '"v2"'
+        graph.update_link_data()
+        assert graph.snapshot is not snapshot
+        assert graph.last_updated == snapshot.last_updated + datetime.timedelta(seconds=60)
+        assert graph._graph is snapshot.graph
+        assert graph._egress_forest is snapshot.egress_forest
+
+
+def test_fetch_retries_server_errors():
+    with LinkDBServer(TEST_NINE_NODE_GRAPH) as server:
+        fetcher = LinkDBFetcher(policy=FetchPolicy(max_attempts=3, backoff=0.01))
+
+        server.failures_to_serve = 2
+        assert (
+            fetcher.fetch(server.url).routers.keys()
+            == LinkDB.from_json(TEST_NINE_NODE_GRAPH).routers.keys()
+        )
+        assert len(server.requests) == 3
+
+        server.failures_to_serve = 3
+        with pytest.raises(LinkDBFetchError):
+            fetcher.fetch(server.url)
+        assert len(server.requests) == 6
+
+        # Not found isn't going to change if we ask again
+        with pytest.raises(LinkDBFetchError):
+            fetcher.fetch(server.url.replace("/linkdb", "/other"))
+        assert len(server.requests) == 7
+
+
+def test_fetch_deadline_bounds_hanging_server():
+    with LinkDBServer(TEST_NINE_NODE_GRAPH) as server:
+        fetcher = LinkDBFetcher(
+            policy=FetchPolicy(read_timeout=0.2, deadline=0.5, max_attempts=10, backoff=0.01)
+        )
+
+        server.delay = 1
+        start = time.monotonic()
+        with pytest.raises(LinkDBFetchError):
+            fetcher.fetch(server.url)
+        assert time.monotonic() - start < 0.9
+
+
+def test_circuit_breaker_fails_fast_then_recovers():
+    with LinkDBServer(TEST_NINE_NODE_GRAPH) as server:
+        fetcher = LinkDBFetcher(
+            policy=FetchPolicy(max_attempts=1, breaker_failure_threshold=2, breaker_cooldown=0.3)
+        )
+
+        server.failures_to_serve = -1
+        for _ in range(2):
+            with pytest.raises(LinkDBFetchError):
+                fetcher.fetch(server.url)
+
+        # Open, so we don't bother the server at all
+        with pytest.raises(CircuitOpenError):
+            fetcher.fetch(server.url)
+        assert len(server.requests) == 2
+
+        # After the cooldown a single probe goes through, and its failure re-opens the breaker
+        time.sleep(0.3)
+        with pytest.raises(LinkDBFetchError):
+            fetcher.fetch(server.url)
+        with pytest.raises(CircuitOpenError):
+            fetcher.fetch(server.url)
+        assert len(server.requests) == 3
+
+        server.failures_to_serve = 0
+        time.sleep(0.3)
+        assert fetcher.fetch(server.url) is not None
+        assert not fetcher.get_breaker(server.url).is_open
+
+
+def test_history_failures_dont_open_live_breaker(monkeypatch):
+    with LinkDBServer(TEST_NINE_NODE_GRAPH) as server:
+        monkeypatch.setattr(graph_module, "API_URL", server.url)
+        monkeypatch.setattr(
+            graph_module, "HISTORY_API_BASE_URL", urlpath.URL(server.url) / "../history"
+        )
+        fetcher = LinkDBFetcher(policy=FetchPolicy(max_attempts=1, breaker_failure_threshold=2))
+        timestamp = datetime.datetime.fromtimestamp(1695999960)
+
+        # Timestamps the history API doesn't have (404s) are normal misses, not failures
+        for _ in range(3):
+            with pytest.raises(LinkDBFetchError) as exc_info:
+                OSPFGraph(load_data=False, fetcher=fetcher).update_from_timestamp(timestamp)
+            assert not isinstance(exc_info.value, CircuitOpenError)
+
+        # And the history API failing outright only cuts off history
+        server.failures_to_serve = 2
+        for _ in range(2):
+            with pytest.raises(LinkDBFetchError):
+                OSPFGraph(load_data=False, fetcher=fetcher).update_from_timestamp(timestamp)
+        with pytest.raises(CircuitOpenError):
+            OSPFGraph(load_data=False, fetcher=fetcher).update_from_timestamp(timestamp)
+
+        assert not fetcher.get_breaker(server.url).is_open
+        assert OSPFGraph(fetcher=fetcher).has_link_data
+
+
+def test_failed_refresh_serves_stale_snapshot(monkeypatch):
+    with LinkDBServer(TEST_NINE_NODE_GRAPH) as server:
+        monkeypatch.setattr(graph_module, "API_URL", server.url)
+
+        graph = OSPFGraph(fetcher=LinkDBFetcher(policy=FetchPolicy(max_attempts=1)))
+        snapshot = graph.snapshot
+        assert not graph.is_stale
+
+        server.failures_to_serve = -1
+        graph.update_if_needed(age_limit=datetime.timedelta(0))
+        assert graph.snapshot is snapshot
+        assert graph.is_stale
+        assert graph.pinned().is_stale
+
+        server.failures_to_serve = 0
+        graph.update_if_needed(age_limit=datetime.timedelta(0))
+        assert graph.snapshot is snapshot
+        assert not graph.is_stale
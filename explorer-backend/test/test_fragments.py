@@ -0,0 +1,32 @@
+import copy
+import dataclasses
+
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from test_graph import TEST_NINE_NODE_GRAPH, TEST_REAL_GRAPH_SEP_2023
+
+
+def test_fragments_match_per_request_json():
+    for link_data in [TEST_NINE_NODE_GRAPH, TEST_REAL_GRAPH_SEP_2023]:
+        graph = OSPFGraph(load_data=False)
+        graph.update_link_data(copy.deepcopy(link_data))
+        assert graph.snapshot.node_fragments is not None
+
+        unfragmented_graph = OSPFGraph(
+            load_data=False, snapshot=dataclasses.replace(graph.snapshot, node_fragments=None)
+        )
+        for router_id in sorted(graph._graph.nodes)[::25]:
+            for neighbor_depth in [1, 3, 6]:
+                for include_egress in [False, True]:
+                    assert graph.get_neighbors_dict(
+                        router_id, neighbor_depth, include_egress
+                    ) == unfragmented_graph.get_neighbors_dict(
+                        router_id, neighbor_depth, include_egress
+                    )
+
+
+def test_fragments_are_dropped_when_graph_is_modified():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(copy.deepcopy(TEST_NINE_NODE_GRAPH))
+
+    graph._egress_forest = graph._egress_forest
+    assert graph.snapshot.node_fragments is None
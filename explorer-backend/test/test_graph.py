@@ -1,7 +1,9 @@
+import copy
 import datetime
 import json
 import math
 import os
+import threading
 import time
 
 import networkx
@@ -888,6 +890,31 @@ def test_graph_with_isolated_node():
     ]
 
 
+def test_egress_forest_is_renumbered_to_csr_order():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(copy.deepcopy(TEST_NINE_NODE_GRAPH_WITH_ASYMMETRIC_COSTS))
+    router_ids = sorted(graph._graph.nodes)
+    expected_outage_lists = [graph.get_outage_lists([router_id], []) for router_id in router_ids]
+    expected_dominator_parents = list(graph._dominator_tree.tree.parent)
+
+    # The same forest, with its routers in the opposite order to the CSR graph
+    egress_forest = graph._egress_forest.to_networkx()
+    reordered_egress_forest = nx.DiGraph()
+    reordered_egress_forest.add_nodes_from(reversed(list(egress_forest.nodes)))
+    reordered_egress_forest.add_edges_from(egress_forest.edges(data=True))
+    assert [
+        node_id for node_id in reordered_egress_forest if node_id in graph._csr
+    ] != graph._csr.node_ids
+
+    graph._egress_forest = reordered_egress_forest
+
+    assert graph._egress_forest.node_ids == graph._csr.node_ids
+    assert list(graph._dominator_tree.tree.parent) == expected_dominator_parents
+    assert [
+        graph.get_outage_lists([router_id], []) for router_id in router_ids
+    ] == expected_outage_lists
+
+
 def test_multiple_exits():
     graph = OSPFGraph(load_data=False)
     graph.update_link_data(TEST_NINE_NODE_GRAPH)
@@ -1075,3 +1102,265 @@ def test_asymmetric():
         "10.69.0.8",
         "10.69.0.8_0.0.0.0/0",
     )
+
+
+def test_incremental_update_without_changes():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_NINE_NODE_GRAPH)
+
+    egress_forest = graph._egress_forest
+    egress_return_paths = graph._egress_return_paths
+
+    new_link_data = copy.deepcopy(TEST_NINE_NODE_GRAPH)
+    new_link_data["updated"] += 60
+    graph.update_link_data(new_link_data)
+
+    assert graph.last_updated == datetime.datetime.fromtimestamp(new_link_data["updated"])
+    assert graph._egress_forest is egress_forest
+    assert graph._egress_return_paths is egress_return_paths
+
+
+def test_incremental_update_matches_full_rebuild():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_NINE_NODE_GRAPH)
+
+    new_link_data = copy.deepcopy(TEST_NINE_NODE_GRAPH)
+    routers = new_link_data["areas"]["0.0.0.0"]["routers"]
+
+    # Re-metric the 1 <-> 2 link, which moves 1, 5 & 9 onto a different exit path
+    routers["10.69.0.1"]["links"]["router"][0]["metric"] = 1000
+    routers["10.69.0.2"]["links"]["router"][0]["metric"] = 1000
+
+    # Remove a router entirely, and add a new one hanging off of 10.69.0.4
+    del routers["10.69.0.9"]
+    routers["10.69.0.1"]["links"]["router"].pop()
+    routers["10.69.0.10"] = {"links": {"router": [{"id": "10.69.0.4", "metric": 10}]}}
+    routers["10.69.0.4"]["links"]["router"].append({"id": "10.69.0.10", "metric": 10})
+
+    graph.update_link_data(new_link_data)
+
+    full_rebuild_graph = OSPFGraph(load_data=False)
+    full_rebuild_graph.update_link_data(new_link_data)
+
+    assert set(graph._graph.edges(data="weight")) == set(
+        full_rebuild_graph._graph.edges(data="weight")
+    )
+    assert dict(graph._graph.nodes(data="networks")) == dict(
+        full_rebuild_graph._graph.nodes(data="networks")
+    )
+    assert set(graph._egress_forest.to_networkx().edges) == set(
+        full_rebuild_graph._egress_forest.to_networkx().edges
+    )
+    assert graph._egress_return_paths == full_rebuild_graph._egress_return_paths
+    assert graph.get_exit_path_for_node("10.69.0.10")[:-1] == [
+        ("10.69.0.10", None),
+        ("10.69.0.4", 10),
+        ("10.69.0.3", 10),
+        ("10.69.0.2", 100),
+    ]
+
+
+def test_incremental_update_repairs_raised_metrics():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_NINE_NODE_GRAPH)
+    dominator_tree = graph.snapshot.dominator_tree
+
+    link_data = copy.deepcopy(TEST_NINE_NODE_GRAPH)
+    routers = link_data["areas"]["0.0.0.0"]["routers"]
+    for metric in [1000, 10]:
+        # Raising the 1 <-> 2 metric moves 1, 5 & 9 onto a different exit path, then lowering it
+        # again moves them back
+        link_data["updated"] += 60
+        routers["10.69.0.1"]["links"]["router"][0]["metric"] = metric
+        routers["10.69.0.2"]["links"]["router"][0]["metric"] = metric
+        graph.update_link_data(copy.deepcopy(link_data))
+
+        full_rebuild_graph = OSPFGraph(load_data=False)
+        full_rebuild_graph.update_link_data(copy.deepcopy(link_data))
+
+        assert set(graph._egress_forest.to_networkx().edges) == set(
+            full_rebuild_graph._egress_forest.to_networkx().edges
+        )
+        assert graph._egress_return_paths == full_rebuild_graph._egress_return_paths
+        assert graph._egress_forest.node_ids is graph.snapshot.csr.node_ids
+
+        if metric == 1000:
+            # The same links are still there, so the dominators are too
+            assert graph.snapshot.dominator_tree.tree is dominator_tree.tree
+        else:
+            assert graph.snapshot.dominator_tree.tree is not dominator_tree.tree
+
+
+def test_incremental_update_of_network_missing_a_linked_router():
+    link_data = copy.deepcopy(TEST_REAL_GRAPH_SEP_2023)
+    network = link_data["areas"]["0.0.0.0"]["networks"]["10.70.76.0/24"]
+
+    # 10.69.2.27 still links to the network, but the network no longer lists it as attached
+    network["routers"].remove("10.69.2.27")
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(copy.deepcopy(link_data))
+    assert graph._graph.has_edge("10.69.2.27", "10.70.76.24")
+
+    link_data["updated"] += 60
+    network["routers"].remove("10.70.76.24")
+    graph.update_link_data(copy.deepcopy(link_data))
+
+    full_rebuild_graph = OSPFGraph(load_data=False)
+    full_rebuild_graph.update_link_data(copy.deepcopy(link_data))
+
+    assert not graph._graph.has_edge("10.69.2.27", "10.70.76.24")
+    assert set(graph._graph.edges(data="weight")) == set(
+        full_rebuild_graph._graph.edges(data="weight")
+    )
+
+
+def test_incremental_update_of_router_gaining_an_lsa_on_unchanged_network():
+    link_data = copy.deepcopy(TEST_REAL_GRAPH_SEP_2023)
+    routers = link_data["areas"]["0.0.0.0"]["routers"]
+
+    # Still listed on 10.70.76.0/24, but without an LSA of its own, so none of the network's
+    # edges lead to it
+    router = routers.pop("10.70.71.137")
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(copy.deepcopy(link_data))
+    assert "10.70.71.137" not in graph._full_graph
+
+    link_data["updated"] += 60
+    routers["10.70.71.137"] = router
+    graph.update_link_data(copy.deepcopy(link_data))
+
+    full_rebuild_graph = OSPFGraph(load_data=False)
+    full_rebuild_graph.update_link_data(copy.deepcopy(link_data))
+
+    assert graph._full_graph.has_edge("10.69.2.27", "10.70.71.137")
+    assert set(graph._full_graph.edges(data="weight")) == set(
+        full_rebuild_graph._full_graph.edges(data="weight")
+    )
+
+
+def test_pinned_graph_keeps_serving_snapshot():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_NINE_NODE_GRAPH)
+
+    pinned_graph = graph.pinned()
+    snapshot = graph.snapshot
+
+    graph.update_link_data(TEST_FOUR_NODE_GRAPH)
+
+    assert graph.snapshot is not snapshot
+    assert pinned_graph.snapshot is snapshot
+    assert pinned_graph.contains_router("10.69.0.9")
+    assert not graph.contains_router("10.69.0.9")
+    assert pinned_graph.get_exit_path_for_node("10.69.0.9")[:-1] == [
+        ("10.69.0.9", None),
+        ("10.69.0.1", 10),
+        ("10.69.0.2", 10),
+    ]
+
+
+def test_concurrent_refreshes_share_one_fetch(monkeypatch):
+    graph = OSPFGraph(load_data=False)
+
+    fetched_urls = []
+    release = threading.Event()
+
+    def slow_fetch(url):
+        fetched_urls.append(url)
+        release.wait(5)
+        return copy.deepcopy(TEST_NINE_NODE_GRAPH)
+
+    monkeypatch.setattr(OSPFGraph, "_fetch_link_data", staticmethod(slow_fetch))
+
+    threads = [threading.Thread(target=graph.update_if_needed) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(fetched_urls) == 1
+    assert graph.contains_router("10.69.0.9")
+
+    # The graph is fresh now, so there is nothing to do
+    graph.update_if_needed()
+    assert len(fetched_urls) == 1
+
+
+def test_neighborhoods_are_cached_per_snapshot():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(copy.deepcopy(TEST_NINE_NODE_GRAPH))
+
+    neighborhood = graph.get_neighborhood("10.69.0.1", 2)
+    assert graph.get_neighborhood("10.69.0.1", 2) is neighborhood
+    assert not neighborhood.truncated
+
+    truncated_neighborhood = graph.get_neighborhood("10.69.0.1", 2, max_nodes=2)
+    assert truncated_neighborhood.truncated
+    assert len(truncated_neighborhood.router_ids) == 2
+    assert truncated_neighborhood.router_ids < neighborhood.router_ids
+
+    # A new snapshot starts with an empty cache
+    graph.update_link_data(copy.deepcopy(TEST_FOUR_NODE_GRAPH), incremental=False)
+    assert graph.get_neighborhood("10.69.0.1", 2) != neighborhood
+
+
+def test_cost_neighborhood_matches_networkx():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(copy.deepcopy(TEST_REAL_GRAPH_SEP_2023))
+
+    for router_id in sorted(graph._graph.nodes)[::40]:
+        for max_cost in [0, 10, 50, 200]:
+            expected = nx.single_source_dijkstra_path_length(
+                graph._graph, router_id, cutoff=max_cost
+            )
+            neighborhood = graph.get_cost_neighborhood(router_id, max_cost)
+            assert neighborhood.router_ids == set(expected)
+            assert not neighborhood.truncated
+
+            max_nodes = len(expected) // 2
+            if max_nodes:
+                truncated_neighborhood = graph.get_cost_neighborhood(router_id, max_cost, max_nodes)
+                assert truncated_neighborhood.truncated
+                assert len(truncated_neighborhood.router_ids) == max_nodes
+                assert {
+                    other_id
+                    for other_id, cost in expected.items()
+                    if cost <= truncated_neighborhood.radius
+                } <= truncated_neighborhood.router_ids
+
+    # Converted to JSON just like a hop-based neighborhood
+    neighbor_set = graph.get_cost_neighborhood("10.69.1.35", 50).router_ids
+    assert graph.get_neighbors_dict("10.69.1.35", max_cost=50) == graph._convert_nodes_to_json(
+        [graph._csr.index[router_id] for router_id in neighbor_set], neighbor_set
+    )
+
+
+def test_paths_match_networkx():
+    for link_data in [TEST_NINE_NODE_GRAPH_WITH_ASYMMETRIC_COSTS, TEST_REAL_GRAPH_SEP_2023]:
+        graph = OSPFGraph(load_data=False)
+        graph.update_link_data(copy.deepcopy(link_data))
+
+        router_ids = sorted(graph._graph.nodes)
+        source = router_ids[0]
+        for destination in router_ids[::7]:
+            paths = graph.get_paths_dict(source, destination)
+            for direction, (start, end) in [
+                ("forward", (source, destination)),
+                ("reverse", (destination, source)),
+            ]:
+                path = paths[direction]["path"]
+                assert path[0] == (start, None)
+                assert path[-1][0] == end
+                assert paths[direction]["cost"] == nx.dijkstra_path_length(graph._graph, start, end)
+
+                # Every hop is a real edge, at its cheapest cost
+                for (hop_id, _), (next_hop_id, cost) in zip(path, path[1:]):
+                    assert cost == min(
+                        edge["weight"]
+                        for edge in graph.get_edges_for_node_pair(hop_id, next_hop_id)
+                    )
+
+        # Every path from (and back to) the same router came from the same two trees
+        assert len(graph.snapshot.spf_trees) == 2
@@ -0,0 +1,72 @@
+import copy
+import json
+
+import pytest
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from nycmesh_ospf_explorer.linkdb import LinkDB, StreamingLinkDBParser
+from test_graph import TEST_NINE_NODE_GRAPH, TEST_REAL_GRAPH_SEP_2023
+
+
+def to_chunks(link_data: dict, chunk_size: int, **dumps_kwargs):
+    raw_link_data = json.dumps(link_data, **dumps_kwargs).encode()
+    return [
+        raw_link_data[start : start + chunk_size]
+        for start in range(0, len(raw_link_data), chunk_size)
+    ]
+
+
+def test_streamed_link_data_matches_parsed():
+    expected = LinkDB.from_json(TEST_REAL_GRAPH_SEP_2023)
+
+    for chunk_size in [1, 7, 1000, 64 * 1024]:
+        assert LinkDB.from_chunks(to_chunks(TEST_REAL_GRAPH_SEP_2023, chunk_size)) == expected
+
+    # Whitespace between tokens, and text rather than bytes, are both fine too
+    assert LinkDB.from_chunks(to_chunks(TEST_REAL_GRAPH_SEP_2023, 4096, indent=2)) == expected
+    assert LinkDB.from_chunks([json.dumps(TEST_REAL_GRAPH_SEP_2023)]) == expected
+
+
+def test_streaming_parser_skips_everything_else():
+    link_data = copy.deepcopy(TEST_NINE_NODE_GRAPH)
+    link_data["extra"] = {"nested": [1, 2.5, {"deep": None}], "flag": True}
+    link_data["areas"]["0.0.0.1"] = {"routers": {"10.70.0.1": {"links": {}}}, "networks": {}}
+    link_data["areas"]["0.0.0.0"]["summary"] = "ünïcode ✓"
+
+    events = list(StreamingLinkDBParser(to_chunks(link_data, 3, ensure_ascii=False)).parse())
+
+    assert ("updated", "updated", link_data["updated"]) in events
+    assert [key for event, key, _ in events if event == "router"] == list(
+        link_data["areas"]["0.0.0.0"]["routers"]
+    )
+    assert [key for event, key, _ in events if event == "network"] == list(
+        link_data["areas"]["0.0.0.0"]["networks"]
+    )
+
+
+def test_streaming_parser_rejects_truncated_link_data():
+    chunks = to_chunks(TEST_NINE_NODE_GRAPH, 100)
+    with pytest.raises(ValueError):
+        LinkDB.from_chunks(chunks[:-1])
+
+    with pytest.raises(ValueError):
+        LinkDB.from_chunks(to_chunks({"areas": {}}, 100))
+
+
+def test_graph_from_streamed_link_data():
+    graph = OSPFGraph(load_data=False)
+    graph.update_link_data(TEST_NINE_NODE_GRAPH)
+
+    streamed_graph = OSPFGraph(load_data=False)
+    streamed_graph.update_link_data(LinkDB.from_chunks(to_chunks(TEST_NINE_NODE_GRAPH, 16)))
+
+    assert streamed_graph.last_updated == graph.last_updated
+    assert set(streamed_graph._graph.edges(data="weight")) == set(graph._graph.edges(data="weight"))
+    assert dict(streamed_graph._graph.nodes(data="networks")) == dict(
+        graph._graph.nodes(data="networks")
+    )
+
+    # Streamed & parsed link data compact the same way, so switching between them doesn't
+    # look like a change to the incremental update
+    egress_forest = graph._egress_forest
+    graph.update_link_data(LinkDB.from_chunks(to_chunks(TEST_NINE_NODE_GRAPH, 16)))
+    assert graph._egress_forest is egress_forest
@@ -0,0 +1,70 @@
+import datetime
+import threading
+
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from nycmesh_ospf_explorer.refresher import BackgroundRefresher
+from test_graph import TEST_FOUR_NODE_GRAPH, TEST_NINE_NODE_GRAPH
+
+
+class FakeRefreshGraph(OSPFGraph):
+    def __init__(self, link_data_to_serve):
+        super().__init__(load_data=False)
+        self.link_data_to_serve = link_data_to_serve
+        self.refreshed = threading.Event()
+
+    def update_link_data(self, json_link_data: dict = None, incremental: bool = True):
+        link_data = self.link_data_to_serve.pop(0)
+        if isinstance(link_data, Exception):
+            raise link_data
+
+        super().update_link_data(link_data, incremental)
+        if not self.link_data_to_serve:
+            self.refreshed.set()
+
+
+def test_background_refresh_publishes_new_snapshot():
+    graph = FakeRefreshGraph([TEST_FOUR_NODE_GRAPH])
+    graph.update_link_data()
+    graph.link_data_to_serve = [RuntimeError("Upstream is down"), TEST_NINE_NODE_GRAPH]
+    graph.refreshed.clear()
+
+    pinned_graph = graph.pinned()
+
+    refresher = BackgroundRefresher(graph, datetime.timedelta(milliseconds=10))
+    refresher.start()
+    try:
+        assert graph.refreshed.wait(5)
+    finally:
+        refresher.stop(timeout=5)
+
+    assert not refresher.is_running
+    assert graph.contains_router("10.69.0.9")
+
+    # Readers which pinned the old snapshot are unaffected
+    assert not pinned_graph.contains_router("10.69.0.9")
+
+
+def test_on_refresh_only_called_after_successful_refresh():
+    graph = FakeRefreshGraph([RuntimeError("Upstream is down"), TEST_FOUR_NODE_GRAPH])
+    refreshed_graphs = []
+
+    refresher = BackgroundRefresher(graph, on_refresh=refreshed_graphs.append)
+    refresher.refresh()
+    assert refreshed_graphs == []
+
+    refresher.refresh()
+    assert refreshed_graphs == [graph]
+
+
+def test_start_with_refresh_now():
+    graph = FakeRefreshGraph([TEST_FOUR_NODE_GRAPH])
+
+    # The first refresh doesn't wait for the interval
+    refresher = BackgroundRefresher(graph, datetime.timedelta(hours=1))
+    refresher.start(refresh_now=True)
+    try:
+        assert graph.refreshed.wait(5)
+    finally:
+        refresher.stop(timeout=5)
+
+    assert graph.contains_router("10.69.0.1")
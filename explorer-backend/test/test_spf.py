@@ -0,0 +1,215 @@
+import random
+
+from nycmesh_ospf_explorer.csr import CSRGraph, GraphMask, link_key
+from nycmesh_ospf_explorer.egress import EgressForest
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from nycmesh_ospf_explorer.spf import ShortestPathTree
+from test_csr import load_networkx_graph
+from test_graph import TEST_FOUR_NODE_GRAPH, TEST_REAL_GRAPH_SEP_2023
+
+
+def remove_from_graph(graph, failed_node_ids, failed_links):
+    modified_graph = graph.copy()
+    modified_graph.remove_nodes_from(failed_node_ids)
+    for router1_id, router2_id in failed_links:
+        for u, v in [(router1_id, router2_id), (router2_id, router1_id)]:
+            while modified_graph.has_edge(u, v):
+                modified_graph.remove_edge(u, v)
+
+    return modified_graph
+
+
+def random_failures(graph, csr, rnd):
+    node_ids = list(graph.nodes)
+    failed_node_ids = rnd.sample(node_ids, rnd.randint(0, 2))
+    failed_links = []
+    for _ in range(rnd.randint(0, 3)):
+        router1_id = rnd.choice(node_ids)
+        router2_id = rnd.choice(list(graph[router1_id]))
+        failed_links.append((router1_id, router2_id))
+
+    return failed_node_ids, failed_links, GraphMask.from_ids(csr, failed_node_ids, failed_links)
+
+
+def test_subtree_nodes():
+    graph = load_networkx_graph(TEST_FOUR_NODE_GRAPH)
+    csr = CSRGraph.from_networkx(graph)
+
+    tree = ShortestPathTree.compute(csr, [(csr.index["10.69.0.1"], 0)])
+
+    assert list(tree.parent) == [-1, 0, 1, 2]
+    assert list(tree.dist) == [0, 10, 110, 120]
+    assert list(tree.euler_order) == [0, 1, 2, 3]
+    assert list(tree.children(1)) == [2]
+    assert tree.subtree_nodes([1]) == [2, 3]
+    assert tree.subtree_nodes([1], include_roots=True) == [1, 2, 3]
+    assert tree.subtree_nodes([2, 1, 3]) == [2, 3]
+
+
+def test_without_matches_recompute():
+    graph = load_networkx_graph(TEST_REAL_GRAPH_SEP_2023)
+    csr = CSRGraph.from_networkx(graph)
+    rnd = random.Random(1)
+
+    for source_id in list(graph.nodes)[::60]:
+        tree = ShortestPathTree.compute(csr, [(csr.index[source_id], 0)])
+
+        for _ in range(5):
+            failed_node_ids, failed_links, mask = random_failures(graph, csr, rnd)
+            if source_id in failed_node_ids:
+                continue
+
+            repaired_tree = tree.without(csr, mask)
+
+            modified_graph = remove_from_graph(graph, failed_node_ids, failed_links)
+            modified_csr = CSRGraph.from_networkx(modified_graph)
+            expected_tree = ShortestPathTree.compute(
+                modified_csr, [(modified_csr.index[source_id], 0)]
+            )
+
+            for node_id in graph.nodes:
+                node = csr.index[node_id]
+                if node_id in failed_node_ids:
+                    assert repaired_tree.dist[node] == -1
+                    continue
+
+                assert repaired_tree.dist[node] == expected_tree.dist[modified_csr.index[node_id]]
+
+                # Any equal cost parent is fine, but it must actually be a shortest path
+                parent = repaired_tree.parent[node]
+                if parent != -1:
+                    parent_id = csr.node_ids[parent]
+                    assert modified_graph.has_edge(parent_id, node_id)
+                    assert repaired_tree.dist[node] == repaired_tree.dist[parent] + min(
+                        edge["weight"] for edge in modified_graph[parent_id][node_id].values()
+                    )
+
+
+def test_egress_forest_without_matches_recompute():
+    graph = load_networkx_graph(TEST_REAL_GRAPH_SEP_2023)
+    csr = CSRGraph.from_networkx(graph)
+    egress_forest = OSPFGraph._build_egress_forest(graph, csr)
+    rnd = random.Random(2)
+
+    for _ in range(20):
+        failed_node_ids, failed_links, mask = random_failures(graph, csr, rnd)
+        repaired_forest = egress_forest.without(csr, mask)
+        expected_forest = OSPFGraph._build_egress_forest(
+            remove_from_graph(graph, failed_node_ids, failed_links)
+        )
+
+        for node_id in graph.nodes:
+            assert (node_id in repaired_forest) == (node_id in expected_forest)
+            assert repaired_forest.get_exit_cost(node_id) == expected_forest.get_exit_cost(node_id)
+
+            exit_path = repaired_forest.get_exit_path(node_id)
+            expected_exit_path = expected_forest.get_exit_path(node_id)
+            if exit_path is not None:
+                assert sum(cost for _, cost in exit_path[1:]) == sum(
+                    cost for _, cost in expected_exit_path[1:]
+                )
+                assert repaired_forest.get_exit_node(node_id) == exit_path[-2][0]
+                assert repaired_forest.depth[csr.index[node_id]] == len(exit_path) - 2
+
+
+def test_egress_forest_without_exit():
+    graph = load_networkx_graph(TEST_FOUR_NODE_GRAPH)
+    csr = CSRGraph.from_networkx(graph)
+    egress_forest = EgressForest.compute(csr, OSPFGraph._get_exit_costs(graph, csr))
+
+    repaired_forest = egress_forest.without(csr, GraphMask({csr.index["10.69.0.2"]}))
+
+    # Everything that can still get out switches over to the (much more expensive) other exit
+    assert list(repaired_forest.dist) == [-1, -1, 10010, 10000]
+    assert list(repaired_forest.parent) == [-1, -1, 3, -1]
+    assert list(repaired_forest.exit_node) == [-1, -1, 3, 3]
+    assert list(repaired_forest.depth) == [-1, -1, 1, 0]
+    assert repaired_forest.mask.excluded_nodes == {1}
+
+
+def raise_edges(graph, rnd):
+    """A copy of graph with a few random edges made more expensive or dropped"""
+    modified_graph = graph.copy()
+    raised_edges = []
+    for _ in range(rnd.randint(1, 4)):
+        node_id, other_node_id, key = rnd.choice(list(modified_graph.edges(keys=True)))
+        if rnd.random() < 0.7:
+            modified_graph[node_id][other_node_id][key]["weight"] += rnd.randint(1, 200)
+        else:
+            modified_graph.remove_edge(node_id, other_node_id, key)
+        raised_edges.append((node_id, other_node_id))
+
+    return modified_graph, raised_edges
+
+
+def test_with_raised_edges_matches_recompute():
+    graph = load_networkx_graph(TEST_REAL_GRAPH_SEP_2023)
+    csr = CSRGraph.from_networkx(graph)
+    egress_forest = OSPFGraph._build_egress_forest(graph, csr)
+    rnd = random.Random(3)
+
+    for source_id in list(graph.nodes)[::120]:
+        tree = ShortestPathTree.compute(csr, [(csr.index[source_id], 0)])
+
+        for _ in range(5):
+            modified_graph, raised_edges = raise_edges(graph, rnd)
+            modified_csr = CSRGraph.from_networkx(modified_graph)
+            edges = [(csr.index[edge[0]], csr.index[edge[1]]) for edge in raised_edges]
+
+            repaired_tree = tree.with_raised_edges(modified_csr, edges)
+            expected_tree = ShortestPathTree.compute(
+                modified_csr, [(modified_csr.index[source_id], 0)]
+            )
+            assert list(repaired_tree.dist) == list(expected_tree.dist)
+
+            repaired_forest = egress_forest.with_raised_edges(modified_csr, edges)
+            expected_forest = OSPFGraph._build_egress_forest(modified_graph, modified_csr)
+            assert list(repaired_forest.dist) == list(expected_forest.dist)
+            for node_id in graph.nodes:
+                exit_path = repaired_forest.get_exit_path(node_id)
+                if exit_path is not None:
+                    assert repaired_forest.get_exit_node(node_id) == exit_path[-2][0]
+                    assert repaired_forest.depth[csr.index[node_id]] == len(exit_path) - 2
+
+
+def test_compute_with_mask_matches_without():
+    graph = load_networkx_graph(TEST_REAL_GRAPH_SEP_2023)
+    csr = CSRGraph.from_networkx(graph)
+    rnd = random.Random(3)
+
+    for source_id in list(graph.nodes)[::90]:
+        tree = ShortestPathTree.compute(csr, [(csr.index[source_id], 0)])
+
+        for _ in range(5):
+            _, _, mask = random_failures(graph, csr, rnd)
+            masked_tree = ShortestPathTree.compute(csr, [(csr.index[source_id], 0)], mask)
+            repaired_tree = tree.without(csr, mask)
+
+            assert list(masked_tree.dist) == list(repaired_tree.dist)
+            assert masked_tree.mask.excluded_nodes == repaired_tree.mask.excluded_nodes
+            assert masked_tree.mask.excluded_links == repaired_tree.mask.excluded_links
+
+
+def test_graph_mask():
+    graph = load_networkx_graph(TEST_FOUR_NODE_GRAPH)
+    csr = CSRGraph.from_networkx(graph)
+
+    mask = GraphMask.from_ids(csr, ["10.69.0.1"], [("10.70.0.4", "10.69.0.3")])
+    assert mask
+    assert not GraphMask()
+    assert mask.excluded_links == {link_key(2, 3)}
+    assert mask.excludes_node(0)
+    assert mask.excludes_edge(1, 0)
+    assert mask.excludes_edge(2, 3) and mask.excludes_edge(3, 2)
+    assert not mask.excludes_edge(1, 2)
+
+    combined_mask = mask | GraphMask({1})
+    assert combined_mask.excluded_nodes == {0, 1}
+    assert combined_mask.excluded_links == mask.excluded_links
+
+    assert list(csr.out_edges(2, mask)) == [(1, 100)]
+    assert csr.bfs(0, 3, mask) == []
+    assert csr.bfs(1, 3, mask) == [1, 2]
+
+    dist, _, _ = csr.dijkstra([(3, 0)], mask=mask)
+    assert dist == [None, None, None, 0]
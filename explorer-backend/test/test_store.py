@@ -0,0 +1,196 @@
+import copy
+import dataclasses
+import datetime
+import os
+
+from nycmesh_ospf_explorer.graph import OSPFGraph
+from nycmesh_ospf_explorer import store as store_module
+from nycmesh_ospf_explorer.store import SnapshotStore
+from test_graph import TEST_FOUR_NODE_GRAPH, TEST_NINE_NODE_GRAPH, TEST_REAL_GRAPH_SEP_2023
+
+
+def build_snapshot(link_data: dict, updated: int = None):
+    link_data = copy.deepcopy(link_data)
+    if updated is not None:
+        link_data["updated"] = updated
+    return OSPFGraph._build_snapshot(link_data)
+
+
+def snapshot_updated(snapshot) -> int:
+    return int(snapshot.last_updated.timestamp())
+
+
+def test_stored_snapshot_matches_built(tmp_path):
+    store = SnapshotStore(str(tmp_path), 64 * 1024 * 1024)
+    snapshot = build_snapshot(TEST_REAL_GRAPH_SEP_2023)
+    assert store.put(snapshot)
+
+    stored_snapshot = store.get(snapshot.last_updated)
+    assert stored_snapshot.last_updated == snapshot.last_updated
+    assert stored_snapshot.content_digest == snapshot.content_digest
+    assert stored_snapshot.routers == snapshot.routers
+
+    graph = OSPFGraph(load_data=False, snapshot=snapshot)
+    stored_graph = OSPFGraph(load_data=False, snapshot=stored_snapshot)
+    for router_id in sorted(graph._graph.nodes)[:100]:
+        assert stored_graph.get_outage_lists([router_id], []) == graph.get_outage_lists(
+            [router_id], []
+        )
+        assert stored_graph.get_exit_path_for_node(router_id) == graph.get_exit_path_for_node(
+            router_id
+        )
+
+    # Nothing stored for other minutes
+    assert store.get(snapshot.last_updated + datetime.timedelta(minutes=1)) is None
+
+
+def test_unchanged_link_data_is_stored_once(tmp_path):
+    store = SnapshotStore(str(tmp_path), 64 * 1024 * 1024)
+    snapshot = build_snapshot(TEST_NINE_NODE_GRAPH)
+    republished_snapshot = build_snapshot(TEST_NINE_NODE_GRAPH, snapshot_updated(snapshot) + 600)
+
+    store.put(snapshot)
+    size_bytes = store.get_size_bytes()
+    store.put(republished_snapshot)
+
+    assert len(os.listdir(tmp_path / "objects")) == 1
+    assert store.get_size_bytes() == size_bytes
+    assert store.get(snapshot.last_updated).last_updated == snapshot.last_updated
+    assert (
+        store.get(republished_snapshot.last_updated).last_updated
+        == republished_snapshot.last_updated
+    )
+
+
+def test_index_is_pruned_to_retention(tmp_path):
+    store = SnapshotStore(str(tmp_path), 64 * 1024 * 1024, datetime.timedelta(hours=1))
+    snapshot = build_snapshot(TEST_FOUR_NODE_GRAPH)
+    first_updated = snapshot_updated(snapshot)
+    store.put(snapshot)
+
+    # Ten hours of the same link data re-published every minute
+    republished_snapshot = build_snapshot(TEST_NINE_NODE_GRAPH)
+    for minute in range(1, 601):
+        store.put(
+            dataclasses.replace(
+                republished_snapshot,
+                last_updated=datetime.datetime.fromtimestamp(first_updated + minute * 60),
+            )
+        )
+
+    # The last hour, the newest entry before it, and the only entry for the first snapshot
+    assert len(os.listdir(tmp_path / "index")) == 61 + 1 + 1
+    newest_updated = first_updated + 600 * 60
+    assert store.get_latest().last_updated == datetime.datetime.fromtimestamp(newest_updated)
+    assert store.get(datetime.datetime.fromtimestamp(newest_updated - 3600)) is not None
+    assert store.get(datetime.datetime.fromtimestamp(newest_updated - 7200)) is None
+    assert store.get(snapshot.last_updated).content_digest == snapshot.content_digest
+
+
+def test_least_recently_used_snapshots_are_evicted(tmp_path):
+    snapshots = [
+        build_snapshot(TEST_NINE_NODE_GRAPH, 1695999960),
+        build_snapshot(TEST_FOUR_NODE_GRAPH, 1696000560),
+    ]
+
+    store = SnapshotStore(str(tmp_path / "sizing"), 64 * 1024 * 1024)
+    for snapshot in snapshots:
+        store.put(snapshot)
+    max_size_bytes = store.get_size_bytes() - 1
+
+    # Only room for one of them, so storing the second evicts the first, and its index entry
+    store = SnapshotStore(str(tmp_path / "store"), max_size_bytes)
+    for snapshot in snapshots:
+        store.put(snapshot)
+
+    assert store.get(snapshots[0].last_updated) is None
+    assert store.get(snapshots[1].last_updated) is not None
+    assert os.listdir(tmp_path / "store" / "index") == [str(snapshot_updated(snapshots[1]))]
+
+
+def test_corrupt_snapshot_is_discarded(tmp_path):
+    store = SnapshotStore(str(tmp_path), 64 * 1024 * 1024)
+    snapshot = build_snapshot(TEST_NINE_NODE_GRAPH)
+    store.put(snapshot)
+
+    object_path = tmp_path / "objects" / (snapshot.content_digest.hex() + ".snap")
+    object_path.write_bytes(object_path.read_bytes()[:-10])
+
+    assert store.get(snapshot.last_updated) is None
+    assert not object_path.exists()
+
+    # And it's written again the next time we load that link data
+    store.put(snapshot)
+    assert store.get(snapshot.last_updated) is not None
+
+
+def test_snapshot_with_other_fields_is_discarded(tmp_path, monkeypatch):
+    store = SnapshotStore(str(tmp_path), 64 * 1024 * 1024)
+    snapshot = build_snapshot(TEST_NINE_NODE_GRAPH)
+    object_path = tmp_path / "objects" / (snapshot.content_digest.hex() + ".snap")
+
+    # As if it was written before the neighborhoods field was added
+    object.__delattr__(snapshot, "neighborhoods")
+    with monkeypatch.context() as patch:
+        patch.setattr(store_module, "_get_schema_digest", lambda: b"\0" * 8)
+        store.put(snapshot)
+
+    assert not OSPFGraph(load_data=False, store=store).load_latest_from_store()
+    assert not object_path.exists()
+
+    # Even if its header claims otherwise
+    store.put(snapshot)
+    assert store.get(snapshot.last_updated) is None
+    assert not object_path.exists()
+
+
+def test_history_graph_is_loaded_from_store(tmp_path, monkeypatch):
+    store = SnapshotStore(str(tmp_path), 64 * 1024 * 1024)
+    timestamp = datetime.datetime.fromtimestamp(1695999960)
+
+    fetched_urls = []
+
+    def fetch(url):
+        fetched_urls.append(url)
+        return copy.deepcopy(TEST_NINE_NODE_GRAPH)
+
+    monkeypatch.setattr(OSPFGraph, "_fetch_link_data", staticmethod(fetch))
+
+    history_graph = OSPFGraph(load_data=False, store=store)
+    history_graph.update_from_timestamp(timestamp)
+    assert len(fetched_urls) == 1
+
+    stored_graph = OSPFGraph(load_data=False, store=store)
+    stored_graph.update_from_timestamp(timestamp + datetime.timedelta(seconds=30))
+    assert len(fetched_urls) == 1
+    assert stored_graph.last_updated == history_graph.last_updated
+    assert stored_graph.get_outage_lists(["10.69.0.2"], []) == history_graph.get_outage_lists(
+        ["10.69.0.2"], []
+    )
+
+
+def test_warm_start_from_latest_snapshot(tmp_path, monkeypatch):
+    store = SnapshotStore(str(tmp_path), 64 * 1024 * 1024)
+    assert store.get_latest() is None
+    assert not OSPFGraph(load_data=False, store=store).load_latest_from_store()
+
+    old_snapshot = build_snapshot(TEST_FOUR_NODE_GRAPH, 1695999960)
+    latest_snapshot = build_snapshot(TEST_NINE_NODE_GRAPH, 1696000560)
+    store.put(latest_snapshot)
+    store.put(old_snapshot)
+    assert store.get_latest().last_updated == latest_snapshot.last_updated
+
+    monkeypatch.setattr(
+        OSPFGraph, "_fetch_link_data", staticmethod(lambda url: copy.deepcopy(TEST_NINE_NODE_GRAPH))
+    )
+
+    graph = OSPFGraph(load_data=False, store=store)
+    assert graph.load_latest_from_store()
+    assert graph.contains_router("10.69.0.9")
+    assert graph.is_stale
+    assert graph.last_checked is None
+
+    # Served as stale until the API confirms it
+    graph.update_link_data()
+    assert not graph.is_stale
+    assert graph.last_checked is not None